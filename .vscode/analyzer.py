@@ -1,13 +1,18 @@
 
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import base64
+import binascii
 import json
 import os
 import importlib
+import time
+from collections import OrderedDict
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 except Exception:
-    OpenAI = None
+    AsyncOpenAI = None
 
 # Resolve config dynamically to keep editors happy and runtime robust
 OPENAI_API_KEY = None
@@ -20,6 +25,14 @@ try:
 except Exception:
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Live-frames: bildedetalj hos modellen, JPEG-kvalitet og grenser
+LIVE_FRAME_DETAIL = os.getenv("LIVE_FRAME_DETAIL", "high")  # low | high
+LIVE_FRAME_JPEG_QUALITY = int(os.getenv("LIVE_FRAME_JPEG_QUALITY", "80"))
+LIVE_MAX_CONCURRENCY = int(os.getenv("LIVE_MAX_CONCURRENCY", "4"))
+LIVE_DHASH_THRESHOLD = int(os.getenv("LIVE_DHASH_THRESHOLD", "4"))  # maks ulike bit av 64
+LIVE_CACHE_SIZE = int(os.getenv("LIVE_CACHE_SIZE", "256"))
+LIVE_CACHE_TTL_S = float(os.getenv("LIVE_CACHE_TTL_S", "30"))
+
 _client: Any = None
 
 def _get_client():
@@ -27,64 +40,205 @@ def _get_client():
     # Lazy init and tolerate missing deps/keys so import doesn't fail
     if _client is not None:
         return _client
-    if OpenAI is None:
+    if AsyncOpenAI is None:
         return None
     api_key = OPENAI_API_KEY
     if not api_key:
         return None
     try:
-        _client = OpenAI(api_key=api_key)
+        _client = AsyncOpenAI(api_key=api_key)
         return _client
     except Exception:
         return None
 
 
-# 2) Hjelpefunksjon: analyser ett live-frame (base64 JPG fra kamera)
-async def analyze_live_frame(frame_base64: str) -> Dict[str, Any]:
+# 1) Forbehandling: skaler ned til oppløsningen modellen faktisk bruker
+
+def model_input_size(width: int, height: int, detail: str = LIVE_FRAME_DETAIL) -> Tuple[int, int]:
     """
-    Tar inn et base64-kodet JPG-bilde og returnerer en enkel CoatVision-vurdering.
+    Størrelsen bildet uansett skaleres til hos modellen:
+    low = innenfor 512x512, high = innenfor 2048x2048 og korteste side maks 768.
+    Større opplasting gir bare mer data å sende, ikke bedre analyse.
+    """
+    if detail == "low":
+        scale = min(1.0, 512 / max(width, height))
+    else:
+        scale = min(1.0, 2048 / max(width, height))
+        shortest = min(width, height) * scale
+        if shortest > 768:
+            scale *= 768 / shortest
+    return max(1, round(width * scale)), max(1, round(height * scale))
 
-    Denne funksjonen er "hjernen" som kalles fra /api/analyze/live.
+
+def dhash(gray) -> int:
+    """64-bit differanse-hash (9x8 gråtone, nabo-sammenligning per rad)."""
+    import cv2
+
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def preprocess_frame(frame_base64: str, detail: str = LIVE_FRAME_DETAIL) -> Dict[str, Any]:
     """
+    base64 JPEG -> nedskalert, re-kodet JPEG (base64) + dHash.
+    Returnerer også størrelser slik at besparelsen kan måles.
+    """
+    import cv2
+    import numpy as np
 
-    system_prompt = (
-        "Du er en ekspert på bilpleie, lakkkorrigering og keramisk coating. "
-        "Du får ett bilde av et panel på en bil. "
-        "Analyser det og vurder:\n"
-        "- generelt inntrykk av lakken\n"
-        "- om coating-dekning ser jevn ut eller ujevn\n"
-        "- om du ser typiske feil (high spots, hologrammer, tørkestriper, osv.)\n"
-        "Svar som ren JSON uten forklarende tekst."
-        "Nøkler: overall_condition, coating_coverage, defects, recommendation."
-    )
+    if "," in frame_base64[:100]:
+        frame_base64 = frame_base64.split(",", 1)[1]  # data:image/jpeg;base64,...
+    try:
+        raw = base64.b64decode(frame_base64, validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 frame: {e}")
 
-    client = _get_client()
-    if client is None:
-        # Fallback result when OpenAI is not configured/available
-        return {
-            "overall_condition": "unknown",
-            "coating_coverage": "unknown",
-            "defects": [],
-            "recommendation": "OpenAI not configured. Set OPENAI_API_KEY to enable AI analysis.",
-        }
+    image = None
+    try:
+        # Redusert JPEG-dekoding (DCT-skalering) når målet er mye mindre enn kilden
+        from backend.app.core.coatvision_core import decode_image_bytes, read_image_size
 
-    response = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Analyser dette panelet basert på bildet:"},
-                    {
-                        "type": "input_image",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{frame_base64}",
-                        },
+        # målet er størrelsen modellen bruker (f.eks. 1024x768 for et 4032x3024-bilde), ikke boksen på 2048
+        size = read_image_size(raw)
+        target = max(model_input_size(*size, detail)) if size else (512 if detail == "low" else 2048)
+        image = decode_image_bytes(raw, target_max_side=target)
+    except ImportError:
+        image = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode frame")
+
+    height, width = image.shape[:2]
+    target_w, target_h = model_input_size(width, height, detail)
+    if (target_w, target_h) != (width, height):
+        image = cv2.resize(image, (target_w, target_h), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, LIVE_FRAME_JPEG_QUALITY])
+    if not ok:
+        raise ValueError("Could not encode frame")
+
+    return {
+        "jpeg_base64": base64.b64encode(encoded.tobytes()).decode("ascii"),
+        "hash": dhash(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)),
+        "size": (target_w, target_h),
+        "bytes_in": len(raw),
+        "bytes_out": int(encoded.size),
+    }
+
+
+class FrameCache:
+    """Nylige resultater slått opp på dHash med Hamming-avstand (nesten-like frames)."""
+
+    def __init__(self, maxsize: int = LIVE_CACHE_SIZE, ttl: float = LIVE_CACHE_TTL_S,
+                 threshold: int = LIVE_DHASH_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def get(self, frame_hash: int) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        best, best_distance = None, self.threshold + 1
+        for key, (expires, result) in list(self._entries.items()):
+            if expires < now:
+                del self._entries[key]
+                continue
+            distance = bin(key ^ frame_hash).count("1")
+            if distance < best_distance:
+                best, best_distance = key, distance
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best][1]
+
+    def set(self, frame_hash: int, result: Dict[str, Any]) -> None:
+        self._entries[frame_hash] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(frame_hash)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+_frame_cache = FrameCache()
+_latest_frame: Dict[str, int] = {}  # klient -> sekvensnummer for nyeste frame
+_frame_seq = 0
+_semaphore: Optional[asyncio.Semaphore] = None
+_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+_client_locks: Dict[str, asyncio.Lock] = {}  # maks ett upstream-kall per klient
+_stats = {"frames": 0, "cache_hits": 0, "superseded": 0, "upstream_calls": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore, _semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _semaphore is None or _semaphore_loop is not loop:
+        # Semaforer/låser hører til én event-loop
+        _semaphore, _semaphore_loop = asyncio.Semaphore(LIVE_MAX_CONCURRENCY), loop
+        _client_locks.clear()
+    return _semaphore
+
+
+async def _upstream(client, frame: Dict[str, Any]) -> Dict[str, Any]:
+    async with _get_semaphore():
+        # En lik frame kan ha blitt ferdig mens vi ventet
+        cached = _frame_cache.get(frame["hash"])
+        if cached is not None:
+            _stats["cache_hits"] += 1
+            return {**cached, "cached": True}
+        _stats["upstream_calls"] += 1
+        _stats["bytes_out"] += frame["bytes_out"]
+        result = await _ask_model(client, frame)
+    _frame_cache.set(frame["hash"], result)
+    return result
+
+
+def live_stats() -> Dict[str, Any]:
+    return dict(_stats, cache_entries=len(_frame_cache._entries))
+
+
+SYSTEM_PROMPT = (
+    "Du er en ekspert på bilpleie, lakkkorrigering og keramisk coating. "
+    "Du får ett bilde av et panel på en bil. "
+    "Analyser det og vurder:\n"
+    "- generelt inntrykk av lakken\n"
+    "- om coating-dekning ser jevn ut eller ujevn\n"
+    "- om du ser typiske feil (high spots, hologrammer, tørkestriper, osv.)\n"
+    "Svar som ren JSON uten forklarende tekst."
+    "Nøkler: overall_condition, coating_coverage, defects, recommendation."
+)
+
+
+def _unknown(recommendation: str, **extra) -> Dict[str, Any]:
+    return {
+        "overall_condition": "unknown",
+        "coating_coverage": "unknown",
+        "defects": [],
+        "recommendation": recommendation,
+        **extra,
+    }
+
+
+async def _ask_model(client, frame: Dict[str, Any]) -> Dict[str, Any]:
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "Analyser dette panelet basert på bildet:"},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{frame['jpeg_base64']}",
+                        "detail": LIVE_FRAME_DETAIL,
                     },
-                ],
-            },
-        ],
+                },
+            ],
+        },
+    ]
+    response = await client.chat.completions.create(
+        model=OPENAI_MODEL,
+        messages=messages,
         response_format={"type": "json_object"},
     )
 
@@ -100,5 +254,52 @@ async def analyze_live_frame(frame_base64: str) -> Dict[str, Any]:
             "defects": [],
             "recommendation": content,
         }
-
     return result
+
+
+# 2) Hjelpefunksjon: analyser ett live-frame (base64 JPG fra kamera)
+async def analyze_live_frame(frame_base64: str, client_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Tar inn et base64-kodet JPG-bilde og returnerer en enkel CoatVision-vurdering.
+
+    Denne funksjonen er "hjernen" som kalles fra /api/analyze/live.
+    Framen skaleres ned før opplasting, nesten-like frames besvares fra cache,
+    og hver `client_id` har maks ett kall ute om gangen der nyeste frame vinner:
+    eldre frames som fortsatt venter droppes med status "superseded".
+    """
+    global _frame_seq
+
+    client = _get_client()
+    if client is None:
+        # Fallback result when OpenAI is not configured/available
+        return _unknown("OpenAI not configured. Set OPENAI_API_KEY to enable AI analysis.")
+
+    # Dekoding/skalering er CPU-arbeid; hold event-loopen fri
+    frame = await asyncio.to_thread(preprocess_frame, frame_base64)
+    _stats["frames"] += 1
+    _stats["bytes_in"] += frame["bytes_in"]
+
+    cached = _frame_cache.get(frame["hash"])
+    if cached is not None:
+        _stats["cache_hits"] += 1
+        return {**cached, "cached": True}
+
+    if not client_id:
+        return await _upstream(client, frame)
+
+    _frame_seq += 1
+    seq = _frame_seq
+    _latest_frame[client_id] = seq
+    _get_semaphore()
+    lock = _client_locks.setdefault(client_id, asyncio.Lock())
+    try:
+        async with lock:
+            if _latest_frame.get(client_id) != seq:
+                _stats["superseded"] += 1
+                return _unknown("Nyere frame fra samme klient er under analyse.", status="superseded")
+            return await _upstream(client, frame)
+    finally:
+        if _latest_frame.get(client_id) == seq:
+            del _latest_frame[client_id]
+            if not lock.locked():
+                _client_locks.pop(client_id, None)
@@ -1,5 +1,5 @@
 import os
-from fastapi import Response, FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
 import importlib
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
@@ -93,6 +93,31 @@ _include_optional_router("backend.app.routers.config", attr_name="router")
 _include_optional_router("backend.app.routers.diagnostics")
 _include_optional_router("backend.app.routers.config_model")
 
+@app.post("/api/analyze/live")
+async def analyze_live(payload: dict, request: Request):
+    """
+    Live-frame fra kameraet: {"frameBase64": "...", "clientId": "..."}.
+    Med `clientId` (eller X-Client-Id) vinner nyeste frame per klient.
+    """
+    from .analyzer import analyze_live_frame
+
+    frame = payload.get("frameBase64") or (payload.get("frame") or {}).get("frameBase64")
+    if not frame:
+        raise HTTPException(status_code=400, detail="Missing frameBase64")
+    client_id = payload.get("clientId") or payload.get("sessionId") or request.headers.get("X-Client-Id")
+    try:
+        return await analyze_live_frame(frame, client_id=client_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/api/analyze/live/stats")
+def analyze_live_stats():
+    from .analyzer import live_stats
+
+    return live_stats()
+
+
 # Serve statiske analyse-resultater (overlays) fra outputs/
 try:
     try:
@@ -1,7 +1,7 @@
 # backend/app/core/coatvision_core.py
 import base64
 import os
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -10,11 +10,94 @@ import numpy as np
 MAX_HUE_STD_DEVIATION = 90
 MAX_LAPLACIAN_VARIANCE = 5000
 
+# Longest side (px) the analysis needs. JPEGs at least 2x larger are decoded
+# with DCT-domain downscaling (IMREAD_REDUCED_COLOR_2/4/8). 0 = always full size.
+ANALYSIS_MAX_SIDE = int(os.getenv("COATVISION_ANALYSIS_MAX_SIDE", "1280"))
 
-def decode_base64_image(base64_str: str) -> np.ndarray:
+# Defektlokalisering (analyze_coating(..., defects=True)): kanter/Laplace-topper
+# summeres i celler på DEFECT_CELL px, og celler med høy tetthet slås sammen
+# til regioner med connectedComponentsWithStats.
+DEFECT_CELL = int(os.getenv("COATVISION_DEFECT_CELL", "8"))
+DEFECT_LAPLACIAN_THRESHOLD = int(os.getenv("COATVISION_DEFECT_LAPLACIAN", "40"))
+DEFECT_MIN_DENSITY = float(os.getenv("COATVISION_DEFECT_MIN_DENSITY", "0.2"))  # andel defektpiksler i en celle
+DEFECT_MIN_CELLS = int(os.getenv("COATVISION_DEFECT_MIN_CELLS", "2"))
+DEFECT_TOP_K = int(os.getenv("COATVISION_DEFECT_TOP_K", "10"))
+DEFECT_STREAK_ELONGATION = 4.0
+
+_REDUCED_COLOR_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+# SOFn markers carrying frame dimensions (DHT/JPG/DAC excluded)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def is_jpeg(data: bytes) -> bool:
+    return data[:2] == b"\xff\xd8"
+
+
+def read_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Return (width, height) from a JPEG or PNG header without decoding pixels."""
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if not is_jpeg(data):
+        return None
+
+    pos = 2
+    size = len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # standalone markers
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):  # EOI / SOS before any SOF
+            return None
+        seg_len = int.from_bytes(data[pos + 2:pos + 4], "big")
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > size:
+                return None
+            height = int.from_bytes(data[pos + 5:pos + 7], "big")
+            width = int.from_bytes(data[pos + 7:pos + 9], "big")
+            return width, height
+        pos += 2 + seg_len
+    return None
+
+
+def reduced_decode_flag(size: Optional[Tuple[int, int]], target_max_side: int) -> int:
+    """Pick the strongest IMREAD_REDUCED_COLOR_* that keeps the longest side >= target."""
+    if not size or target_max_side <= 0:
+        return cv2.IMREAD_COLOR
+    longest = max(size)
+    for factor, flag in _REDUCED_COLOR_FLAGS:
+        if longest // factor >= target_max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image_bytes(data: bytes, target_max_side: Optional[int] = None) -> Optional[np.ndarray]:
+    """Decode an encoded image, using reduced-resolution JPEG decoding when possible.
+
+    Returns None if the data cannot be decoded (same contract as cv2.imdecode).
+    """
+    if target_max_side is None:
+        target_max_side = ANALYSIS_MAX_SIDE
+    flag = cv2.IMREAD_COLOR
+    # Kun JPEG har rask DCT-skalering; for andre formater ville REDUCED bare
+    # bety full dekoding + resize.
+    if is_jpeg(data):
+        flag = reduced_decode_flag(read_image_size(data), target_max_side)
+    return cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+
+
+def decode_base64_image(base64_str: str, target_max_side: Optional[int] = None) -> np.ndarray:
     img_data = base64.b64decode(base64_str)
-    nparr = np.frombuffer(img_data, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    img = decode_image_bytes(img_data, target_max_side)
     if img is None:
         raise ValueError("Decoded image is None. The input may not be a valid base64-encoded image.")
     return img
@@ -25,33 +108,122 @@ def encode_image_base64(img: np.ndarray) -> str:
     return base64.b64encode(buffer.tobytes()).decode('utf-8')
 
 
-def analyze_coating(image: np.ndarray) -> Dict:
+def find_defects(edges: np.ndarray, laplacian: np.ndarray, top_k: int = DEFECT_TOP_K,
+                 cell: int = DEFECT_CELL, mask: Optional[np.ndarray] = None) -> List[Dict]:
+    """Regioner med tette kanter/Laplace-topper (høye flekker, hologrammer, striper).
+
+    Gjenbruker kart analysen allerede har regnet ut. Tettheten samles i celler
+    med INTER_AREA (én SIMD-pass), så komponentanalysen kjøres på et kart som er
+    `cell`² ganger mindre enn bildet. Returnerer de `top_k` største (areal x
+    tetthet), med bokser i bildets piksler og alvorlighet 0-100. `mask` (ROI)
+    fjerner alt utenfor før tettheten regnes ut.
+    """
+    height, width = edges.shape
+    # kantpiksler er 255, så max + én terskel = |Laplace| > T eller kant, uten en ekstra OR-pass
+    strength = cv2.max(cv2.convertScaleAbs(laplacian), edges)
+    if mask is not None:
+        strength = cv2.bitwise_and(strength, mask)
+    _, hits = cv2.threshold(strength, DEFECT_LAPLACIAN_THRESHOLD, 255, cv2.THRESH_BINARY)
+    grid = (max(1, width // cell), max(1, height // cell))
+    density = cv2.resize(hits, grid, interpolation=cv2.INTER_AREA)  # 0-255 = andel defektpiksler
+    hot = (density >= DEFECT_MIN_DENSITY * 255).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(hot, connectivity=8)
+    if count <= 1:
+        return []
+
+    # tetthet summert per komponent i én vektorisert pass (etikett 0 = bakgrunn)
+    mass = np.bincount(labels.ravel(), weights=density.ravel(), minlength=count)[1:] / 255.0
+    cells = stats[1:, cv2.CC_STAT_AREA]
+    keep = np.flatnonzero(cells >= DEFECT_MIN_CELLS)
+    order = keep[np.argsort(-mass[keep], kind="stable")][:top_k]
+
+    sx, sy = width / grid[0], height / grid[1]
+    regions = []
+    for i in order:
+        x, y, w, h = stats[i + 1, :4]
+        elongation = max(w, h) / max(1, min(w, h))
+        regions.append({
+            "x": int(x * sx), "y": int(y * sy), "w": int(round(w * sx)), "h": int(round(h * sy)),
+            "area": round(float(cells[i]) * sx * sy / (width * height) * 100, 3),  # % av bildet
+            "severity": round(float(mass[i] / cells[i]) * 100, 1),  # gjennomsnittlig tetthet
+            "shape": "streak" if elongation >= DEFECT_STREAK_ELONGATION else "spot",
+        })
+    return regions
+
+
+def _otsu_coverage(hist: np.ndarray) -> float:
+    """Andel piksler over Otsu-terskelen, regnet fra et (maskert) 256-bins histogram."""
+    total = hist.sum()
+    w0 = np.cumsum(hist)
+    w1 = total - w0
+    m0 = np.cumsum(hist * np.arange(256))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        between = w0 * w1 * (m0 / w0 - (m0[-1] - m0) / w1) ** 2
+    threshold = int(np.argmax(np.nan_to_num(between)))  # samme som THRESH_OTSU: > terskel er forgrunn
+    return float(hist[threshold + 1:].sum() / total)
+
+
+def analyze_coating(image: np.ndarray, calibration=None, defects: bool = False,
+                    top_k: int = DEFECT_TOP_K, roi=None) -> Dict:
+    """`calibration` er en enhetsprofil med `.apply(image)` (se services.color_calibration).
+
+    `defects=True` legger til `defects`: de `top_k` mest markerte defektregionene.
+    `roi` (se services.roi) begrenser analysen til panelet: bildet beskjæres til
+    ROI-ens bounding box først, og med polygon/maske regnes statistikken bare
+    over pikslene innenfor, så arbeidet følger panelets areal, ikke bildets.
+    """
     if image is None:
         raise ValueError("Image could not be loaded")
 
+    region = None
+    if roi is not None:
+        region = roi.region(image.shape)
+        image = image[region.y:region.y + region.h, region.x:region.x + region.w]
+
+    if calibration is not None:
+        image = calibration.apply(image)
+
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
     edges = cv2.Canny(gray, 50, 150)
-    edge_density = float(np.count_nonzero(edges) / edges.size)
+    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+    mask = region.mask if region is not None else None
+    inner = None
 
-    hue_channel = hsv[:, :, 0].astype(np.float32)
-    hue_std = float(np.std(hue_channel))
-    color_uniformity = max(0, 1 - (hue_std / MAX_HUE_STD_DEVIATION))
+    if mask is None:
+        edge_density = float(np.count_nonzero(edges) / edges.size)
 
-    saturation = hsv[:, :, 1]
-    mean_saturation = float(np.mean(saturation.astype(np.float32)))
-    saturation_score = mean_saturation / 255.0
+        hue_channel = hsv[:, :, 0].astype(np.float32)
+        hue_std = float(np.std(hue_channel))
 
-    value = hsv[:, :, 2]
-    mean_brightness = float(np.mean(value.astype(np.float32)))
-    brightness_score = mean_brightness / 255.0
+        mean_saturation = float(np.mean(hsv[:, :, 1].astype(np.float32)))
+        mean_brightness = float(np.mean(hsv[:, :, 2].astype(np.float32)))
 
-    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    coverage = float(np.count_nonzero(binary) / binary.size)
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        coverage = float(np.count_nonzero(binary) / binary.size)
 
-    laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-    laplacian_var = float(laplacian.var())
+        laplacian_var = float(laplacian.var())
+    else:
+        # kanten av ROI-en er panelkanten (eller bakgrunnen), ikke en lakkdefekt
+        inner = cv2.erode(mask, np.ones((5, 5), np.uint8))
+        if cv2.countNonZero(inner) == 0:
+            inner = mask
+        edge_density = cv2.countNonZero(cv2.bitwise_and(edges, inner)) / cv2.countNonZero(inner)
+
+        mean, std = cv2.meanStdDev(hsv, mask=mask)  # alle tre kanaler i én pass
+        hue_std = float(std[0, 0])
+        mean_saturation = float(mean[1, 0])
+        mean_brightness = float(mean[2, 0])
+
+        coverage = _otsu_coverage(cv2.calcHist([gray], [0], mask, [256], [0, 256]).ravel())
+
+        _, lap_std = cv2.meanStdDev(laplacian, mask=inner)
+        laplacian_var = float(lap_std[0, 0]) ** 2
+
+    color_uniformity = max(0, 1 - (hue_std / MAX_HUE_STD_DEVIATION))
+    saturation_score = mean_saturation / 255.0
+    brightness_score = mean_brightness / 255.0
     smoothness = max(0, 1 - (laplacian_var / MAX_LAPLACIAN_VARIANCE))
 
     cvi = (
@@ -68,7 +240,7 @@ def analyze_coating(image: np.ndarray) -> Dict:
         brightness_score * 0.15
     ) * 100
 
-    return {
+    metrics = {
         "cvi": round(cvi, 2),
         "cqi": round(cqi, 2),
         "coverage": round(coverage * 100, 2),
@@ -78,12 +250,35 @@ def analyze_coating(image: np.ndarray) -> Dict:
         "saturation_score": round(saturation_score * 100, 2),
         "brightness_score": round(brightness_score * 100, 2),
         "laplacian_variance": round(laplacian_var, 2),
+        "calibrated": calibration is not None,
         "note": "OpenCV-based heuristic analysis - no ML model",
     }
+    if region is not None:
+        metrics["roi"] = region.summary()
+    if defects:
+        found = find_defects(edges, laplacian, top_k, mask=inner)
+        if region is not None:
+            # tilbake til bildets koordinater; areal i % av ROI-en i stedet for utsnittet
+            scale = mask.size / cv2.countNonZero(mask) if mask is not None else 1.0
+            for d in found:
+                d["x"] += region.x
+                d["y"] += region.y
+                d["area"] = round(d["area"] * scale, 3)
+        metrics["defects"] = found
+    return metrics
 
 
-def process_image_file(file_path: str, output_dir: Optional[str] = None) -> Dict:
-    image = cv2.imread(file_path)
+def process_image_file(
+    file_path: str,
+    output_dir: Optional[str] = None,
+    target_max_side: Optional[int] = None,
+) -> Dict:
+    try:
+        with open(file_path, "rb") as f:
+            data = f.read()
+    except OSError:
+        data = b""
+    image = decode_image_bytes(data, target_max_side) if data else None
     if image is None:
         raise ValueError(f"Could not read image: {file_path}")
 
@@ -108,6 +303,10 @@ def create_analysis_overlay(image: np.ndarray, metrics: Dict) -> np.ndarray:
 
     result = cv2.addWeighted(result, 0.7, edge_overlay, 0.3, 0)
 
+    for region in metrics.get("defects", []):
+        x, y, w, h = region["x"], region["y"], region["w"], region["h"]
+        cv2.rectangle(result, (x, y), (x + w, y + h), (0, 0, 255), 2)
+
     font = cv2.FONT_HERSHEY_SIMPLEX
     y_offset = 30
     for key in ['cvi', 'cqi', 'coverage']:
@@ -1,7 +1,6 @@
 import os
+from ..services import concurrency  # først: BLAS-trådgrenser må settes før numpy/cv2 lastes
 from fastapi import Response, FastAPI
-import importlib
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
 from .db import Base, engine
@@ -16,7 +15,7 @@ app = FastAPI(title="CoatVision Core")
 Base.metadata.create_all(bind=engine)
 # Også opprett SQLModel-tabeller (CalibrationEvent, CalibrationWeightsProfile)
 try:
-    pass
+    from backend.app.services import calibration_registry  # noqa: F401 (registrerer tabellene)
     SQLModel.metadata.create_all(bind=engine)
 except Exception:
     pass
@@ -51,6 +50,53 @@ def root():
     }
 
 
+@app.on_event("startup")
+def apply_thread_limits():
+    """cv2/BLAS-tråder etter cgroup-kvoten og antall workere (før modellen lastes)."""
+    plan = concurrency.apply()
+    print(f"[startup] Thread plan: {plan}")
+
+
+@app.on_event("startup")
+def start_storage_sweeper():
+    """Blob-lageret: fjern referanser fra jobber som ikke finnes, start opprydding (én worker om gangen)."""
+    try:
+        from backend.app.services import jobs, storage
+
+        store = storage.default_store()
+        released = jobs.store.reconcile_refs(store)
+        if released:
+            print(f"[startup] Released {released} storage refs from unknown jobs")
+        store.start_sweeper()
+    except Exception as e:
+        print(f"[startup] Storage sweeper not started: {e}")
+
+
+@app.on_event("startup")
+def warm_model_engine():
+    """Last inferensmodellen én gang per worker ved oppstart, ikke på første forespørsel."""
+    try:
+        from backend.app.services import inference
+        from backend.app.services.config import INFERENCE_PRELOAD
+
+        if INFERENCE_PRELOAD:
+            inference.warmup()
+    except Exception as e:
+        print(f"[startup] Model warmup skipped: {e}")
+
+
+@app.on_event("startup")
+def start_calibration_registry():
+    """Last kalibreringsprofilene i minnet og poll etter endringer fra andre workere."""
+    try:
+        from backend.app.services.calibration_registry import registry
+
+        registry.refresh()
+        registry.start()
+    except Exception as e:
+        print(f"[startup] Calibration registry not started: {e}")
+
+
 @app.get("/favicon.ico", include_in_schema=False)
 def favicon():
     # Return empty response to avoid 404 noise in logs.
@@ -88,6 +134,7 @@ _include_optional_router("backend.app.routers.config_model")
 _include_optional_router("backend.app.routers.calibration")
 _include_optional_router("backend.app.routers.jobs")
 _include_optional_router("backend.app.routers.wash")
+_include_optional_router("backend.app.routers.history")
 _include_optional_router("backend.app.routers.reports")
 _include_optional_router("backend.app.routers.coatvision_v1")
 
@@ -101,17 +148,5 @@ try:
 except Exception:
     pass
 
-# Serve statiske analyse-resultater (overlays) fra outputs/
-try:
-    try:
-        _pkg = __package__ or "backend.app"
-        _config = importlib.import_module(_pkg + ".services.config")
-        BACKEND_DIR = getattr(_config, "BACKEND_DIR")
-        outputs_dir = (BACKEND_DIR / "outputs").resolve()
-        outputs_dir.mkdir(parents=True, exist_ok=True)
-        app.mount("/outputs", StaticFiles(directory=str(outputs_dir), check_dir=False), name="outputs")
-    except Exception:
-        # Ikke fatal i utvikling hvis mappe mangler eller modulen ikke kan importeres
-        pass
-except Exception:
-    pass
\ No newline at end of file
+# Serve analyse-resultater (overlays) fra outputs/ med ETag/Range/immutable-caching
+_include_optional_router("backend.app.routers.artifacts")
@@ -1,10 +1,16 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
+from typing import Optional
 from fastapi.responses import FileResponse
 
+from .services import concurrency  # først: BLAS-trådgrenser må settes før numpy/cv2 lastes
 from .models import AnalyzeResponse
-from .services.analyzer import analyze_image
+from .services.analyzer import analyze_image_png
+from .services.artifacts import serve_blob, serve_file
+from .services.config import MAX_UPLOAD_BYTES, STORAGE_INDEX_PATH
+from .services.storage import get_store, ingest_upload
+from .services.uploads import UploadTooLarge
 
 # Basestier
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -25,6 +31,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+def storage():
+    """Blob-lageret for uploads/ og outputs/ (sharded, dedupet, med kvoter)."""
+    dirs = {"uploads": UPLOAD_DIR, "outputs": OUTPUT_DIR, "thumbnails": OUTPUT_DIR / ".variants"}
+    return get_store(dirs, STORAGE_INDEX_PATH)
+
+
+@app.on_event("startup")
+def start_storage_sweeper():
+    # bare én worker rydder; den indekserer også overlays fra før blob-lageret (kvoter, oppslag på filnavn)
+    storage().start_sweeper()
+
+
+@app.on_event("startup")
+def apply_thread_limits():
+    concurrency.apply()
+
+
 @app.get("/")
 def root():
     return {"status": "ok", "name": "CoatVision Core"}
@@ -47,24 +71,38 @@ def ui():
 
 @app.post("/analyze", response_model=AnalyzeResponse)
 async def analyze(file: UploadFile = File(...)):
-    # 1. Lagre opplastet fil
-    save_path = UPLOAD_DIR / file.filename
-    contents = await file.read()
-    save_path.write_bytes(contents)
+    store = storage()
+    # 1. Strøm opplastet fil inn i blob-lageret (innholdsadressert, med størrelsesgrense)
+    try:
+        upload, _ = await ingest_upload(store, file, "uploads", max_bytes=MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-    # 2. Kjør analyse
-    out_path, metrics = analyze_image(save_path, OUTPUT_DIR)
+    # 2. Kjør analyse på bufferen vi allerede har i minnet; overlayet er en avledet blob
+    overlay, metrics = await concurrency.run_cpu(analyze_image_png, upload.data, upload.sha256)
+    output = store.put_bytes(overlay, "outputs", ".png", source=upload.sha256)
 
     # 3. Returner metadata til CoatVision-klienten
     return AnalyzeResponse(
         original_filename=file.filename,
-        output_filename=out_path.name,
+        output_filename=output.name,
         metrics=metrics,
     )
 
 @app.get("/outputs/{filename}")
-def get_output_image(filename: str):
-    file_path = OUTPUT_DIR / filename
-    if not file_path.exists():
+async def get_output_image(request: Request, filename: str, w: Optional[int] = Query(None, ge=16, le=4096)):
+    """Innholdsadressert overlay: immutable, ETag/304, Range og `?w=` for miniatyrer."""
+    store = storage()
+    blob = store.get_named(filename, "outputs")
+    if blob is not None and not blob.legacy:
+        return await serve_blob(request, store, blob, width=w)
+    # eldre flat fil (indeksert for kvotene, men kan skrives over): vanlig ETag fra mtime/størrelse
+    root = OUTPUT_DIR.resolve()
+    path = (root / filename).resolve()
+    if not path.is_relative_to(root) or not path.is_file():
         raise HTTPException(status_code=404, detail="Output file not found")
-    return FileResponse(file_path)
\ No newline at end of file
+    return await serve_file(request, path)
+
+@app.get("/storage/usage")
+def storage_usage():
+    return storage().usage()
@@ -1,51 +1,159 @@
 # backend/app/routers/analyze.py
-from fastapi import APIRouter, UploadFile, File, HTTPException
-import tempfile
-import os
+import base64
+import binascii
+import json
+from typing import Optional
 
-from backend.app.core.coatvision_core import process_image_file, analyze_coating
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from backend.app.core.coatvision_core import ANALYSIS_MAX_SIDE
+from backend.app.services import concurrency, inference, shared_cache, video
+from backend.app.services.calibration_registry import registry
+from backend.app.services.color_calibration import CalibrationError
+from backend.app.services.config import VIDEO_MAX_UPLOAD_BYTES
+from backend.app.services.inference import ModelUnavailable
+from backend.app.services.roi import RoiError, parse_roi
+from backend.app.services.uploads import UploadTooLarge, safe_suffix
 
 router = APIRouter(prefix="/api/analyze", tags=["analyze"])
 
+ENGINE_QUERY = Query("heuristic", pattern="^(heuristic|model|both)$",
+                     description="heuristic (OpenCV), model (multitask CNN) or both")
+DEVICE_QUERY = Query(None, description="Apply the colour calibration fitted for this device")
+CAMERA_QUERY = Query(None, description="Camera on the device (falls back to the device default)")
+DEFECTS_QUERY = Query(False, description="Also return the top defect regions (boxes, area, severity)")
+ROI_FORM = Form(None, description='Limit analysis to the panel: JSON {"rect": [x, y, w, h]}, '
+                                  '{"polygon": [[x, y], ...]} (relative 0-1) or {"mask": "<base64 image>"}')
+
+
+def device_calibration(device_id: Optional[str], camera: Optional[str] = None):
+    """Bakt LUT for enheten, None hvis ingen device_id eller ingen kalibrering."""
+    try:
+        return registry.resolve(device_id, camera)
+    except CalibrationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def roi_spec(data):
+    """ROI fra forespørselen (JSON-tekst eller objekt), None hvis ingen."""
+    try:
+        return parse_roi(data)
+    except RoiError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def run_engine(data: bytes, engine: str, device_id: Optional[str] = None, camera: Optional[str] = None,
+                     defects: bool = False, region=None):
+    """Metrikker for de kodede bildebytene (delt resultat-cache), None hvis de ikke kan dekodes."""
+    calibration = device_calibration(device_id, camera)
+    try:
+        return await inference.analyze_bytes_async(data, engine, calibration, defects=defects, roi=region)
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Model engine unavailable: {e}")
+    except RoiError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
 @router.post("/")
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(file: UploadFile = File(...), engine: str = ENGINE_QUERY,
+                        device_id: Optional[str] = DEVICE_QUERY, camera: Optional[str] = CAMERA_QUERY,
+                        defects: bool = DEFECTS_QUERY, roi: Optional[str] = ROI_FORM):
     """
     Analyze an uploaded image for coating quality.
     Returns CVI, CQI, coverage and other metrics.
     """
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = os.path.join(temp_dir, file.filename or "upload.jpg")
-        contents = await file.read()
-        with open(temp_path, "wb") as f:
-            f.write(contents)
-
-        try:
-            metrics = process_image_file(temp_path, temp_dir)
-            return {
-                "status": "success",
-                "filename": file.filename,
-                "metrics": metrics,
-            }
-        except Exception as e:
-            raise HTTPException(status_code=400, detail=str(e))
+    region = roi_spec(roi)
+    contents = await file.read()
+    metrics = await run_engine(contents, engine, device_id, camera, defects, region) if contents else None
+    if metrics is None:
+        raise HTTPException(status_code=400, detail=f"Could not read image: {file.filename}")
+    return {
+        "status": "success",
+        "filename": file.filename,
+        "metrics": metrics,
+    }
 
 
 @router.post("/base64")
-async def analyze_base64(payload: dict):
+async def analyze_base64(payload: dict, engine: str = ENGINE_QUERY,
+                         device_id: Optional[str] = DEVICE_QUERY, camera: Optional[str] = CAMERA_QUERY,
+                         defects: bool = DEFECTS_QUERY):
     """
     Analyze a base64-encoded image.
-    Expects {"image": "<base64_string>"}
+    Expects {"image": "<base64_string>"}, optionally with "device_id"/"camera"/"defects"/"roi".
     """
-    from backend.app.core.coatvision_core import decode_base64_image
-
     image_data = payload.get("image")
     if not image_data:
         raise HTTPException(status_code=400, detail="Missing 'image' field")
+    region = roi_spec(payload.get("roi"))
 
     try:
-        image = decode_base64_image(image_data)
-        metrics = analyze_coating(image)
-        return {"status": "success", "metrics": metrics}
-    except Exception as e:
+        data = base64.b64decode(image_data)
+    except (binascii.Error, TypeError, ValueError) as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+    metrics = await run_engine(data, engine, device_id or payload.get("device_id"),
+                               camera or payload.get("camera"), defects or bool(payload.get("defects")), region)
+    if metrics is None:
+        raise HTTPException(status_code=400,
+                            detail="Decoded image is None. The input may not be a valid base64-encoded image.")
+    return {"status": "success", "metrics": metrics}
+
+
+@router.post("/video")
+async def analyze_video(file: UploadFile = File(...), engine: str = ENGINE_QUERY,
+                        device_id: Optional[str] = DEVICE_QUERY, camera: Optional[str] = CAMERA_QUERY,
+                        defects: bool = DEFECTS_QUERY,
+                        every_s: float = Query(1.0, gt=0, le=60, description="Seconds between sampled frames"),
+                        scene: Optional[float] = Query(None, gt=0, lt=1,
+                                                       description="Also sample on scene change above this "
+                                                                   "difference (0-1); every_s is then the max gap"),
+                        roi: Optional[str] = ROI_FORM):
+    """
+    Analyze a video (e.g. a walk-around) by sampling frames.
+    Streams NDJSON: one "video" line, one "frame" line per sampled frame (in order), then a "summary".
+    """
+    calibration = device_calibration(device_id, camera)
+    region = roi_spec(roi)
+    if engine != "heuristic":
+        try:
+            inference.get_engine()
+        except ModelUnavailable as e:
+            raise HTTPException(status_code=503, detail=f"Model engine unavailable: {e}")
+    try:
+        path = await video.spool_upload(file, VIDEO_MAX_UPLOAD_BYTES, safe_suffix(file.filename, ".mp4"))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        sampler = video.FrameSampler(path, every_s=every_s, scene_threshold=scene, max_side=ANALYSIS_MAX_SIDE)
+    except video.VideoError as e:
+        path.unlink(missing_ok=True)
+        raise HTTPException(status_code=400, detail=f"{e}: {file.filename}")
+
+    async def score(image):
+        return await inference.analyze_async(image, engine, calibration, defects=defects, roi=region)
+
+    def cleanup():
+        # dekoderen først: på Windows kan en åpen fil ikke slettes
+        sampler.close()
+        path.unlink(missing_ok=True)
+
+    async def lines():
+        yield json.dumps({"type": "video", "filename": file.filename, **sampler.info()}) + "\n"
+        summary = video.Summary()
+        async for item in video.score_frames(sampler, score):
+            summary.add(item)
+            yield json.dumps(item) + "\n"
+        yield json.dumps(summary.result(sampler)) + "\n"
+
+    # BackgroundTask kjører også når klienten kobler fra før strømmen har startet
+    # (da kjøres aldri generatorens finally), så temp-filen blir aldri liggende
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(cleanup))
+
+
+@router.get("/engine")
+async def engine_status():
+    return {**inference.engine_status(), "result_cache": shared_cache.cache.stats(),
+            "concurrency": concurrency.status()}
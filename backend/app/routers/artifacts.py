@@ -0,0 +1,30 @@
+# backend/app/routers/artifacts.py
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from backend.app.services import storage
+from backend.app.services.artifacts import serve_blob, serve_file
+from backend.app.services.config import BACKEND_DIR
+
+# Erstatter StaticFiles-mounten på /outputs: innholdsadresserte overlays fra blob-lageret,
+# eldre flate filer (f.eks. fra batch-jobber) direkte fra outputs/.
+router = APIRouter(prefix="/outputs", tags=["artifacts"])
+
+OUTPUTS_DIR = (BACKEND_DIR / "outputs").resolve()
+
+
+@router.api_route("/{filename:path}", methods=["GET", "HEAD"])
+async def get_artifact(request: Request, filename: str, w: Optional[int] = Query(None, ge=16, le=4096)):
+    store = storage.default_store()
+    name = Path(filename)
+    if len(name.parts) == 1:
+        blob = store.get_named(filename, "outputs")
+        if blob is not None and not blob.legacy:
+            return await serve_blob(request, store, blob, width=w)
+
+    path = (OUTPUTS_DIR / filename).resolve()
+    if not path.is_relative_to(OUTPUTS_DIR) or not path.is_file():
+        raise HTTPException(status_code=404, detail="Output file not found")
+    return await serve_file(request, path)
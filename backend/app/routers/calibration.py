@@ -1,34 +1,116 @@
 # backend/app/routers/calibration.py
-from fastapi import APIRouter, Depends
+import json
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+
+from backend.app.core.coatvision_core import decode_image_bytes
 from backend.app.security import admin_guard
+from backend.app.services import color_calibration
+from backend.app.services.calibration_registry import registry
+from backend.app.services.color_calibration import CalibrationError
 
 router = APIRouter(prefix="/api/calibration", tags=["calibration"])
 
+DEFAULT_PARAMETERS = {
+    "brightness_offset": 0,
+    "contrast_factor": 1.0,
+    "color_correction": [1.0, 1.0, 1.0],
+    "white_balance": "auto",
+}
+
+
+def _params(device_id: str, camera: Optional[str] = None):
+    try:
+        return registry.get(device_id, camera or "")
+    except CalibrationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
 
 @router.get("/status")
-async def calibration_status():
+async def calibration_status(device_id: Optional[str] = Query(None), camera: Optional[str] = Query(None)):
+    params = _params(device_id, camera) if device_id else None
     return {
         "status": "ok",
-        "calibrated": True,
-        "last_calibration": "2024-01-01T00:00:00Z",
-        "next_recommended": "2024-07-01T00:00:00Z",
+        "device_id": device_id,
+        "registry": registry.stats(),
+        "calibrated": params is not None,
+        "last_calibration": _iso(params.fitted_at) if params else None,
+        "version": params.version if params else None,
     }
 
 
 @router.post("/run")
 async def run_calibration(_=Depends(admin_guard)):
     return {
-        "status": "started",
-        "message": "Calibration process initiated",
-        "estimated_time_seconds": 60,
+        "status": "ready",
+        "message": "Upload reference-chart photos to POST /api/calibration/devices/{device_id}/fit",
     }
 
 
+@router.post("/devices/{device_id}/fit")
+async def fit_device(
+    device_id: str,
+    files: List[UploadFile] = File(..., description="Photos of a ColorChecker-style 24-patch chart"),
+    rows: int = Form(color_calibration.COLORCHECKER_GRID[0]),
+    cols: int = Form(color_calibration.COLORCHECKER_GRID[1]),
+    roi: Optional[str] = Form(None, description='Chart position as JSON "[x, y, w, h]"; default whole image'),
+    camera: str = Form("", description="Camera/lens on the device; empty = device default"),
+    _=Depends(admin_guard),
+):
+    """Tilpass tonekurve + fargematrise for enheten fra ett eller flere kartbilder."""
+    if rows * cols != len(color_calibration.COLORCHECKER_SRGB):
+        raise HTTPException(status_code=400, detail="rows * cols must match the 24-patch reference chart")
+    try:
+        chart_roi = tuple(int(v) for v in json.loads(roi)) if roi else None
+        if chart_roi is not None and len(chart_roi) != 4:
+            raise ValueError
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='roi must be "[x, y, w, h]"')
+
+    measured = []
+    for upload in files:
+        image = decode_image_bytes(await upload.read(), target_max_side=0)
+        if image is None:
+            raise HTTPException(status_code=400, detail=f"Could not read image: {upload.filename}")
+        try:
+            measured.append(color_calibration.sample_patches(image, rows, cols, chart_roi))
+        except CalibrationError as e:
+            raise HTTPException(status_code=400, detail=f"{upload.filename}: {e}")
+
+    try:
+        params = color_calibration.fit_calibration(device_id, np.concatenate(measured), camera=camera)
+        params = registry.save(params)
+    except CalibrationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "calibrated", **params.summary()}
+
+
+@router.get("/devices/{device_id}")
+async def get_device(device_id: str, camera: Optional[str] = Query(None)):
+    params = _params(device_id, camera)
+    if params is None:
+        raise HTTPException(status_code=404, detail="Device is not calibrated")
+    return {**params.summary(), "tone_curves": params.tone_curves}
+
+
+@router.delete("/devices/{device_id}")
+async def delete_device(device_id: str, camera: Optional[str] = Query(None), _=Depends(admin_guard)):
+    try:
+        return {"deleted": registry.delete(device_id, camera or "")}
+    except CalibrationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/parameters")
-async def get_calibration_parameters():
-    return {
-        "brightness_offset": 0,
-        "contrast_factor": 1.0,
-        "color_correction": [1.0, 1.0, 1.0],
-        "white_balance": "auto",
-    }
+async def get_calibration_parameters(device_id: Optional[str] = Query(None), camera: Optional[str] = Query(None)):
+    params = _params(device_id, camera) if device_id else None
+    if params is None:
+        return {**DEFAULT_PARAMETERS, "device_id": device_id}
+    return params.summary()
@@ -1,14 +1,13 @@
-from fastapi import APIRouter, HTTPException
+import base64
+import time
+from fastapi import APIRouter, BackgroundTasks, HTTPException
 from datetime import datetime
-import tempfile
-import os
 from typing import Optional, Dict, Any
 
-from backend.app.core.coatvision_core import (
-    process_image_file,
-    analyze_coating,
-    decode_base64_image,
-)
+from backend.app.services import inference, roi, timeseries, wash_durability
+from backend.app.services.calibration_registry import registry
+from backend.app.services.color_calibration import CalibrationError
+from backend.app.services.inference import ModelUnavailable
 from backend.app.services.supabase_client import insert_analysis_payload
 
 router = APIRouter(prefix="/v1/coatvision", tags=["coatvision-v1"])
@@ -23,24 +22,75 @@ def _result_payload(result: Dict[str, Any], mode: str) -> Dict[str, Any]:
     }
 
 
+def _engine(payload: Dict[str, Any]) -> str:
+    engine = payload.get("engine") or "heuristic"
+    if engine not in inference.ENGINES:
+        raise HTTPException(status_code=400, detail=f"Unknown engine '{engine}'")
+    return engine
+
+
+def _record_history(payload: Dict[str, Any], metrics: Dict[str, Any]) -> None:
+    """Analyser med vehicleId går inn i historikken og holdbarhetsprognosen (ikke-fatal).
+
+    Kalles bare for nye analyser: et cachetreff er samme bilde sendt på nytt (retry,
+    stillestående kamera) og skal ikke telle som en ny måling. Kjøres som
+    BackgroundTask etter svaret (i threadpoolen): skrivingene er blokkerende.
+    """
+    vehicle_id = payload.get("vehicleId")
+    if not vehicle_id or "cqi" not in metrics:
+        return
+    now = time.time()
+    try:
+        wash_durability.engine.record(str(vehicle_id), metrics, panel=payload.get("panel"), ts=now)
+        timeseries.store.record_analysis(str(vehicle_id), payload.get("panel"), metrics, ts=now)
+    except Exception:
+        pass
+
+
+def _calibration(payload: Dict[str, Any]):
+    try:
+        return registry.resolve(payload.get("deviceId"), payload.get("camera"))
+    except CalibrationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _roi(payload: Dict[str, Any]):
+    try:
+        return roi.parse_roi(payload.get("roi"))
+    except roi.RoiError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _live_roi(payload: Dict[str, Any]):
+    """`roi` i payloaden, ellers siste ROI sendt i samme `sessionId` (delt mellom workere)."""
+    try:
+        return await roi.sessions.resolve_async(payload.get("sessionId"), payload.get("roi"))
+    except roi.RoiError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.post("/analyze-image")
-async def analyze_image(payload: Dict[str, Any]):
+async def analyze_image(payload: Dict[str, Any], background: BackgroundTasks):
     image = payload.get("image") or {}
     image_url: Optional[str] = image.get("imageUrl")
     if not image_url:
         raise HTTPException(status_code=400, detail="Missing image.imageUrl")
+    engine = _engine(payload)
+    calibration = _calibration(payload)
+    region = _roi(payload)
 
     try:
-        # Last ned bildet til temp og kjør eksisterende pipeline
+        # Last ned bildet og analyser bytene direkte fra minnet (samme bilde = cachet resultat)
         import requests
-        with tempfile.TemporaryDirectory() as tmp:
-            filename = os.path.join(tmp, "remote_image.jpg")
-            resp = requests.get(image_url, timeout=15)
-            resp.raise_for_status()
-            with open(filename, "wb") as f:
-                f.write(resp.content)
-
-            metrics = process_image_file(filename, tmp)
+        resp = requests.get(image_url, timeout=15)
+        resp.raise_for_status()
+        metrics, cache_hit = await inference.analyze_bytes_cached_async(
+            resp.content, engine, calibration, defects=bool(payload.get("defects")), roi=region)
+        if metrics is None:
+            raise ValueError(f"Could not read image: {image_url}")
+
+        if not cache_hit:
+            background.add_task(_record_history, payload, metrics)
         result = _result_payload(metrics, mode="image")
         # Attach minimal request context and attempt Supabase insert (non-fatal)
         result["request"] = {"imageUrl": image_url}
@@ -49,20 +99,29 @@ async def analyze_image(payload: Dict[str, Any]):
         except Exception:
             pass
         return result
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Model engine unavailable: {e}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/analyze-live")
-async def analyze_live(payload: Dict[str, Any]):
+async def analyze_live(payload: Dict[str, Any], background: BackgroundTasks):
     frame = payload.get("frame") or {}
     frame_b64: Optional[str] = frame.get("frameBase64")
     if not frame_b64:
         raise HTTPException(status_code=400, detail="Missing frame.frameBase64")
+    engine = _engine(payload)
+    calibration = _calibration(payload)
+    region = await _live_roi(payload)
 
     try:
-        img = decode_base64_image(frame_b64)
-        metrics = analyze_coating(img)
+        metrics, cache_hit = await inference.analyze_bytes_cached_async(
+            base64.b64decode(frame_b64), engine, calibration, defects=bool(payload.get("defects")), roi=region)
+        if metrics is None:
+            raise ValueError("Decoded image is None. The input may not be a valid base64-encoded image.")
+        if not cache_hit:
+            background.add_task(_record_history, payload, metrics)
         result = _result_payload(metrics, mode="live")
         # Do not store raw base64; only store minimal context
         result["request"] = {"source": "live"}
@@ -71,5 +130,7 @@ async def analyze_live(payload: Dict[str, Any]):
         except Exception:
             pass
         return result
+    except ModelUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Model engine unavailable: {e}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,4 +1,6 @@
 from fastapi import APIRouter, HTTPException
+from backend.app.services import shared_cache
+from backend.app.services.config import DASHBOARD_CACHE_TTL_S
 from backend.app.services.supabase_client import get_dashboard_summary, get_latest_analyses
 
 router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
@@ -6,7 +8,8 @@ router = APIRouter(prefix="/api/dashboard", tags=["dashboard"])
 
 @router.get("/summary")
 async def summary():
-    data = get_dashboard_summary()
+    # delt mellom workerne: ett Supabase-kall per TTL på hele maskinen, utenfor event-loopen
+    data = await shared_cache.cache.get_or_compute_async("dashboard:summary", get_dashboard_summary, ttl=DASHBOARD_CACHE_TTL_S)
     if data is None:
         raise HTTPException(status_code=500, detail="Supabase not configured or unavailable")
     return data
@@ -14,7 +17,8 @@ async def summary():
 
 @router.get("/latest")
 async def latest(limit: int = 10):
-    data = get_latest_analyses(limit)
+    data = await shared_cache.cache.get_or_compute_async(f"dashboard:latest:{limit}",
+                                                         lambda: get_latest_analyses(limit), ttl=DASHBOARD_CACHE_TTL_S)
     if data is None:
         raise HTTPException(status_code=500, detail="Supabase not configured or unavailable")
     return data
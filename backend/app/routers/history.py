@@ -0,0 +1,61 @@
+# backend/app/routers/history.py
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel, Field
+
+from backend.app.services import timeseries
+from backend.app.services.timeseries import SeriesNameError
+
+router = APIRouter(prefix="/api/history", tags=["history"])
+
+RESOLUTION_QUERY = Query("auto", pattern="^(auto|raw|hour|day|month)$",
+                         description="auto picks the finest resolution with at most max_points points")
+
+
+class Point(BaseModel):
+    ts: float
+    value: float
+
+
+class AppendRequest(BaseModel):
+    points: List[Point] = Field(..., max_length=100000)
+
+
+# Vanlige `def`: flock'et skriving, memmap-lesing og omskriving av rollups ved
+# etterfylling er blokkerende fil-I/O, så FastAPI kjører dem i threadpoolen.
+
+@router.get("/{vehicle_id}")
+def list_series(vehicle_id: str):
+    try:
+        series = timeseries.store.series(vehicle_id)
+    except SeriesNameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"vehicle_id": vehicle_id, "series": series}
+
+
+@router.get("/{vehicle_id}/{panel}/{metric}")
+def get_series(
+    vehicle_id: str,
+    panel: str,
+    metric: str,
+    start: Optional[float] = Query(None, description="unix seconds"),
+    end: Optional[float] = Query(None, description="unix seconds"),
+    resolution: str = RESOLUTION_QUERY,
+    max_points: Optional[int] = Query(None, ge=1, le=10000),
+):
+    try:
+        return timeseries.store.query(vehicle_id, panel, metric, start, end, resolution, max_points)
+    except SeriesNameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/{vehicle_id}/{panel}/{metric}")
+def append_points(vehicle_id: str, panel: str, metric: str, body: AppendRequest):
+    """Legg inn punkter (f.eks. import av eldre historikk)."""
+    try:
+        stored = timeseries.store.append(vehicle_id, panel, metric,
+                                         [p.ts for p in body.points], [p.value for p in body.points])
+    except SeriesNameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"stored": stored}
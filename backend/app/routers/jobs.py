@@ -1,6 +1,10 @@
 # backend/app/routers/jobs.py
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from starlette.concurrency import run_in_threadpool
+
 from backend.app.security import admin_guard
+from backend.app.services import jobs
+from backend.app.services.storage import default_store
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
@@ -14,28 +18,41 @@ class Job(BaseModel):
     status: str = "pending"
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
-
-
-jobs_db: List[dict] = []
+    uploads: List[str] = []  # sha256 for opplastinger jobben bruker (beskyttes mot opprydding)
 
 
 @router.get("/")
 async def list_jobs():
-    return {"jobs": jobs_db}
+    return {"jobs": await run_in_threadpool(jobs.store.list)}
 
 
 @router.post("/")
 async def create_job(job: Job, _=Depends(admin_guard)):
     job_dict = job.dict()
-    job_dict["id"] = f"job_{len(jobs_db) + 1}"
     job_dict["created_at"] = datetime.utcnow().isoformat()
-    jobs_db.append(job_dict)
+    job_dict = await run_in_threadpool(jobs.store.create, job_dict)
+    if job.uploads:
+        store = default_store()
+        owner = f"job:{job_dict['id']}"
+        missing = await run_in_threadpool(
+            lambda: [sha for sha in job.uploads if not store.add_ref(sha, "uploads", owner)])
+        if missing:
+            await run_in_threadpool(store.release, owner)
+            await run_in_threadpool(jobs.store.delete, job_dict["id"])
+            raise HTTPException(status_code=404, detail=f"Unknown uploads: {missing}")
     return {"status": "created", "job": job_dict}
 
 
 @router.get("/{job_id}")
 async def get_job(job_id: str):
-    for job in jobs_db:
-        if job.get("id") == job_id:
-            return job
-    return {"error": "Job not found"}
+    job = await run_in_threadpool(jobs.store.get, job_id)
+    return job if job is not None else {"error": "Job not found"}
+
+
+@router.delete("/{job_id}")
+async def delete_job(job_id: str, _=Depends(admin_guard)):
+    job = await run_in_threadpool(jobs.store.delete, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    released = await run_in_threadpool(default_store().release, f"job:{job_id}") if job.get("uploads") else 0
+    return {"status": "deleted", "released_refs": released}
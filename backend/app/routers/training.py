@@ -1,14 +1,48 @@
-from fastapi import APIRouter, Depends
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
 from backend.app.security import admin_guard
+from backend.app.services import training_runner
+from backend.app.services.training_runner import TrainingAlreadyRunning, TrainingOptions
 
 router = APIRouter(prefix="/api/training", tags=["training"])
 
 
+class TrainingStartRequest(BaseModel):
+    epochs: Optional[int] = None
+    batch_size: Optional[int] = None
+    image_size: Optional[int] = None
+    workers: Optional[int] = None
+    lr: Optional[float] = None
+    resume: Optional[bool] = None
+    batch_augment: Optional[bool] = None
+    threads: Optional[int] = None
+    cv_threads: Optional[int] = None
+    nice: Optional[int] = None
+    cpu_affinity: Optional[str] = None
+    world_size: Optional[int] = None
+
+
 @router.post("/start")
-async def start_training(_=Depends(admin_guard)):
-    return {"status": "started", "message": "Training process queued"}
+async def start_training(body: Optional[TrainingStartRequest] = None, _=Depends(admin_guard)):
+    overrides = body.model_dump(exclude_none=True) if body else {}
+    try:
+        run = await run_in_threadpool(training_runner.runner.start, TrainingOptions(**overrides))
+    except TrainingAlreadyRunning as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "started", "message": "Training process started", "run": run}
+
+
+@router.post("/stop")
+async def stop_training(_=Depends(admin_guard)):
+    # venter på at prosessen avslutter (opptil 10 s): ikke på event-loopen
+    stopped = await run_in_threadpool(training_runner.runner.stop)
+    return {"status": "stopped" if stopped else "not_running"}
 
 
 @router.get("/status")
 async def training_status():
-    return {"status": "idle", "last_run": None}
+    return await run_in_threadpool(training_runner.runner.status)
@@ -1,29 +1,94 @@
 # backend/app/routers/wash.py
-from fastapi import APIRouter
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+from backend.app.services import wash_durability
 
 router = APIRouter(prefix="/api/wash", tags=["wash"])
 
+MAX_BATCH = 20000
+
 
 class WashAnalysis(BaseModel):
     image_id: Optional[str] = None
     wash_count: int = 0
     condition: str = "good"
+    vehicle_id: Optional[str] = None
+    panel: Optional[str] = None
+
+
+class Observation(BaseModel):
+    vehicle_id: str = Field(..., min_length=1, max_length=128)
+    panel: Optional[str] = None
+    ts: Optional[float] = None  # unix-sekunder; default nå
+    cqi: Optional[float] = None
+    smoothness: Optional[float] = None
+
+
+class ObservationBatch(BaseModel):
+    observations: List[Observation] = Field(..., max_length=MAX_BATCH)
+
+
+class SeriesRef(BaseModel):
+    vehicle_id: str
+    panel: Optional[str] = None  # None = alle paneler på bilen
+
 
+class ForecastRequest(BaseModel):
+    vehicles: Optional[List[SeriesRef]] = Field(None, max_length=MAX_BATCH)  # None = alle
+
+
+# Handlerne er vanlige `def`: motoren gjør SQLite-kall (og refit) som FastAPI
+# da kjører i threadpoolen i stedet for på event-loopen.
 
 @router.get("/status")
-async def wash_status():
-    return {"status": "ok", "module": "wash_analysis", "version": "1.0.0"}
+def wash_status():
+    return {"status": "ok", "module": "wash_analysis", "version": "1.1.0",
+            "durability": wash_durability.engine.stats()}
 
 
 @router.post("/analyze")
-async def analyze_wash(analysis: WashAnalysis):
-    durability_score = max(0, 100 - (analysis.wash_count * 2))
+def analyze_wash(analysis: WashAnalysis):
+    forecast = None
+    if analysis.vehicle_id:
+        results, _ = wash_durability.engine.forecast([(analysis.vehicle_id, analysis.panel or "")])
+        if results and results[0]["metrics"]["cqi"]["current"] is not None:
+            forecast = results[0]
+
+    if forecast is None:
+        # Ingen historikk ennå: enkel tommelfingerregel på antall vask
+        durability_score = max(0, 100 - (analysis.wash_count * 2))
+        recommendation = "continue" if durability_score > 50 else "recoat_recommended"
+    else:
+        durability_score = round(max(0.0, min(100.0, forecast["metrics"]["cqi"]["current"])), 2)
+        recommendation = forecast["recommendation"]
     return {
         "status": "analyzed",
         "wash_count": analysis.wash_count,
         "condition": analysis.condition,
         "durability_score": durability_score,
-        "recommendation": "continue" if durability_score > 50 else "recoat_recommended",
+        "recommendation": recommendation,
+        "forecast": forecast,
+    }
+
+
+@router.post("/observations")
+def add_observations(batch: ObservationBatch):
+    """Legg inn analyseresultater (f.eks. historikk) for holdbarhetsprognosen."""
+    count = wash_durability.engine.record_many(o.model_dump() for o in batch.observations)
+    return {"recorded": count, **wash_durability.engine.stats()}
+
+
+@router.post("/forecast")
+def forecast_recoat(request: ForecastRequest):
+    """Prognose for ny coating for mange kjøretøy i ett kall."""
+    refs = None if request.vehicles is None else [(v.vehicle_id, v.panel) for v in request.vehicles]
+    results, missing = wash_durability.engine.forecast(refs)
+    if refs is not None and not results and missing:
+        raise HTTPException(status_code=404, detail="No analysis history for the requested vehicles")
+    return {
+        "count": len(results),
+        "forecasts": results,
+        "missing": [{"vehicle_id": v, "panel": p} for v, p in missing],
     }
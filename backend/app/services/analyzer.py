@@ -1,5 +1,15 @@
 from pathlib import Path
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, Union
+
+
+def _load_cv():
+    # Lazy import to avoid startup failures on platforms missing system libs for OpenCV
+    try:
+        import cv2  # type: ignore
+        import numpy as np  # type: ignore
+    except Exception as e:
+        raise RuntimeError(f"OpenCV unavailable: {e}")
+    return cv2, np
 
 
 def analyze_image(input_path: Path, output_dir: Path) -> Tuple[Path, Dict[str, Any]]:
@@ -10,17 +20,35 @@ def analyze_image(input_path: Path, output_dir: Path) -> Tuple[Path, Dict[str, A
     - Lager et output-bilde
     - Returnerer (sti_til_output, metrics)
     """
-    # Lazy import to avoid startup failures on platforms missing system libs for OpenCV
-    try:
-        import cv2  # type: ignore
-        import numpy as np  # type: ignore
-    except Exception as e:
-        raise RuntimeError(f"OpenCV unavailable: {e}")
+    cv2, _ = _load_cv()
 
     img = cv2.imread(str(input_path))
     if img is None:
         raise ValueError(f"Kunne ikke lese bilde: {input_path}")
 
+    blended, metrics = render_analysis(img)
+    output_path = output_dir / f"{input_path.stem}_cv_output.png"
+    cv2.imwrite(str(output_path), blended)
+    return output_path, metrics
+
+
+def analyze_image_png(data: Union[bytes, bytearray, memoryview], name: str) -> Tuple[bytes, Dict[str, Any]]:
+    """Analyser et bilde som allerede ligger i minnet; overlayet returneres som PNG-bytes (for blob-lageret)."""
+    cv2, np = _load_cv()
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"Kunne ikke lese bilde: {name}")
+    blended, metrics = render_analysis(img)
+    ok, encoded = cv2.imencode(".png", blended)
+    if not ok:
+        raise ValueError(f"Kunne ikke kode overlay: {name}")
+    return encoded.tobytes(), metrics
+
+
+def render_analysis(img) -> Tuple[Any, Dict[str, Any]]:
+    cv2, np = _load_cv()
+
     # Enkel "AI"-placeholder: kantdeteksjon
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     edges = cv2.Canny(gray, 100, 200)
@@ -31,9 +59,6 @@ def analyze_image(input_path: Path, output_dir: Path) -> Tuple[Path, Dict[str, A
 
     blended = cv2.addWeighted(img, 0.8, overlay, 0.7, 0)
 
-    output_path = output_dir / f"{input_path.stem}_cv_output.png"
-    cv2.imwrite(str(output_path), blended)
-
     coverage = float(np.count_nonzero(edges) / edges.size)
 
     metrics: Dict[str, Any] = {
@@ -41,4 +66,4 @@ def analyze_image(input_path: Path, output_dir: Path) -> Tuple[Path, Dict[str, A
         "note": "Dummy-metrikk – byttes ut med ekte AI-modell senere.",
     }
 
-    return output_path, metrics
+    return blended, metrics
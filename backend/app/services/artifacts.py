@@ -0,0 +1,231 @@
+"""
+Levering av analyse-artefakter (overlays, miniatyrer) over HTTP.
+
+- Innholdsadresserte URL-er (`<sha256>.png`) får `Cache-Control: immutable`
+  og sterk ETag = hashen; `If-None-Match` gir 304 uten å åpne filen.
+- `Range`/`If-Range` (ett intervall) gir 206; flere intervaller besvares med
+  hele filen (tillatt etter RFC 9110).
+- Filinnholdet sendes uten kopiering når ASGI-serveren annonserer
+  `http.response.zerocopy` (sendfile) eller `http.response.pathsend`; ellers
+  leses det i biter med `os.pread` i en tråd.
+- `?w=400` gir en nedskalert variant. Bredden rundes opp til nærmeste tillatte
+  (`ARTIFACT_WIDTHS`), lages én gang og lagres som avledet blob.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .config import ARTIFACT_CHUNK_BYTES, ARTIFACT_WIDTHS
+from .storage import Blob, BlobStore
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=60, must-revalidate"
+MEDIA_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp",
+               ".json": "application/json", ".pdf": "application/pdf"}
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def media_type(path: Path) -> str:
+    return MEDIA_TYPES.get(path.suffix.lower(), "application/octet-stream")
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match: svak sammenligning, lister og `*`."""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """`bytes=a-b` -> (start, end) inklusiv. None = hele filen. ValueError = ikke tilfredsstillbar."""
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None  # flere intervaller/ukjent enhet: send hele filen
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # siste n byte
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+class ArtifactResponse(Response):
+    """Filrespons med ETag, Range og zero-copy der serveren støtter det."""
+
+    def __init__(self, path: Path, etag: str, cache_control: str, request: Request,
+                 media: Optional[str] = None):
+        self.path = Path(path)
+        self.request = request
+        self.body_range: Optional[Tuple[int, int]] = None
+        stat = os.stat(self.path)
+        self.size = stat.st_size
+        headers = {"etag": etag, "cache-control": cache_control, "accept-ranges": "bytes"}
+        status = 200
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            status = 304
+        else:
+            range_header = request.headers.get("range")
+            if_range = request.headers.get("if-range")
+            if range_header and (not if_range or if_range.strip() == etag):
+                try:
+                    self.body_range = parse_range(range_header, self.size)
+                except ValueError:
+                    status = 416
+                    headers["content-range"] = f"bytes */{self.size}"
+                if self.body_range is not None:
+                    status = 206
+                    start, end = self.body_range
+                    headers["content-range"] = f"bytes {start}-{end}/{self.size}"
+
+        super().__init__(status_code=status, headers=headers, media_type=media or media_type(self.path))
+        if status in (304, 416):
+            self.headers["content-length"] = "0"
+        else:
+            start, end = self.body_range or (0, self.size - 1)
+            self.headers["content-length"] = str(max(end - start + 1, 0))
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.status_code in (304, 416) or scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = self.body_range or (0, self.size - 1)
+        count = max(end - start + 1, 0)
+        extensions = scope.get("extensions") or {}
+        if "http.response.pathsend" in extensions and self.body_range is None:
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+            return
+
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if "http.response.zerocopy" in extensions:
+                await send({"type": "http.response.zerocopy", "file": fd, "offset": start, "count": count,
+                            "more_body": False})
+                return
+            offset, remaining = start, count
+            while remaining > 0:
+                chunk = await run_in_threadpool(os.pread, fd, min(ARTIFACT_CHUNK_BYTES, remaining), offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0 or count == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            os.close(fd)
+
+
+# -- varianter -------------------------------------------------------------
+
+_variant_locks: Dict[str, threading.Lock] = {}
+_variant_locks_guard = threading.Lock()
+
+
+def snap_width(width: int) -> int:
+    """Rund opp til nærmeste tillatte bredde (begrenser antall varianter per bilde)."""
+    for allowed in ARTIFACT_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return ARTIFACT_WIDTHS[-1]
+
+
+def _render_variant(path: Path, width: int) -> Optional[bytes]:
+    import cv2
+
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None or image.shape[1] <= width:
+        return None  # ikke et bilde / allerede lite nok: originalen brukes
+    height = max(1, round(image.shape[0] * width / image.shape[1]))
+    small = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    ext = path.suffix.lower()
+    params = [cv2.IMWRITE_JPEG_QUALITY, 85] if ext in (".jpg", ".jpeg") else []
+    ok, encoded = cv2.imencode(ext if ext in (".png", ".jpg", ".jpeg", ".webp") else ".png", small, params)
+    return encoded.tobytes() if ok else None
+
+
+def _cached_variant(store: BlobStore, source: str) -> Optional[Blob]:
+    for candidate in store.derived_from(source, "thumbnails"):
+        hit = store.get(candidate.sha256, "thumbnails")  # oppdaterer LRU-tiden for kvoten
+        if hit is not None:
+            return hit
+    return None
+
+
+def variant(store: BlobStore, blob: Blob, width: int) -> Blob:
+    """Blob for `blob` skalert til `width` (laget én gang, deretter fra lageret)."""
+    width = snap_width(width)
+    source = f"{blob.sha256}:w{width}"
+    hit = _cached_variant(store, source)
+    if hit is not None:
+        return hit
+    with _variant_locks_guard:
+        lock = _variant_locks.setdefault(source, threading.Lock())
+    with lock:
+        hit = _cached_variant(store, source)
+        if hit is not None:
+            return hit
+        data = _render_variant(blob.path, width)
+        if data is None:
+            return blob
+        return store.put_bytes(data, "thumbnails", blob.ext or ".png", source=source)
+
+
+# -- flate filer (eldre outputs/ uten innholdsnavn) -------------------------
+
+_file_etags: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+_file_etags_lock = threading.Lock()
+
+
+def file_etag(path: Path) -> str:
+    """Sterk ETag for en vanlig fil, cachet på (sti, mtime, størrelse)."""
+    stat = os.stat(path)
+    key = (str(path), stat.st_mtime_ns, stat.st_size)
+    with _file_etags_lock:
+        etag = _file_etags.get(key)
+        if etag is not None:
+            _file_etags.move_to_end(key)
+            return etag
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    etag = f'"{digest.hexdigest()[:32]}"'
+    with _file_etags_lock:
+        _file_etags[key] = etag
+        while len(_file_etags) > 4096:
+            _file_etags.popitem(last=False)
+    return etag
+
+
+async def serve_blob(request: Request, store: BlobStore, blob: Blob, width: Optional[int] = None) -> Response:
+    if width:
+        blob = await run_in_threadpool(variant, store, blob, width)
+    return ArtifactResponse(blob.path, f'"{blob.sha256}"', IMMUTABLE, request)
+
+
+async def serve_file(request: Request, path: Path) -> Response:
+    etag = await run_in_threadpool(file_etag, path)
+    return ArtifactResponse(path, etag, REVALIDATE, request)
@@ -0,0 +1,141 @@
+"""
+Dynamisk mikro-batching foran modell-inferensen.
+
+Samtidige forespørsler samles i opptil `max_delay_ms` millisekunder eller
+`max_batch` elementer, kjøres som ett batch-kall og resultatene fordeles
+tilbake til hver ventende forespørsel. Batch-størrelse og køforsinkelse
+registreres i enkle histogrammer.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generic, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus-style cumulative 'le' buckets)."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets, running = {}, 0
+            for bound, n in zip(self.bounds + [float("inf")], self.counts):
+                running += n
+                buckets["+Inf" if bound == float("inf") else f"{bound:g}"] = running
+            return {
+                "count": self.count,
+                "sum": round(self.sum, 4),
+                "mean": round(self.sum / self.count, 4) if self.count else None,
+                "buckets": buckets,
+            }
+
+
+class MicroBatcher(Generic[T, R]):
+    """Gather concurrent `submit()` calls into batches for `fn(items) -> results`.
+
+    `fn` runs on a single background thread so the event loop stays free
+    while a batch is computing; the next batch is gathered meanwhile.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[T]], Sequence[R]],
+        max_batch: int = 8,
+        max_delay_ms: float = 5.0,
+        executor: Optional[ThreadPoolExecutor] = None,
+    ):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay_ms) / 1000.0
+        self._executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="microbatch")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        batch_bounds = sorted({1, 2, 4, 8, 16, 32, 64, self.max_batch})
+        self.batch_sizes = Histogram([b for b in batch_bounds if b <= self.max_batch])
+        self.queue_delay_ms = Histogram([0.5, 1, 2, 5, 10, 20, 50, 100, 250])
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            # Ny event-loop (f.eks. i tester) -> ny kø og worker bundet til den
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        return self._queue
+
+    async def submit(self, item: T) -> R:
+        queue = self._ensure_worker()
+        future = self._loop.create_future()
+        await queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _gather(self, queue: asyncio.Queue) -> List[Tuple[T, asyncio.Future, float]]:
+        batch = [await queue.get()]
+        deadline = self._loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = await self._gather(queue)
+            batch = [entry for entry in batch if not entry[1].cancelled()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for _, _, enqueued in batch:
+                self.queue_delay_ms.observe((started - enqueued) * 1000.0)
+
+            try:
+                results = await self._loop.run_in_executor(self._executor, self.fn, [b[0] for b in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"Batch function returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": self.max_batch,
+            "max_delay_ms": self.max_delay * 1000.0,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_delay_ms": self.queue_delay_ms.snapshot(),
+        }
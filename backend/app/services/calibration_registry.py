@@ -0,0 +1,237 @@
+"""
+Kalibreringsprofiler per enhet/kamera: SQLModel-tabeller + cache i prosessen.
+
+Profilene (`CalibrationWeightsProfile`) ligger i hoveddatabasen, og hver endring
+skriver en rad i `CalibrationEvent`. Registeret holder alle profiler i en dict
+nøklet på (device_id, camera), så et analysekall finner profilen (og den bakte
+LUT-en) uten å spørre databasen.
+
+Ugyldiggjøring skjer på hendelses-id: en bakgrunnstråd (eller, uten tråd, første
+forespørsel etter `poll_interval`) spør bare `MAX(id)` fra hendelsestabellen og
+laster kun profilene som er endret siden sist. Endringer fra andre workere blir
+dermed synlige uten omstart; egne endringer er synlige med én gang.
+"""
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import UniqueConstraint, func
+from sqlmodel import Field, Session, SQLModel, select
+
+from .color_calibration import DEVICE_ID_RE, CalibrationError, CalibrationLUT, CalibrationParams
+from .config import CALIBRATION_POLL_S
+
+ProfileKey = Tuple[str, str]  # (device_id, camera); camera "" = enhetens standard
+
+
+class CalibrationWeightsProfile(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("device_id", "camera"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: str = Field(index=True)
+    camera: str = Field(default="")
+    version: int = 1
+    params: str  # CalibrationParams som JSON
+    updated_at: float = Field(default_factory=time.time)
+
+
+class CalibrationEvent(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: str
+    camera: str = ""
+    version: int = 0
+    action: str  # fit | delete
+    created_at: float = Field(default_factory=time.time)
+
+
+def _validate(device_id: str, camera: str) -> ProfileKey:
+    if not DEVICE_ID_RE.match(device_id or ""):
+        raise CalibrationError("device_id must be 1-64 characters of [A-Za-z0-9_.:-]")
+    if camera and not DEVICE_ID_RE.match(camera):
+        raise CalibrationError("camera must be 1-64 characters of [A-Za-z0-9_.:-]")
+    return device_id, camera or ""
+
+
+class CalibrationRegistry:
+    def __init__(self, engine=None, poll_interval: float = CALIBRATION_POLL_S, max_luts: int = 64):
+        self._engine = engine
+        self.poll_interval = poll_interval
+        self.max_luts = max_luts
+        # Leses uten lås: oppdateringer bygger en ny dict og bytter referansen
+        self._profiles: Dict[ProfileKey, CalibrationParams] = {}
+        self._luts: Dict[Tuple[str, str, int], CalibrationLUT] = {}
+        self._last_event: Optional[int] = None  # None = ikke lastet ennå
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+        self._poller: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.reloads = 0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            from ..db import engine
+
+            self._engine = engine
+        return self._engine
+
+    def create_tables(self) -> None:
+        SQLModel.metadata.create_all(
+            self.engine, tables=[CalibrationWeightsProfile.__table__, CalibrationEvent.__table__])
+
+    # -- lasting -----------------------------------------------------------
+
+    def refresh(self) -> bool:
+        """Last endrede profiler hvis hendelsestabellen har nye rader. True = endret."""
+        with self._lock:
+            self._next_poll = time.monotonic() + self.poll_interval
+            with Session(self.engine) as session:
+                if self._last_event is None:
+                    self.create_tables()
+                latest = session.exec(select(func.max(CalibrationEvent.id))).one() or 0
+                if latest == self._last_event:
+                    return False
+                if self._last_event is None:
+                    rows = session.exec(select(CalibrationWeightsProfile)).all()
+                    profiles: Dict[ProfileKey, CalibrationParams] = {}
+                    changed: Iterable[ProfileKey] = ()
+                else:
+                    events = session.exec(
+                        select(CalibrationEvent.device_id, CalibrationEvent.camera)
+                        .where(CalibrationEvent.id > self._last_event)).all()
+                    changed = {(d, c) for d, c in events}
+                    rows = session.exec(
+                        select(CalibrationWeightsProfile)
+                        .where(CalibrationWeightsProfile.device_id.in_({d for d, _ in changed}))).all()
+                    profiles = {k: v for k, v in self._profiles.items() if k not in changed}
+
+            for row in rows:
+                key = (row.device_id, row.camera)
+                if self._last_event is None or key in changed:
+                    params = CalibrationParams(**json.loads(row.params))
+                    params.version = row.version
+                    profiles[key] = params
+            self._profiles = profiles
+            current = {(k[0], k[1], p.version) for k, p in profiles.items()}
+            self._luts = {k: v for k, v in self._luts.items() if k in current}
+            self._last_event = latest
+            self.reloads += 1
+            return True
+
+    def _maybe_refresh(self) -> None:
+        if self._last_event is None:
+            self.refresh()
+        elif (self._poller is None or not self._poller.is_alive()) and time.monotonic() >= self._next_poll:
+            try:
+                self.refresh()
+            except Exception as e:  # DB nede: fortsett med profilene vi har
+                logging.warning("Calibration registry refresh failed: %r", e)
+
+    def notify(self) -> None:
+        """Tving ny sjekk ved neste oppslag (f.eks. fra en NOTIFY-lytter)."""
+        self._next_poll = 0.0
+
+    # -- oppslag -----------------------------------------------------------
+
+    def get(self, device_id: str, camera: str = "") -> Optional[CalibrationParams]:
+        """Profil for enhet/kamera; faller tilbake til enhetens standardprofil."""
+        key = _validate(device_id, camera)
+        self._maybe_refresh()
+        profiles = self._profiles
+        return profiles.get(key) or (profiles.get((key[0], "")) if key[1] else None)
+
+    def resolve(self, device_id: Optional[str], camera: Optional[str] = None) -> Optional[CalibrationLUT]:
+        """Bakt LUT for forespørselen, eller None hvis ingen/ukjent enhet."""
+        if not device_id:
+            return None
+        params = self.get(device_id, camera or "")
+        if params is None:
+            return None
+        key = (params.device_id, params.camera, params.version)
+        lut = self._luts.get(key)
+        if lut is None:
+            lut = CalibrationLUT(params)
+            luts = dict(self._luts)
+            while len(luts) >= self.max_luts:
+                luts.pop(next(iter(luts)))
+            luts[key] = lut
+            self._luts = luts
+        return lut
+
+    def profiles(self) -> Dict[ProfileKey, CalibrationParams]:
+        self._maybe_refresh()
+        return dict(self._profiles)
+
+    # -- skriving ----------------------------------------------------------
+
+    def save(self, params: CalibrationParams) -> CalibrationParams:
+        key = _validate(params.device_id, params.camera)
+        if self._last_event is None:
+            self.refresh()
+        with Session(self.engine) as session:
+            row = session.exec(select(CalibrationWeightsProfile).where(
+                CalibrationWeightsProfile.device_id == key[0],
+                CalibrationWeightsProfile.camera == key[1])).first()
+            params.version = row.version + 1 if row else 1
+            if row is None:
+                row = CalibrationWeightsProfile(device_id=key[0], camera=key[1])
+            row.version = params.version
+            row.params = json.dumps(asdict(params))
+            row.updated_at = time.time()
+            session.add(row)
+            session.add(CalibrationEvent(device_id=key[0], camera=key[1], version=params.version, action="fit"))
+            session.commit()
+        self.refresh()
+        return params
+
+    def delete(self, device_id: str, camera: str = "") -> bool:
+        key = _validate(device_id, camera)
+        with Session(self.engine) as session:
+            row = session.exec(select(CalibrationWeightsProfile).where(
+                CalibrationWeightsProfile.device_id == key[0],
+                CalibrationWeightsProfile.camera == key[1])).first()
+            if row is None:
+                return False
+            session.delete(row)
+            session.add(CalibrationEvent(device_id=key[0], camera=key[1], version=row.version, action="delete"))
+            session.commit()
+        self.refresh()
+        return True
+
+    # -- bakgrunnspolling --------------------------------------------------
+
+    def start(self) -> None:
+        """Start polletråden (én per worker). Idempotent."""
+        if self._poller is not None and self._poller.is_alive():
+            return
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._poll_loop, name="calibration-registry", daemon=True)
+        self._poller.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._poller is not None:
+            self._poller.join(timeout=5)
+            self._poller = None
+
+    def _poll_loop(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning("Calibration registry refresh failed: %r", e)
+
+    def stats(self) -> Dict:
+        return {
+            "profiles": len(self._profiles),
+            "luts": len(self._luts),
+            "last_event": self._last_event,
+            "reloads": self.reloads,
+            "polling": self._poller is not None and self._poller.is_alive(),
+        }
+
+
+registry = CalibrationRegistry()
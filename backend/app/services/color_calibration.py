@@ -0,0 +1,201 @@
+"""
+Fargekalibrering per enhet (telefon/kamera) fra bilder av et referansekart.
+
+Tilpasningen gjøres i to ledd, i RGB 0–1:
+  1. tonekurve per kanal, fra de nøytrale (grå) feltene på kartet
+  2. affin 3x3-fargematrise (+ offset), minste kvadraters metode over alle felt
+
+Resultatet bakes inn i oppslagstabeller: en 1D-tabell (`cv2.LUT`) som gjør
+tonekurven og samtidig kvantiserer til rutenettet, og en 3D-tabell (nærmeste
+node) med fargematrisen ferdig anvendt. Å kalibrere et bilde koster da ett
+1D-oppslag og ett 3D-oppslag per piksel i stedet for flyttallsregning.
+Profilene lagres og caches i `calibration_registry`.
+"""
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import CALIBRATION_LUT_SIZE
+
+# X-Rite ColorChecker Classic (24 felt, rad for rad), sRGB 8-bit
+COLORCHECKER_SRGB = np.array([
+    [115, 82, 68], [194, 150, 130], [98, 122, 157], [87, 108, 67], [133, 128, 177], [103, 189, 170],
+    [214, 126, 44], [80, 91, 166], [193, 90, 99], [94, 60, 108], [157, 188, 64], [224, 163, 46],
+    [56, 61, 150], [70, 148, 73], [175, 54, 60], [231, 199, 31], [187, 86, 149], [8, 133, 161],
+    [243, 243, 242], [200, 200, 200], [160, 160, 160], [122, 122, 121], [85, 85, 85], [52, 52, 52],
+], dtype=np.float64) / 255.0
+COLORCHECKER_NEUTRALS = tuple(range(18, 24))
+COLORCHECKER_GRID = (4, 6)
+
+DEVICE_ID_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+
+
+class CalibrationError(ValueError):
+    pass
+
+
+def sample_patches(
+    image_bgr: np.ndarray,
+    rows: int = COLORCHECKER_GRID[0],
+    cols: int = COLORCHECKER_GRID[1],
+    roi: Optional[Tuple[int, int, int, int]] = None,
+    inset: float = 0.3,
+) -> np.ndarray:
+    """Snittfarge (RGB 0–1) i midten av hver rute i et rows x cols-kart.
+
+    `roi` = (x, y, w, h) for kartet i bildet; uten roi fyller kartet bildet.
+    `inset` er andelen av ruten som kuttes på hver side (unngår kantene).
+    """
+    x0, y0, w, h = roi or (0, 0, image_bgr.shape[1], image_bgr.shape[0])
+    cell_w, cell_h = w / cols, h / rows
+    patches = np.empty((rows * cols, 3), dtype=np.float64)
+    for r in range(rows):
+        for c in range(cols):
+            xa = int(x0 + (c + inset) * cell_w)
+            xb = max(xa + 1, int(x0 + (c + 1 - inset) * cell_w))
+            ya = int(y0 + (r + inset) * cell_h)
+            yb = max(ya + 1, int(y0 + (r + 1 - inset) * cell_h))
+            cell = image_bgr[ya:yb, xa:xb].reshape(-1, 3)
+            if cell.size == 0:
+                raise CalibrationError("Chart region is outside the image")
+            patches[r * cols + c] = cell.mean(axis=0)[::-1] / 255.0
+    return patches
+
+
+def _fit_tone_curve(measured: np.ndarray, reference: np.ndarray, neutral_idx: Sequence[int]) -> List[List[List[float]]]:
+    """Monoton stykkevis lineær kurve per kanal: målt grå -> referansegrå."""
+    target = reference[list(neutral_idx)].mean(axis=1)
+    curves = []
+    for ch in range(3):
+        xs = measured[list(neutral_idx), ch]
+        order = np.argsort(xs)
+        xs, ys = xs[order], target[order]
+        ys = np.maximum.accumulate(ys)  # tonekurven skal aldri gå nedover
+        xs = np.concatenate(([0.0], xs, [1.0]))
+        ys = np.concatenate(([0.0], ys, [1.0]))
+        keep = np.concatenate(([True], np.diff(xs) > 1e-6))
+        curves.append([xs[keep].round(6).tolist(), ys[keep].round(6).tolist()])
+    return curves
+
+
+def _apply_tone(rgb: np.ndarray, curves) -> np.ndarray:
+    out = np.empty_like(rgb, dtype=np.float64)
+    for ch, (xs, ys) in enumerate(curves):
+        out[..., ch] = np.interp(rgb[..., ch], xs, ys)
+    return out
+
+
+def _apply_matrix(rgb: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    return rgb @ matrix[:3] + matrix[3]
+
+
+@dataclass
+class CalibrationParams:
+    device_id: str
+    tone_curves: List[List[List[float]]]  # per kanal (R, G, B): [xs, ys]
+    matrix: List[List[float]]  # 4x3: rader R, G, B, offset
+    patches: int
+    error_before: float  # snitt absolutt feil (0–255) mot referansen
+    error_after: float
+    camera: str = ""
+    version: int = 1
+    fitted_at: float = field(default_factory=time.time)
+
+    def transform(self, rgb: np.ndarray) -> np.ndarray:
+        """Flyttallsvarianten (brukes til tilpasning/verifisering, ikke per bilde)."""
+        return np.clip(_apply_matrix(_apply_tone(rgb, self.tone_curves), np.asarray(self.matrix)), 0.0, 1.0)
+
+    def summary(self) -> Dict:
+        """Parametrene i det gamle /parameters-formatet + den fulle matrisen."""
+        matrix = np.asarray(self.matrix)
+        gains = np.diag(matrix[:3])
+        return {
+            "device_id": self.device_id,
+            "camera": self.camera,
+            "version": self.version,
+            "brightness_offset": round(float(matrix[3].mean() * 255.0), 2),
+            "contrast_factor": round(float(gains.mean()), 4),
+            "color_correction": [round(float(g), 4) for g in gains],
+            "white_balance": "calibrated",
+            "matrix": self.matrix,
+            "patches": self.patches,
+            "error_before": self.error_before,
+            "error_after": self.error_after,
+            "fitted_at": self.fitted_at,
+        }
+
+
+def fit_calibration(
+    device_id: str,
+    measured: np.ndarray,
+    reference: np.ndarray = COLORCHECKER_SRGB,
+    neutral_idx: Sequence[int] = COLORCHECKER_NEUTRALS,
+    camera: str = "",
+) -> CalibrationParams:
+    """Tilpass tonekurve + fargematrise. `measured`/`reference` er (N, 3) RGB 0–1.
+
+    Flere bilder av samme kart kan slås sammen ved å stable feltene (N = k * 24).
+    """
+    measured = np.asarray(measured, dtype=np.float64).reshape(-1, 3)
+    if len(reference) != len(measured):
+        # samme kart fotografert flere ganger
+        reps = len(measured) // len(reference)
+        if reps * len(reference) != len(measured):
+            raise CalibrationError(f"{len(measured)} measured patches do not match {len(reference)} reference patches")
+        reference = np.tile(reference, (reps, 1))
+        neutral_idx = [i + k * len(COLORCHECKER_SRGB) for k in range(reps) for i in neutral_idx]
+    if len(measured) < 6:
+        raise CalibrationError("At least 6 patches are required")
+
+    curves = _fit_tone_curve(measured, reference, neutral_idx)
+    toned = _apply_tone(measured, curves)
+    design = np.hstack([toned, np.ones((len(toned), 1))])
+    matrix, *_ = np.linalg.lstsq(design, reference, rcond=None)
+
+    params = CalibrationParams(
+        device_id=device_id,
+        camera=camera,
+        tone_curves=curves,
+        matrix=matrix.round(6).tolist(),
+        patches=len(measured),
+        error_before=round(float(np.abs(measured - reference).mean() * 255.0), 3),
+        error_after=0.0,
+    )
+    params.error_after = round(float(np.abs(params.transform(measured) - reference).mean() * 255.0), 3)
+    return params
+
+
+class CalibrationLUT:
+    """Ferdigbakt kalibrering for BGR uint8-bilder."""
+
+    def __init__(self, params: CalibrationParams, size: int = CALIBRATION_LUT_SIZE):
+        self.device_id = params.device_id
+        self.version = params.version
+        self.cache_key = f"{params.device_id}/{params.camera}@{params.version}:{params.fitted_at:.3f}"
+        self.size = size
+        n = size
+
+        # 1D: verdi -> tonekurve -> nærmeste nodeindeks i 3D-gitteret (BGR-rekkefølge)
+        values = np.arange(256, dtype=np.float64) / 255.0
+        lut1d = np.empty((1, 256, 3), dtype=np.uint8)
+        for ch, (xs, ys) in enumerate(params.tone_curves):  # R, G, B
+            lut1d[0, :, 2 - ch] = np.rint(np.interp(values, xs, ys) * (n - 1)).astype(np.uint8)
+        self.lut1d = lut1d
+
+        # 3D: node (b, g, r) -> fargematrise anvendt, som BGR uint8
+        axis = np.arange(n, dtype=np.float64) / (n - 1)
+        b, g, r = np.meshgrid(axis, axis, axis, indexing="ij")
+        rgb = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+        corrected = np.clip(_apply_matrix(rgb, np.asarray(params.matrix)), 0.0, 1.0)
+        self.lut3d = np.rint(corrected[:, ::-1] * 255.0).astype(np.uint8)
+
+    def apply(self, image_bgr: np.ndarray) -> np.ndarray:
+        import cv2
+
+        q = cv2.LUT(image_bgr, self.lut1d)
+        n = self.size
+        idx = (q[..., 0].astype(np.int32) * n + q[..., 1]) * n + q[..., 2]
+        return self.lut3d[idx]
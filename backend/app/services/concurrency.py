@@ -0,0 +1,179 @@
+"""
+Trådbudsjett per worker: OpenCV, BLAS/OpenMP og analyse-poolen.
+
+cv2 starter egne tråder per kall, NumPy/BLAS har sin egen pool, og uvicorn
+ganger begge med antall workere. På en 4-vCPU-instans med 4 workere kan fire
+samtidige `analyze_coating` ende med 4 x 4 cv2-tråder + BLAS-tråder, og alt
+går tregere enn med én tråd hver.
+
+Her regnes budsjettet ut fra det prosessen faktisk får bruke (cgroup-kvote og
+CPU-affinitet, ikke `os.cpu_count()` som ser hele verten):
+
+    cpus_per_worker = cpus // workers
+    pool_size       = samtidige analyser i workeren (default cpus_per_worker)
+    cv_threads      = cpus_per_worker // pool_size   (samme for BLAS)
+
+Modulen må importeres før numpy/cv2 for at BLAS-grensene (miljøvariabler)
+skal gjelde; `apply()` setter i tillegg `cv2.setNumThreads` og, hvis
+threadpoolctl er installert, BLAS-poolene som allerede er lastet.
+`scripts/autotune_concurrency.py` måler hvilken kombinasjon av workere x
+tråder som gir best gjennomstrømning og lagrer den i `CONCURRENCY_PROFILE`.
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from .config import CONCURRENCY_CV_THREADS, CONCURRENCY_POOL_SIZE, CONCURRENCY_PROFILE, CONCURRENCY_WORKERS
+
+BLAS_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                 "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+
+
+def cgroup_cpu_limit(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """CPU-kvoten fra cgroup v2 (`cpu.max`) eller v1 (`cfs_quota_us`), None = ubegrenset."""
+    try:
+        quota, _, period = (root / "cpu.max").read_text().strip().partition(" ")
+        if quota != "max":
+            return int(quota) / int(period or 100000)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        quota = int((root / "cpu" / "cpu.cfs_quota_us").read_text())
+        period = int((root / "cpu" / "cpu.cfs_period_us").read_text())
+        return quota / period if quota > 0 and period > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus(root: Path = CGROUP_ROOT) -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # pragma: no cover (macOS/Windows)
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit(root)
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(1, cpus)
+
+
+def worker_count() -> int:
+    # uvicorn/gunicorn bruker WEB_CONCURRENCY som default for --workers
+    return max(1, CONCURRENCY_WORKERS or int(os.getenv("WEB_CONCURRENCY", "1") or 1))
+
+
+@dataclass
+class ThreadPlan:
+    cpus: int
+    workers: int
+    pool_size: int
+    cv_threads: int
+    blas_threads: int
+    source: str = "auto"
+
+
+def load_profile(path: Optional[str] = CONCURRENCY_PROFILE) -> Dict[str, Any]:
+    """Resultatet fra autotune-skriptet (tomt hvis ingen profil)."""
+    if not path:
+        return {}
+    try:
+        return json.loads(Path(path).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def plan(cpus: Optional[int] = None, workers: Optional[int] = None,
+         profile: Optional[Dict[str, Any]] = None) -> ThreadPlan:
+    cpus = cpus or available_cpus()
+    workers = workers or worker_count()
+    profile = load_profile() if profile is None else profile
+    source = "auto"
+    budget = max(1, cpus // workers)
+    pool_size = CONCURRENCY_POOL_SIZE
+    cv_threads = CONCURRENCY_CV_THREADS
+    measured = [r for r in profile.get("results", []) if r.get("workers") == workers]
+    if measured and profile.get("cpus") == cpus:
+        # bare gyldig for samme maskinstørrelse og antall workere som ble målt
+        best = max(measured, key=lambda r: r.get("images_per_s", 0))
+        pool_size = pool_size or int(best.get("pool_size", 0))
+        cv_threads = cv_threads or int(best.get("cv_threads", 0))
+        source = "profile"
+    if CONCURRENCY_POOL_SIZE or CONCURRENCY_CV_THREADS:
+        source = "env"
+    pool_size = max(1, pool_size or budget)
+    cv_threads = max(1, cv_threads or budget // pool_size)
+    return ThreadPlan(cpus, workers, pool_size, cv_threads, cv_threads, source)
+
+
+current = plan()
+
+# Før numpy/cv2 lastes: BLAS/OpenMP leser disse ved oppstart. Eksplisitte verdier vinner.
+# Gjelder bare API-workerne; barneprosesser (trening) fjerner dem med `child_env`.
+INJECTED_ENV = {_var: str(current.blas_threads) for _var in BLAS_ENV_VARS if _var not in os.environ}
+os.environ.update(INJECTED_ENV)
+
+
+def child_env(env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Kopi av miljøet uten trådgrensene denne modulen satte for API-workerne."""
+    env = dict(os.environ if env is None else env)
+    for var, value in INJECTED_ENV.items():
+        if env.get(var) == value:
+            del env[var]
+    return env
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+_applied = False
+
+
+def apply(p: Optional[ThreadPlan] = None) -> ThreadPlan:
+    """Sett grensene i denne prosessen (trygt å kalle flere ganger)."""
+    global current, _applied
+    p = p or current
+    import cv2
+
+    cv2.setNumThreads(p.cv_threads)
+    try:
+        from threadpoolctl import threadpool_limits  # valgfri; dekker BLAS som alt er lastet
+        threadpool_limits(p.blas_threads)
+    except ImportError:
+        pass
+    current, _applied = p, True
+    return p
+
+
+def analysis_pool() -> ThreadPoolExecutor:
+    """Poolen CPU-tung analyse kjøres i (holder event-loopen fri, begrenser samtidighet)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if not _applied:
+                    apply()
+                _pool = ThreadPoolExecutor(max_workers=current.pool_size, thread_name_prefix="analysis")
+    return _pool
+
+
+async def run_cpu(fn: Callable, *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(analysis_pool(), partial(fn, *args, **kwargs))
+
+
+def status() -> Dict[str, Any]:
+    out = asdict(current)
+    out["cgroup_cpu_limit"] = cgroup_cpu_limit()
+    out["applied"] = _applied
+    try:
+        import cv2
+        out["cv2_threads"] = cv2.getNumThreads()
+    except ImportError:  # pragma: no cover
+        pass
+    return out
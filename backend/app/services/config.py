@@ -11,6 +11,21 @@ PERSIST_BASE = os.getenv("PERSIST_BASE", str((REPO_DIR / "local_data").resolve()
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # None = api.openai.com
+
+# LYXbot chat (async klient, samtidighet og svar-cache)
+LYXBOT_MAX_CONCURRENCY = int(os.getenv("LYXBOT_MAX_CONCURRENCY", "8"))
+LYXBOT_TIMEOUT_S = float(os.getenv("LYXBOT_TIMEOUT_S", "30"))
+LYXBOT_CACHE_SIZE = int(os.getenv("LYXBOT_CACHE_SIZE", "512"))
+LYXBOT_CACHE_TTL_S = float(os.getenv("LYXBOT_CACHE_TTL_S", "3600"))
+# LYXbot samtaler (server-side, token-budsjett for konteksten)
+LYXBOT_CONTEXT_TOKENS = int(os.getenv("LYXBOT_CONTEXT_TOKENS", "3000"))
+LYXBOT_SUMMARY_TOKENS = int(os.getenv("LYXBOT_SUMMARY_TOKENS", "400"))
+LYXBOT_SESSION_MAX_TURNS = int(os.getenv("LYXBOT_SESSION_MAX_TURNS", "40"))
+LYXBOT_MAX_SESSIONS = int(os.getenv("LYXBOT_MAX_SESSIONS", "1000"))
+LYXBOT_SESSION_TTL_S = float(os.getenv("LYXBOT_SESSION_TTL_S", str(6 * 3600)))
+# Samtalene deles av alle workere via SQLite; tom verdi = bare i prosessen (én worker)
+LYXBOT_SESSIONS_PATH = os.getenv("LYXBOT_SESSIONS_PATH", str(Path(PERSIST_BASE) / "lyxbot_sessions.sqlite"))
 
 # Auth/JWT
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
@@ -20,3 +35,82 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60")
 # Supabase
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+
+# Uploads
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_KB", "1024")) * 1024
+
+# Training dataset manifest (SQLite)
+DATASET_MANIFEST_PATH = os.getenv(
+    "DATASET_MANIFEST_PATH", str(Path(PERSIST_BASE) / "training_manifest.sqlite")
+)
+
+# Training runner (separate process for train_multitask)
+TRAINING_RUN_DIR = os.getenv("TRAINING_RUN_DIR", str(Path(PERSIST_BASE) / "training_runs"))
+TRAINING_TORCH_THREADS = int(os.getenv("TRAINING_TORCH_THREADS", "0"))  # 0 = tilgjengelige kjerner delt på ranks
+TRAINING_CV_THREADS = int(os.getenv("TRAINING_CV_THREADS", "1"))
+TRAINING_NICE = int(os.getenv("TRAINING_NICE", "10"))
+TRAINING_CPU_AFFINITY = os.getenv("TRAINING_CPU_AFFINITY", "")  # f.eks. "2,3" eller "2-3"
+TRAINING_WORLD_SIZE = int(os.getenv("TRAINING_WORLD_SIZE", "1"))  # data-parallelle prosesser (gloo)
+
+# Model inference (CPU serving of the exported multitask model)
+MODEL_DIR = os.getenv("MODEL_DIR", str(Path(PERSIST_BASE) / "models"))
+MODEL_NAME = os.getenv("MODEL_NAME", "multitask")
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "")  # "" = float, ellers f.eks. int8 fra quantize.py
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "auto")  # auto | onnx | torchscript
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))  # 0 = bibliotekets default
+INFERENCE_PRELOAD = os.getenv("INFERENCE_PRELOAD", "1") == "1"
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "8"))
+INFERENCE_MAX_DELAY_MS = float(os.getenv("INFERENCE_MAX_DELAY_MS", "5"))
+
+# Fargekalibrering per enhet
+CALIBRATION_LUT_SIZE = int(os.getenv("CALIBRATION_LUT_SIZE", "64"))  # noder per akse i 3D-tabellen
+CALIBRATION_POLL_S = float(os.getenv("CALIBRATION_POLL_S", "5"))  # sjekk etter endrede profiler
+
+# Holdbarhetsprognose (wash)
+WASH_HISTORY_PATH = os.getenv("WASH_HISTORY_PATH", str(Path(PERSIST_BASE) / "wash_history.sqlite"))
+WASH_RECOAT_CQI = float(os.getenv("WASH_RECOAT_CQI", "60"))  # ny coating anbefales under denne CQI
+WASH_RECOAT_SMOOTHNESS = float(os.getenv("WASH_RECOAT_SMOOTHNESS", "40"))
+WASH_MIN_POINTS = int(os.getenv("WASH_MIN_POINTS", "3"))  # analyser før en serie får prognose
+
+# Tidsserier per kjøretøy/panel/metrikk
+TIMESERIES_DIR = os.getenv("TIMESERIES_DIR", str(Path(PERSIST_BASE) / "timeseries"))
+TIMESERIES_MAX_POINTS = int(os.getenv("TIMESERIES_MAX_POINTS", "500"))  # maks punkter per graf (auto)
+
+# Lagring (uploads/outputs): kvoter per type i MB, f.eks. "uploads=20000,outputs=5000"; 0/mangler = ubegrenset
+STORAGE_QUOTAS = {
+    kind.strip(): int(float(mb) * 1024 * 1024)
+    for kind, _, mb in (item.partition("=") for item in os.getenv("STORAGE_QUOTAS_MB", "").split(",") if "=" in item)
+}
+STORAGE_INDEX_PATH = os.getenv("STORAGE_INDEX_PATH") or None  # default: ved siden av mappene
+STORAGE_ORPHAN_GRACE_S = float(os.getenv("STORAGE_ORPHAN_GRACE_S", str(24 * 3600)))
+STORAGE_SWEEP_INTERVAL_S = float(os.getenv("STORAGE_SWEEP_INTERVAL_S", "300"))
+STORAGE_SWEEP_CHECK_ROWS = int(os.getenv("STORAGE_SWEEP_CHECK_ROWS", "2000"))  # indeksrader fil-sjekket per runde
+STORAGE_ACCESS_RESOLUTION_S = float(os.getenv("STORAGE_ACCESS_RESOLUTION_S", "60"))
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", str(Path(PERSIST_BASE) / "jobs.sqlite"))  # jobber eier referanser i lageret
+
+# Levering av artefakter: tillatte bredder for ?w= (rundes opp), lesebiter når sendfile ikke finnes
+ARTIFACT_WIDTHS = sorted(int(w) for w in os.getenv("ARTIFACT_WIDTHS", "160,320,400,640,800,1280").split(",") if w.strip())
+ARTIFACT_CHUNK_BYTES = int(os.getenv("ARTIFACT_CHUNK_KB", "256")) * 1024
+
+# Delt resultat-cache for alle workere på maskinen (SQLite WAL + L1 i prosessen); tom sti = bare L1
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", str(Path(PERSIST_BASE) / "shared_cache.sqlite"))
+SHARED_CACHE_L1_SIZE = int(os.getenv("SHARED_CACHE_L1_SIZE", "256"))
+SHARED_CACHE_TTL_S = float(os.getenv("SHARED_CACHE_TTL_S", "3600"))
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "50000"))
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") not in ("0", "false", "False")
+DASHBOARD_CACHE_TTL_S = float(os.getenv("DASHBOARD_CACHE_TTL_S", "30"))
+
+# Trådbudsjett (se services/concurrency.py); 0 = regnes ut fra cgroup-kvote og antall workere
+CONCURRENCY_WORKERS = int(os.getenv("CONCURRENCY_WORKERS", "0"))  # 0 = WEB_CONCURRENCY
+CONCURRENCY_POOL_SIZE = int(os.getenv("CONCURRENCY_POOL_SIZE", "0"))
+CONCURRENCY_CV_THREADS = int(os.getenv("CONCURRENCY_CV_THREADS", "0"))
+CONCURRENCY_PROFILE = os.getenv("CONCURRENCY_PROFILE", str(Path(PERSIST_BASE) / "concurrency.json"))
+
+# Videoanalyse (/api/analyze/video)
+VIDEO_MAX_UPLOAD_BYTES = int(os.getenv("VIDEO_MAX_UPLOAD_MB", "500")) * 1024 * 1024
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "600"))  # maks analyserte bilder per klipp
+
+# ROI (services/roi.py): siste ROI per live-økt (sessionId), LRU
+ROI_SESSION_CACHE_SIZE = int(os.getenv("ROI_SESSION_CACHE_SIZE", "256"))
+ROI_SESSION_TTL_S = float(os.getenv("ROI_SESSION_TTL_S", str(24 * 3600)))  # ROI per live-økt i den delte cachen
@@ -0,0 +1,267 @@
+"""
+Datasett-manifest for treningsbildene (training_data/, local_data/training_data).
+
+Manifestet er en liten SQLite-fil med én rad per bilde: dimensjoner,
+innholds-hash, etiketter fra TrainingSession/Phase og forhåndsberegnede
+`analyze_coating`-metrikker. Spørringer og train/val-splitt leser bare
+manifestet, aldri selve bildene.
+
+    python -m backend.app.services.dataset_manifest sync training_data local_data/training_data
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .config import DATASET_MANIFEST_PATH
+from .training import TrainingSession
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+LABEL_COLUMNS = ("session_id", "phase", "car_brand", "panel", "color", "color_code")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path        TEXT PRIMARY KEY,
+    sha256      TEXT NOT NULL,
+    size_bytes  INTEGER NOT NULL,
+    mtime_ns    INTEGER NOT NULL,
+    width       INTEGER,
+    height      INTEGER,
+    session_id  TEXT,
+    phase       TEXT,
+    car_brand   TEXT,
+    panel       TEXT,
+    color       TEXT,
+    color_code  TEXT,
+    cvi         REAL,
+    cqi         REAL,
+    metrics     TEXT,
+    split_key   REAL NOT NULL,
+    added_at    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images(sha256);
+CREATE INDEX IF NOT EXISTS idx_images_phase ON images(phase);
+CREATE INDEX IF NOT EXISTS idx_images_split ON images(split_key);
+"""
+
+
+def open_manifest(path: Optional[str] = None) -> sqlite3.Connection:
+    """Open (and create if needed) the manifest database."""
+    db_path = Path(path or DATASET_MANIFEST_PATH)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=30)
+    conn.row_factory = sqlite3.Row
+    # WAL lar trenings-skript lese mens opplastinger skriver
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _split_key(sha256: str) -> float:
+    return int(sha256[:8], 16) / 2 ** 32
+
+
+def _describe_image(data: bytes) -> Tuple[Optional[int], Optional[int], Optional[Dict]]:
+    """Return (width, height, analyze_coating metrics) with a single decode."""
+    # Lazy: OpenCV trengs bare når nye bilder legges til
+    from ..core.coatvision_core import analyze_coating, decode_image_bytes, read_image_size
+
+    size = read_image_size(data)
+    image = decode_image_bytes(data)
+    if image is None:
+        return (size or (None, None)) + (None,)
+    if size is None:
+        size = (image.shape[1], image.shape[0])
+    return size[0], size[1], analyze_coating(image)
+
+
+def _pending_write(
+    conn: sqlite3.Connection,
+    image_path: Path,
+    labels: Optional[Dict[str, str]] = None,
+) -> Optional[Tuple[str, tuple]]:
+    """Return the (sql, params) that brings one image's row up to date, or None if it is current."""
+    image_path = Path(image_path).resolve()
+    stat = image_path.stat()
+    key = image_path.as_posix()
+
+    labels = {k: v for k, v in (labels or {}).items() if k in LABEL_COLUMNS}
+
+    row = conn.execute("SELECT size_bytes, mtime_ns FROM images WHERE path = ?", (key,)).fetchone()
+    if row and row["size_bytes"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+        # Uendret fil: ingen ny dekoding, bare oppdater etiketter om nødvendig
+        if not labels:
+            return None
+        assignments = ", ".join(f"{c} = ?" for c in labels)
+        return f"UPDATE images SET {assignments} WHERE path = ?", (*labels.values(), key)
+
+    data = image_path.read_bytes()
+    sha256 = hashlib.sha256(data).hexdigest()
+    width, height, metrics = _describe_image(data)
+
+    values = {
+        "path": key,
+        "sha256": sha256,
+        "size_bytes": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "width": width,
+        "height": height,
+        "cvi": metrics.get("cvi") if metrics else None,
+        "cqi": metrics.get("cqi") if metrics else None,
+        "metrics": json.dumps(metrics) if metrics else None,
+        "split_key": _split_key(sha256),
+        "added_at": datetime.utcnow().isoformat() + "Z",
+        **labels,
+    }
+    columns = ", ".join(values)
+    placeholders = ", ".join("?" for _ in values)
+    # Etiketter som ikke er oppgitt beholdes fra eksisterende rad
+    updates = ", ".join(f"{c} = excluded.{c}" for c in values if c not in ("path", "added_at"))
+    return (
+        f"INSERT INTO images ({columns}) VALUES ({placeholders}) "
+        f"ON CONFLICT(path) DO UPDATE SET {updates}",
+        tuple(values.values()),
+    )
+
+
+def add_image(
+    conn: sqlite3.Connection,
+    image_path: Path,
+    labels: Optional[Dict[str, str]] = None,
+    commit: bool = True,
+) -> bool:
+    """Add or refresh one image. Returns False if the stored row was already current."""
+    write = _pending_write(conn, image_path, labels)
+    if write is None:
+        return False
+    conn.execute(*write)
+    if commit:
+        conn.commit()
+    return True
+
+
+def upsert_many(
+    conn: sqlite3.Connection,
+    image_paths: Iterable[Path],
+    labels: Optional[Dict[str, str]] = None,
+) -> int:
+    """Add or refresh many images in one transaction; returns how many rows changed.
+
+    Bildene dekodes før transaksjonen starter, så skrivelåsen holdes bare mens
+    radene skrives. Filer som er borte når batchen indekseres hoppes over.
+    """
+    writes = []
+    for path in image_paths:
+        try:
+            write = _pending_write(conn, path, labels)
+        except FileNotFoundError:
+            continue
+        if write is not None:
+            writes.append(write)
+    with conn:
+        for sql, params in writes:
+            conn.execute(sql, params)
+    return len(writes)
+
+
+def record_session(conn: sqlite3.Connection, session: TrainingSession) -> int:
+    """Add every image in a TrainingSession with the session's labels."""
+    labels = session.labels()
+    changed = sum(add_image(conn, p, labels, commit=False) for p in session.image_paths)
+    conn.commit()
+    return changed
+
+
+def sync_directories(conn: sqlite3.Connection, directories: Iterable[Path]) -> Dict[str, int]:
+    """Incrementally index image files; unchanged files are skipped via size/mtime.
+
+    Rows whose file no longer exists under the given directories are removed.
+    """
+    added = 0
+    seen = set()
+    roots = [Path(d).resolve() for d in directories]
+    for root in roots:
+        if not root.is_dir():
+            continue
+        for entry in os.scandir(root):
+            if not entry.is_file() or Path(entry.name).suffix.lower() not in IMAGE_SUFFIXES:
+                continue
+            path = Path(entry.path)
+            seen.add(path.as_posix())
+            added += add_image(conn, path, commit=False)
+
+    removed = 0
+    for root in roots:
+        prefix = root.as_posix().rstrip("/") + "/"
+        rows = conn.execute("SELECT path FROM images WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+        stale = [
+            r["path"] for r in rows
+            if r["path"] not in seen and "/" not in r["path"][len(prefix):]
+        ]
+        conn.executemany("DELETE FROM images WHERE path = ?", [(p,) for p in stale])
+        removed += len(stale)
+    conn.commit()
+    return {"added_or_updated": added, "removed": removed, "total": count(conn)}
+
+
+def has_sha256(conn: sqlite3.Connection, sha256: str) -> bool:
+    """Is an image with this content already in the manifest (under any path)?"""
+    return conn.execute("SELECT 1 FROM images WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone() is not None
+
+
+def count(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+
+def _row_to_dict(row: sqlite3.Row) -> Dict:
+    item = dict(row)
+    item["metrics"] = json.loads(item["metrics"]) if item["metrics"] else None
+    return item
+
+
+def query(conn: sqlite3.Connection, **filters: str) -> List[Dict]:
+    """Return manifest rows matching label filters, e.g. query(conn, phase=..., panel=...)."""
+    unknown = set(filters) - set(LABEL_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown manifest filter(s): {sorted(unknown)}")
+    where = " AND ".join(f"{k} = ?" for k in filters) or "1"
+    rows = conn.execute(f"SELECT * FROM images WHERE {where} ORDER BY path", tuple(filters.values()))
+    return [_row_to_dict(r) for r in rows]
+
+
+def split(
+    conn: sqlite3.Connection, val_fraction: float = 0.2, seed: int = 0, **filters: str
+) -> Tuple[List[Dict], List[Dict]]:
+    """Deterministic train/val split keyed on content hash.
+
+    The same image always lands in the same split for a given seed, so the
+    split is stable as new images arrive.
+    """
+    offset = (seed * 0.6180339887498949) % 1.0
+    train, val = [], []
+    for item in query(conn, **filters):
+        (val if (item["split_key"] + offset) % 1.0 < val_fraction else train).append(item)
+    return train, val
+
+
+def manifest_hash(conn: sqlite3.Connection) -> str:
+    """Hash of all image hashes and labels; changes whenever the dataset does."""
+    digest = hashlib.sha256()
+    cols = ", ".join(("path", "sha256") + LABEL_COLUMNS)
+    for row in conn.execute(f"SELECT {cols} FROM images ORDER BY path"):
+        digest.update(json.dumps(tuple(row)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("sync", "stats"):
+        print("Usage: python -m backend.app.services.dataset_manifest sync <dir> [<dir> ...] | stats")
+        sys.exit(2)
+    _conn = open_manifest()
+    if sys.argv[1] == "sync":
+        print(sync_directories(_conn, [Path(d) for d in sys.argv[2:]]))
+    print({"images": count(_conn), "manifest_hash": manifest_hash(_conn)})
@@ -0,0 +1,312 @@
+"""
+CPU-inferens for multitask-modellen fra coatvision-app/models/train_multitask.py.
+
+Modellen eksporteres med export_multitask.py til TorchScript (og ev. ONNX)
+og lastes én gang per worker-prosess – ved oppstart via `warmup()`, ikke på
+første forespørsel. Forbehandlingen jobber på det allerede dekodede
+BGR-bildet, så bildet dekodes bare én gang per analyse.
+"""
+import hashlib
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import concurrency, shared_cache
+from .batching import MicroBatcher
+from .config import (
+    ANALYSIS_CACHE_ENABLED,
+    INFERENCE_BACKEND,
+    INFERENCE_MAX_BATCH,
+    INFERENCE_MAX_DELAY_MS,
+    INFERENCE_THREADS,
+    MODEL_DIR,
+    MODEL_NAME,
+    MODEL_VARIANT,
+)
+
+ENGINES = ("heuristic", "model", "both")
+ANALYSIS_CACHE_VERSION = 1  # økes når heuristikken endres, så gamle cachede resultater ikke brukes
+
+
+class ModelUnavailable(RuntimeError):
+    """No exported model (or runtime) is available in this process."""
+
+
+def model_file_stem(name: Optional[str] = None, variant: Optional[str] = None) -> str:
+    """Filnavn for en variant fra quantize.py: multitask + int8 -> multitask_int8."""
+    name = MODEL_NAME if name is None else name
+    variant = MODEL_VARIANT if variant is None else variant
+    return f"{name}_{variant}" if variant and variant != "fp32" else name
+
+
+def preprocess(image_bgr: np.ndarray, size: int, mean, std) -> np.ndarray:
+    """Decoded BGR uint8 image -> normalised float32 (3, size, size) RGB."""
+    import cv2  # lazy, som i analyzer.py
+
+    resized = cv2.resize(image_bgr, (size, size), interpolation=cv2.INTER_AREA)
+    rgb = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB).astype(np.float32)
+    rgb *= 1.0 / 255.0
+    rgb -= np.asarray(mean, dtype=np.float32)
+    rgb /= np.asarray(std, dtype=np.float32)
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1))
+
+
+def _softmax(logits: np.ndarray) -> np.ndarray:
+    z = logits - logits.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class ModelEngine:
+    """Wrapper around an exported model (ONNX Runtime or TorchScript)."""
+
+    def __init__(self, model_dir: Path, name: Optional[str] = None, backend: str = INFERENCE_BACKEND,
+                 threads: int = INFERENCE_THREADS):
+        name = name or model_file_stem()
+        self.model_dir = Path(model_dir)
+        meta_path = self.model_dir / f"{name}.json"
+        if not meta_path.exists():
+            raise ModelUnavailable(f"Model metadata not found: {meta_path}")
+        self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.image_size = int(self.meta["image_size"])
+        self.phases: List[str] = self.meta["phases"]
+        self.metrics: List[str] = self.meta["metrics"]
+        self.variant = self.meta.get("variant", "fp32")
+        self._run = None
+
+        onnx_path = self.model_dir / f"{name}.onnx"
+        ts_path = self.model_dir / f"{name}.ts"
+        if backend in ("auto", "onnx") and onnx_path.exists():
+            try:
+                self._load_onnx(onnx_path, threads)
+            except ImportError:
+                if backend == "onnx":
+                    raise ModelUnavailable("onnxruntime is not installed")
+        if self._run is None and backend in ("auto", "torchscript") and ts_path.exists():
+            try:
+                self._load_torchscript(ts_path, threads)
+            except ImportError:
+                raise ModelUnavailable("torch is not installed")
+        if self._run is None:
+            raise ModelUnavailable(f"No loadable {backend} model for '{name}' in {self.model_dir}")
+        # identifiserer nøyaktig denne modellen (nøkkel i resultat-cachen): ny eksport = nye nøkler
+        stat = (onnx_path if self.backend == "onnx" else ts_path).stat()
+        self.fingerprint = hashlib.sha1(
+            f"{json.dumps(self.meta, sort_keys=True)}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+    def _load_onnx(self, path: Path, threads: int) -> None:
+        import onnxruntime as ort  # type: ignore
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+        self.backend = "onnx"
+        self._run = lambda batch: session.run(None, {"images": batch})
+
+    def _load_torchscript(self, path: Path, threads: int) -> None:
+        import torch  # type: ignore
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        engine = self.meta.get("quantized_engine")
+        if engine and engine in torch.backends.quantized.supported_engines:
+            # INT8-varianter må kjøres med samme kvantiseringsmotor som de ble laget for
+            torch.backends.quantized.engine = engine
+        module = torch.jit.load(str(path), map_location="cpu")
+        module.eval()
+
+        def run(batch: np.ndarray):
+            with torch.inference_mode():
+                phase_logits, metrics = module(torch.from_numpy(batch))
+            return phase_logits.numpy(), metrics.numpy()
+
+        self.backend = "torchscript"
+        self._run = run
+
+    def preprocess(self, image_bgr: np.ndarray) -> np.ndarray:
+        return preprocess(image_bgr, self.image_size, self.meta["mean"], self.meta["std"])
+
+    def predict_batch(self, batch: np.ndarray) -> List[Dict[str, Any]]:
+        """Run one forward pass over a preprocessed (N, 3, S, S) float32 batch."""
+        phase_logits, metrics = self._run(np.ascontiguousarray(batch, dtype=np.float32))
+        probs = _softmax(np.asarray(phase_logits))
+        metrics = np.asarray(metrics)
+        results = []
+        for i in range(len(batch)):
+            best = int(probs[i].argmax())
+            result: Dict[str, Any] = {
+                "phase": self.phases[best],
+                "phase_confidence": round(float(probs[i, best]), 4),
+            }
+            for j, key in enumerate(self.metrics):
+                result[key] = round(float(metrics[i, j]) * 100.0, 2)
+            results.append(result)
+        return results
+
+    def predict(self, image_bgr: np.ndarray) -> Dict[str, Any]:
+        return self.predict_batch(self.preprocess(image_bgr)[None])[0]
+
+
+_engine: Optional[ModelEngine] = None
+_engine_error: Optional[str] = None
+_engine_lock = threading.Lock()
+_batcher: Optional[MicroBatcher] = None
+
+
+def get_engine() -> ModelEngine:
+    """Return the process-wide model engine, loading it on first use."""
+    global _engine, _engine_error
+    if _engine is not None:
+        return _engine
+    with _engine_lock:
+        if _engine is None:
+            try:
+                # hele workerens budsjett: batcheren kjører ett forward-pass av gangen
+                threads = INFERENCE_THREADS or max(1, concurrency.current.cpus // concurrency.current.workers)
+                _engine = ModelEngine(Path(MODEL_DIR), threads=threads)
+                _engine_error = None
+            except ModelUnavailable as e:
+                _engine_error = str(e)
+                raise
+    return _engine
+
+
+def warmup() -> bool:
+    """Load the model and run one dummy forward pass. Called at startup."""
+    try:
+        engine = get_engine()
+    except ModelUnavailable as e:
+        logging.info("Model inference disabled: %s", e)
+        return False
+    engine.predict_batch(np.zeros((1, 3, engine.image_size, engine.image_size), dtype=np.float32))
+    logging.info("Model '%s' (%s, %s) loaded", model_file_stem(), engine.backend, engine.variant)
+    return True
+
+
+def get_batcher() -> MicroBatcher:
+    """Micro-batcher bound to the current engine (one per worker process)."""
+    global _batcher
+    engine = get_engine()
+    if _batcher is None or getattr(_batcher, "engine", None) is not engine:
+        _batcher = MicroBatcher(
+            lambda items: engine.predict_batch(np.stack(items)),
+            max_batch=INFERENCE_MAX_BATCH,
+            max_delay_ms=INFERENCE_MAX_DELAY_MS,
+        )
+        _batcher.engine = engine
+    return _batcher
+
+
+async def predict_async(image: np.ndarray) -> Dict[str, Any]:
+    """Predict via the micro-batcher; concurrent callers share forward passes."""
+    batcher = get_batcher()
+    return await batcher.submit(batcher.engine.preprocess(image))
+
+
+def engine_status() -> Dict[str, Any]:
+    if _engine is None:
+        return {"loaded": False, "error": _engine_error}
+    status = {
+        "loaded": True,
+        "backend": _engine.backend,
+        "variant": _engine.variant,
+        "image_size": _engine.image_size,
+        "phases": _engine.phases,
+    }
+    if _batcher is not None:
+        status["batching"] = _batcher.stats()
+    return status
+
+
+def _check_engine(engine: str) -> None:
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+
+
+def _combine(image: np.ndarray, engine: str, prediction: Optional[Dict[str, Any]],
+             calibration=None, defects: bool = False, roi=None) -> Dict[str, Any]:
+    from ..core.coatvision_core import analyze_coating
+
+    if prediction is None:
+        return analyze_coating(image, calibration, defects=defects, roi=roi)
+    prediction["engine"] = "model"
+    if engine == "model":
+        return prediction
+    metrics = analyze_coating(image, calibration, defects=defects, roi=roi)
+    metrics["model"] = prediction
+    return metrics
+
+
+def analyze(image: np.ndarray, engine: str = "heuristic", calibration=None, defects: bool = False,
+            roi=None) -> Dict[str, Any]:
+    """Run the selected engine(s) on an already-decoded BGR image.
+
+    `calibration` (device colour profile) applies to the heuristic metrics; the
+    model sees the raw image it was trained on. `defects` adds localized defect
+    regions to the heuristic metrics (ignored for engine="model"); so does `roi`
+    (services.roi.RoiSpec), which limits them to the panel.
+    """
+    _check_engine(engine)
+    prediction = None if engine == "heuristic" else get_engine().predict(image)
+    return _combine(image, engine, prediction, calibration, defects, roi)
+
+
+async def analyze_async(image: np.ndarray, engine: str = "heuristic", calibration=None,
+                        defects: bool = False, roi=None) -> Dict[str, Any]:
+    """Like `analyze`, but model predictions go through the micro-batcher and the
+    heuristic runs in the worker's analysis pool, off the event loop."""
+    _check_engine(engine)
+    prediction = None if engine == "heuristic" else await predict_async(image)
+    return await concurrency.run_cpu(_combine, image, engine, prediction, calibration, defects, roi)
+
+
+def result_cache_key(data: bytes, engine: str = "heuristic", calibration=None, defects: bool = False,
+                     roi=None) -> str:
+    """Nøkkel for analyseresultatet av de kodede bildebytene (samme for alle workere)."""
+    from ..core.coatvision_core import ANALYSIS_MAX_SIDE
+
+    parts = [f"analysis:v{ANALYSIS_CACHE_VERSION}", engine + ("+defects" if defects else ""), str(ANALYSIS_MAX_SIDE),
+             hashlib.blake2b(data, digest_size=16).hexdigest(),
+             calibration.cache_key if calibration is not None else "-", roi.key if roi is not None else "-"]
+    if engine != "heuristic":
+        parts.append(get_engine().fingerprint)
+    return ":".join(parts)
+
+
+async def analyze_bytes_async(data: bytes, engine: str = "heuristic", calibration=None,
+                              defects: bool = False, roi=None) -> Optional[Dict[str, Any]]:
+    """Dekod og analyser et kodet bilde, via den delte resultat-cachen.
+
+    Samme bilde (f.eks. en retry, eller samme URL fra flere klienter) analyseres
+    én gang per maskin, uansett hvilken worker som får forespørselen. Returnerer
+    None hvis bytene ikke er et bilde.
+    """
+    metrics, _ = await analyze_bytes_cached_async(data, engine, calibration, defects=defects, roi=roi)
+    return metrics
+
+
+async def analyze_bytes_cached_async(data: bytes, engine: str = "heuristic", calibration=None,
+                                     defects: bool = False, roi=None) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """Som `analyze_bytes_async`, men returnerer også om svaret kom fra cachen."""
+    from ..core.coatvision_core import decode_image_bytes
+
+    _check_engine(engine)
+    key = result_cache_key(data, engine, calibration, defects, roi) if ANALYSIS_CACHE_ENABLED else None
+    if key is not None:
+        cached = await shared_cache.cache.get_async(key)
+        if cached is not None:
+            return cached, True
+    image = await concurrency.run_cpu(decode_image_bytes, data)
+    if image is None:
+        return None, False
+    metrics = await analyze_async(image, engine, calibration, defects=defects, roi=roi)
+    if key is not None:
+        await shared_cache.cache.set_async(key, metrics)
+    return metrics, False
@@ -0,0 +1,87 @@
+"""
+Jobber (/api/jobs) lagret i SQLite, ikke i minnet.
+
+En jobb holder referanser ("job:<id>") til opplastinger i blob-lageret, og
+referansene ligger varig i lagerets indeks. Jobbene må derfor overleve en
+omstart og være de samme i alle workere; ellers blir opplastingene låst for
+alltid. `reconcile_refs` fjerner referanser fra jobber som ikke finnes
+(f.eks. fra før jobbene ble lagret).
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .config import JOBS_DB_PATH
+
+OWNER_PREFIX = "job:"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq   INTEGER PRIMARY KEY AUTOINCREMENT,  -- AUTOINCREMENT: id-er gjenbrukes ikke etter sletting
+    data  TEXT NOT NULL
+);
+"""
+
+
+def _seq(job_id: str) -> Optional[int]:
+    prefix, _, num = (job_id or "").partition("_")
+    return int(num) if prefix == "job" and num.isdigit() else None
+
+
+class JobStore:
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def create(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            cur = self.conn.execute("INSERT INTO jobs (data) VALUES ('{}')")
+            job = {**job, "id": f"job_{cur.lastrowid}"}
+            self.conn.execute("UPDATE jobs SET data = ? WHERE seq = ?", (json.dumps(job, default=str), cur.lastrowid))
+            self.conn.commit()
+        return job
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [json.loads(r[0]) for r in self.conn.execute("SELECT data FROM jobs ORDER BY seq")]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        seq = _seq(job_id)
+        if seq is None:
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM jobs WHERE seq = ?", (seq,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self.get(job_id)
+        if job is not None:
+            with self._lock:
+                self.conn.execute("DELETE FROM jobs WHERE seq = ?", (_seq(job_id),))
+                self.conn.commit()
+        return job
+
+    def reconcile_refs(self, blob_store) -> int:
+        """Fjern "job:*"-referanser i lageret for jobber som ikke finnes. Returnerer antall fjernet."""
+        known = {OWNER_PREFIX + job["id"] for job in self.list()}
+        released = 0
+        for owner in blob_store.owners(OWNER_PREFIX):
+            if owner not in known:
+                released += blob_store.release(owner)
+        return released
+
+
+store = JobStore()
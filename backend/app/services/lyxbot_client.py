@@ -0,0 +1,233 @@
+"""
+Felles async OpenAI-klient for LYXbot.
+
+Klienten lages først ved første bruk (ikke ved import), deler én httpx-pool
+med keep-alive, og et semafor begrenser antall samtidige kall mot API-et.
+Svar på enkeltmeldinger caches (TTL + LRU) på normalisert tekst, så de mange
+like FAQ-spørsmålene besvares uten nytt modellkall. `sse_chat` strømmer svaret
+token for token som Server-Sent Events.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from .config import (
+    LYXBOT_CACHE_SIZE,
+    LYXBOT_CACHE_TTL_S,
+    LYXBOT_MAX_CONCURRENCY,
+    LYXBOT_TIMEOUT_S,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_MODEL,
+)
+
+Messages = List[Dict[str, str]]
+
+
+class LyxbotUnavailable(RuntimeError):
+    """No API key / client library configured for LYXbot."""
+
+
+class TTLCache:
+    """Liten LRU-cache der hver verdi utløper etter `ttl` sekunder."""
+
+    def __init__(self, maxsize: int = LYXBOT_CACHE_SIZE, ttl: float = LYXBOT_CACHE_TTL_S):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: str, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+response_cache = TTLCache()
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(text: str) -> str:
+    """'  Hvordan vasker jeg bilen?? ' -> 'hvordan vasker jeg bilen'."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _WHITESPACE.sub(" ", text).strip(" ?!.,;:")
+
+
+def cache_key(system_prompt: str, message: str, model: str = OPENAI_MODEL) -> str:
+    raw = "\x1f".join((model, system_prompt, normalize_message(message)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def build_messages(system_prompt: str, message: str) -> Messages:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": message},
+    ]
+
+
+class _LoopState:
+    """Klient og semafor hører til én event-loop (ny loop i tester -> ny state)."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        try:
+            import httpx
+            from openai import AsyncOpenAI
+        except ImportError as e:
+            raise LyxbotUnavailable(f"openai/httpx is not installed: {e}")
+        if not OPENAI_API_KEY:
+            raise LyxbotUnavailable("OPENAI_API_KEY is not set")
+        self.loop = loop
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LYXBOT_MAX_CONCURRENCY * 2,
+                                max_keepalive_connections=LYXBOT_MAX_CONCURRENCY),
+            timeout=httpx.Timeout(LYXBOT_TIMEOUT_S, connect=5.0),
+        )
+        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL,
+                                  http_client=self.http, max_retries=2)
+        self.semaphore = asyncio.Semaphore(LYXBOT_MAX_CONCURRENCY)
+        self.inflight: Dict[str, asyncio.Future] = {}
+
+
+_state: Optional[_LoopState] = None
+
+
+def _get_state() -> _LoopState:
+    global _state
+    loop = asyncio.get_running_loop()
+    if _state is None or _state.loop is not loop:
+        _state = _LoopState(loop)
+    return _state
+
+
+async def aclose() -> None:
+    """Lukk httpx-poolen (ved nedstenging)."""
+    global _state
+    if _state is not None:
+        state, _state = _state, None
+        await state.http.aclose()
+
+
+async def _create(messages: Messages, model: str) -> str:
+    state = _get_state()
+    async with state.semaphore:
+        completion = await state.client.chat.completions.create(model=model, messages=messages)
+    return completion.choices[0].message.content or ""
+
+
+async def complete(messages: Messages, key: Optional[str] = None, model: str = OPENAI_MODEL) -> Tuple[str, bool]:
+    """Returnerer (svar, fra_cache). Like samtidige spørsmål deler ett modellkall."""
+    if key is None:
+        return await _create(messages, model), False
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached, True
+
+    state = _get_state()
+    pending = state.inflight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending), True
+
+    future = state.loop.create_future()
+    state.inflight[key] = future
+    try:
+        reply = await _create(messages, model)
+        if reply:
+            response_cache.set(key, reply)
+        future.set_result(reply)
+        return reply, False
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # markert som hentet, ingen "never retrieved"-advarsel
+        raise
+    finally:
+        state.inflight.pop(key, None)
+
+
+async def stream(messages: Messages, model: str = OPENAI_MODEL) -> AsyncIterator[str]:
+    """Tekstbiter fra modellen etter hvert som de kommer."""
+    state = _get_state()
+    async with state.semaphore:
+        response = await state.client.chat.completions.create(model=model, messages=messages, stream=True)
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def sse_chat(
+    messages: Messages,
+    key: Optional[str] = None,
+    fallback: str = "",
+    on_complete: Optional[Callable[[str], Any]] = None,
+    model: str = OPENAI_MODEL,
+):
+    """StreamingResponse med `data: {"delta": ...}`-hendelser og til slutt `{"done": true}`."""
+    from fastapi.responses import StreamingResponse
+
+    async def events() -> AsyncIterator[str]:
+        cached = response_cache.get(key) if key else None
+        if cached is not None:
+            yield _sse({"delta": cached})
+            reply = cached
+        else:
+            parts: List[str] = []
+            try:
+                async for delta in stream(messages, model):
+                    parts.append(delta)
+                    yield _sse({"delta": delta})
+            except LyxbotUnavailable as e:
+                yield _sse({"detail": str(e)}, event="error")
+                return
+            except Exception as e:
+                logging.warning("LYXbot stream failed: %r", e)
+                yield _sse({"detail": "Feil mot AI-tjenesten. Prøv igjen senere."}, event="error")
+                return
+            reply = "".join(parts)
+            if not reply and fallback:
+                yield _sse({"delta": fallback})  # bare til klienten: fallback er ikke et svar fra modellen
+            elif key and reply:
+                response_cache.set(key, reply)
+        if on_complete is not None and reply:
+            result = on_complete(reply)
+            if asyncio.iscoroutine(result):
+                await result
+        yield _sse({"done": True, "cached": cached is not None})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
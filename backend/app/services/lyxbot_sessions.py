@@ -0,0 +1,313 @@
+"""
+Server-side samtaler for LYXbot med token-budsjettert kontekst.
+
+Hver samtale lagres kompakt (rolle, tekst, tokenantall per tur). Med `path`
+ligger samtalene i en SQLite-fil (WAL) som alle uvicorn-workere på maskinen
+deler, så en samtale kan fortsette uansett hvilken worker neste melding
+havner hos; hver runde leses og skrives i én IMMEDIATE-transaksjon. Uten
+`path` holdes de bare i denne prosessen (tester, én worker). Fra async-kode
+brukes `*_async`-variantene: i SQLite-modus kan en runde vente på skrivelåsen
+(busy timeout), og det skal skje i threadpoolen, ikke på event-loopen.
+
+Konteksten til modellen bygges slik at den holder seg under et fast budsjett:
+
+    [systemprompt (festet)] [sammendrag av eldre turer] [nyeste turer] [ny melding]
+
+Turer som ikke får plass brettes inn i et løpende, uttrekkende sammendrag
+med eget tak, så promptstørrelsen holder seg flat uansett hvor lang samtalen
+blir. Sammendraget lages uten ekstra modellkall. Systemprompten (det statiske
+prefikset) og tokentellingen for den caches, og ligger alltid først, slik at
+API-ets prompt-caching treffer.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import (
+    LYXBOT_CONTEXT_TOKENS,
+    LYXBOT_MAX_SESSIONS,
+    LYXBOT_SESSION_MAX_TURNS,
+    LYXBOT_SESSION_TTL_S,
+    LYXBOT_SESSIONS_PATH,
+    LYXBOT_SUMMARY_TOKENS,
+    OPENAI_MODEL,
+)
+
+Messages = List[Dict[str, str]]
+
+MESSAGE_OVERHEAD = 4  # rolle/skilletegn per melding i chat-formatet
+SUMMARY_LINE_CHARS = 160
+SESSION_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+SUMMARY_HEADER = "Sammendrag av tidligere i samtalen:\n"
+_SPEAKERS = {"user": "Bruker", "assistant": "LYXbot"}
+
+
+@lru_cache(maxsize=1)
+def _encoder():
+    try:
+        import tiktoken  # valgfritt; uten den brukes et tegnbasert anslag
+
+        try:
+            return tiktoken.encoding_for_model(OPENAI_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    encoder = _encoder()
+    if encoder is not None:
+        return len(encoder.encode(text or ""))
+    return len(text or "") // 4 + 1
+
+
+def message_tokens(content: str) -> int:
+    return estimate_tokens(content) + MESSAGE_OVERHEAD
+
+
+@lru_cache(maxsize=16)
+def prompt_prefix(system_prompt: str) -> Tuple[Dict[str, str], int]:
+    """Den festede systemmeldingen og tokenantallet – beregnes én gang per prompt."""
+    return {"role": "system", "content": system_prompt}, message_tokens(system_prompt)
+
+
+class InvalidSessionId(ValueError):
+    pass
+
+
+@dataclass
+class Conversation:
+    turns: Deque[Tuple[str, str, int]] = field(default_factory=deque)  # (rolle, tekst, tokens)
+    summary_lines: Deque[str] = field(default_factory=deque)
+    summary_tokens: int = 0
+    updated_at: float = field(default_factory=time.time)  # veggklokke: deles mellom prosesser
+    total_turns: int = 0
+
+    @property
+    def summary(self) -> str:
+        return "\n".join(self.summary_lines)
+
+    def to_json(self) -> str:
+        return json.dumps({"turns": list(self.turns), "summary_lines": list(self.summary_lines),
+                           "summary_tokens": self.summary_tokens, "total_turns": self.total_turns},
+                          ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, data: str, updated_at: float) -> "Conversation":
+        raw = json.loads(data)
+        return cls(turns=deque(tuple(t) for t in raw["turns"]), summary_lines=deque(raw["summary_lines"]),
+                   summary_tokens=raw["summary_tokens"], updated_at=updated_at, total_turns=raw["total_turns"])
+
+
+def _first_sentence(text: str) -> str:
+    text = " ".join(text.split())
+    match = re.search(r"[.!?](\s|$)", text)
+    if match and match.end() <= SUMMARY_LINE_CHARS:
+        return text[:match.end()].strip()
+    return text[:SUMMARY_LINE_CHARS].rstrip() + ("…" if len(text) > SUMMARY_LINE_CHARS else "")
+
+
+def _check_id(session_id: str) -> None:
+    if not SESSION_ID_RE.match(session_id or ""):
+        raise InvalidSessionId("session_id must be 8-64 characters of [A-Za-z0-9_-]")
+
+
+class ConversationStore:
+    """LRU + TTL-begrenset lager av samtaler, i prosessen eller delt via SQLite (`path`)."""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_sessions: int = LYXBOT_MAX_SESSIONS,
+        ttl: float = LYXBOT_SESSION_TTL_S,
+        max_turns: int = LYXBOT_SESSION_MAX_TURNS,
+        context_tokens: int = LYXBOT_CONTEXT_TOKENS,
+        summary_tokens: int = LYXBOT_SUMMARY_TOKENS,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.context_tokens = context_tokens
+        self.summary_tokens = summary_tokens
+        self.path = Path(path) if path else None
+        self._sessions: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # ny tilkobling etter fork: en SQLite-tilkobling må ikke deles mellom prosesser
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated_at)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    @contextmanager
+    def _session(self, session_id: str, create: bool, write: bool = True) -> Iterator[Optional[Conversation]]:
+        """Samtalen for én lese-endre-skriv-runde; i SQLite-modus som én transaksjon."""
+        _check_id(session_id)
+        with self._lock:
+            if self.path is None:
+                yield self._get(session_id, create)
+                return
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")  # skrivelås nå: to workere kan ikke flette samme samtale
+            try:
+                conv = self._load(conn, session_id, create)
+                yield conv
+                if conv is not None and write:
+                    conn.execute("INSERT OR REPLACE INTO sessions(session_id, data, updated_at) VALUES (?, ?, ?)",
+                                 (session_id, conv.to_json(), conv.updated_at))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def _load(self, conn: sqlite3.Connection, session_id: str, create: bool) -> Optional[Conversation]:
+        now = time.time()
+        row = conn.execute("SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is not None and now - row[1] <= self.ttl:
+            conv = Conversation.from_json(row[0], updated_at=now)
+        elif create:
+            conv = Conversation(updated_at=now)
+            # ny samtale: rydd utløpte og hold antallet under taket (eldste først)
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM sessions WHERE session_id IN (SELECT session_id FROM sessions "
+                "WHERE session_id != ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                (session_id, max(self.max_sessions - 1, 0)))
+        else:
+            conv = None
+        return conv
+
+    def _get(self, session_id: str, create: bool) -> Optional[Conversation]:
+        now = time.time()
+        conv = self._sessions.get(session_id)
+        if conv is not None and now - conv.updated_at > self.ttl:
+            del self._sessions[session_id]
+            conv = None
+        if conv is None and create:
+            conv = self._sessions[session_id] = Conversation(updated_at=now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        if conv is not None:
+            conv.updated_at = now
+            self._sessions.move_to_end(session_id)
+        return conv
+
+    def _fold(self, conv: Conversation, count: int) -> None:
+        """Flytt de `count` eldste turene inn i sammendraget (med eget token-tak)."""
+        for _ in range(count):
+            role, content, _ = conv.turns.popleft()
+            line = f"{_SPEAKERS.get(role, role)}: {_first_sentence(content)}"
+            conv.summary_lines.append(line)
+            conv.summary_tokens += estimate_tokens(line) + 1
+        while conv.summary_lines and conv.summary_tokens > self.summary_tokens:
+            dropped = conv.summary_lines.popleft()
+            conv.summary_tokens -= estimate_tokens(dropped) + 1
+
+    def context(self, session_id: str, system_prompt: str, message: str,
+                budget: Optional[int] = None) -> Messages:
+        """Meldingslisten til modellen for en ny brukermelding i samtalen."""
+        budget = budget or self.context_tokens
+        system, system_tokens = prompt_prefix(system_prompt)
+        with self._session(session_id, create=True) as conv:
+            # sammendraget har eget tak; reserver det så totalen aldri går over budsjettet
+            summary_reserve = 0
+            if conv.turns or conv.summary_lines:
+                summary_reserve = self.summary_tokens + message_tokens(SUMMARY_HEADER)
+            remaining = budget - system_tokens - message_tokens(message) - summary_reserve
+
+            keep = 0
+            for _, _, tokens in reversed(conv.turns):
+                if tokens > remaining:
+                    break
+                remaining -= tokens
+                keep += 1
+            # konteksten skal starte med en brukertur, ikke et svar uten spørsmål
+            while keep and conv.turns[len(conv.turns) - keep][0] != "user":
+                keep -= 1
+            self._fold(conv, len(conv.turns) - keep)
+
+            messages = [system]
+            if conv.summary_lines:
+                messages.append({"role": "system", "content": SUMMARY_HEADER + conv.summary})
+            messages.extend({"role": role, "content": content} for role, content, _ in conv.turns)
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def record(self, session_id: str, message: str, reply: str) -> None:
+        """Lagre en fullført runde (brukermelding + svar). Uten svar lagres ingenting."""
+        if not reply:
+            return
+        with self._session(session_id, create=True) as conv:
+            conv.turns.append(("user", message, message_tokens(message)))
+            conv.turns.append(("assistant", reply, message_tokens(reply)))
+            conv.total_turns += 2
+            if len(conv.turns) > self.max_turns:
+                self._fold(conv, len(conv.turns) - self.max_turns)
+
+    def info(self, session_id: str) -> Optional[Dict]:
+        with self._session(session_id, create=False, write=False) as conv:
+            if conv is None:
+                return None
+            return {
+                "session_id": session_id,
+                "turns": len(conv.turns),
+                "total_turns": conv.total_turns,
+                "history_tokens": sum(t for _, _, t in conv.turns),
+                "summary": conv.summary,
+                "summary_tokens": conv.summary_tokens,
+            }
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if self.path is None:
+                return self._sessions.pop(session_id, None) is not None
+            return self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    async def _run(self, fn, *args):
+        if self.path is None:
+            return fn(*args)  # bare minne: ingen I/O å vente på
+        return await run_in_threadpool(fn, *args)
+
+    async def context_async(self, session_id: str, system_prompt: str, message: str,
+                            budget: Optional[int] = None) -> Messages:
+        return await self._run(self.context, session_id, system_prompt, message, budget)
+
+    async def record_async(self, session_id: str, message: str, reply: str) -> None:
+        await self._run(self.record, session_id, message, reply)
+
+    async def info_async(self, session_id: str) -> Optional[Dict]:
+        return await self._run(self.info, session_id)
+
+    async def delete_async(self, session_id: str) -> bool:
+        return await self._run(self.delete, session_id)
+
+    def __len__(self) -> int:
+        if self.path is None:
+            return len(self._sessions)
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+store = ConversationStore(LYXBOT_SESSIONS_PATH)
@@ -0,0 +1,217 @@
+"""
+Område (ROI) som analysen skal begrenses til: rektangel, polygon eller maske.
+
+Koordinatene er relative (0-1) til bildets bredde/høyde, så de gjelder også
+når serveren dekoder bildet nedskalert. En maske er et gråtonebilde (base64
+PNG/JPEG, ikke-null = innenfor) i vilkårlig oppløsning.
+
+`RoiSpec.region(shape)` gir utsnittet (bounding box) og masken beskåret til
+utsnittet, cachet per bildestørrelse. For live-strømmer holdes spesifikasjonen
+per `sessionId`, så masken bygges én gang og gjenbrukes for hvert bilde. Den
+rå spesifikasjonen ligger i den delte resultat-cachen, så en frame uten `roi`
+får samme maske uansett hvilken worker den havner hos; hver worker bygger
+`RoiSpec` lokalt og gjenbruker den så lenge nøkkelen er den samme.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from . import shared_cache
+from .config import ROI_SESSION_CACHE_SIZE, ROI_SESSION_TTL_S
+
+
+class RoiError(ValueError):
+    pass
+
+
+@dataclass
+class Region:
+    x: int
+    y: int
+    w: int
+    h: int
+    mask: Optional[np.ndarray]  # uint8 0/255 i utsnittets størrelse, None = hele utsnittet
+    area: float  # andel av bildet som er innenfor
+
+    def summary(self) -> Dict[str, Any]:
+        return {"x": self.x, "y": self.y, "w": self.w, "h": self.h, "area": round(self.area * 100, 2)}
+
+
+def _points(values, name: str, count: Optional[int] = None) -> np.ndarray:
+    try:
+        arr = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise RoiError(f"roi.{name} must be numeric")
+    if count is not None and arr.shape != (count,):
+        raise RoiError(f"roi.{name} must have {count} values")
+    if not np.all(np.isfinite(arr)) or arr.min(initial=0) < 0 or arr.max(initial=0) > 1:
+        raise RoiError(f"roi.{name} must use relative coordinates in [0, 1]")
+    return arr
+
+
+class RoiSpec:
+    def __init__(self, rect=None, polygon=None, mask: Optional[np.ndarray] = None):
+        given = [v is not None for v in (rect, polygon, mask)]
+        if sum(given) != 1:
+            raise RoiError("Specify exactly one of roi.rect, roi.polygon or roi.mask")
+        self.rect = None if rect is None else _points(rect, "rect", 4)
+        self.polygon = None
+        if polygon is not None:
+            self.polygon = _points(polygon, "polygon")
+            if self.polygon.ndim != 2 or self.polygon.shape[1] != 2 or len(self.polygon) < 3:
+                raise RoiError("roi.polygon must be a list of at least 3 [x, y] points")
+        self.mask = mask
+        digest = hashlib.sha1()
+        for part in (self.rect, self.polygon):
+            digest.update(b"-" if part is None else np.round(part, 6).tobytes())
+        if mask is not None:
+            digest.update(f"{mask.shape}".encode() + mask.tobytes())
+        self.key = digest.hexdigest()[:16]
+        self._regions: "OrderedDict[Tuple[int, int], Region]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def region(self, shape) -> Region:
+        """Utsnitt + maske for et bilde med `shape` (cachet; live-bilder har samme størrelse)."""
+        key = (int(shape[0]), int(shape[1]))
+        with self._lock:
+            region = self._regions.get(key)
+            if region is not None:
+                self._regions.move_to_end(key)
+                return region
+        region = self._build(*key)
+        with self._lock:
+            self._regions[key] = region
+            while len(self._regions) > 4:
+                self._regions.popitem(last=False)
+        return region
+
+    def _build(self, height: int, width: int) -> Region:
+        if self.rect is not None:
+            rx, ry, rw, rh = self.rect
+            x0, y0 = int(rx * width), int(ry * height)
+            x1, y1 = min(width, int(round((rx + rw) * width))), min(height, int(round((ry + rh) * height)))
+            if x1 <= x0 or y1 <= y0:
+                raise RoiError("ROI is empty")
+            return Region(x0, y0, x1 - x0, y1 - y0, None, (x1 - x0) * (y1 - y0) / (width * height))
+
+        if self.polygon is not None:
+            pts = np.round(self.polygon * [width - 1, height - 1]).astype(np.int32)
+            x, y, w, h = cv2.boundingRect(pts)
+            mask = np.zeros((h, w), np.uint8)
+            cv2.fillPoly(mask, [pts - [x, y]], 255)
+        else:
+            full = cv2.resize(self.mask, (width, height), interpolation=cv2.INTER_NEAREST)
+            nonzero = cv2.findNonZero(full)
+            if nonzero is None:
+                raise RoiError("ROI is empty")
+            x, y, w, h = cv2.boundingRect(nonzero)
+            mask = np.where(full[y:y + h, x:x + w] > 0, 255, 0).astype(np.uint8)
+        inside = cv2.countNonZero(mask)
+        if inside == 0:
+            raise RoiError("ROI is empty")
+        return Region(x, y, w, h, mask, inside / (width * height))
+
+
+def parse_roi(data: Optional[Any]) -> Optional[RoiSpec]:
+    """`{"rect": [x, y, w, h]}`, `{"polygon": [[x, y], ...]}` eller `{"mask": "<base64>"}` (også som JSON-tekst)."""
+    if data is None or data == "":
+        return None
+    if isinstance(data, str):
+        try:
+            data = json.loads(data)
+        except ValueError:
+            raise RoiError("roi must be a JSON object")
+    if not isinstance(data, dict):
+        raise RoiError("roi must be an object with rect, polygon or mask")
+    mask = None
+    if data.get("mask") is not None:
+        try:
+            raw = base64.b64decode(data["mask"], validate=True)
+        except (binascii.Error, TypeError, ValueError):
+            raise RoiError("roi.mask must be a base64-encoded image")
+        mask = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            raise RoiError("roi.mask could not be decoded")
+    return RoiSpec(rect=data.get("rect"), polygon=data.get("polygon"), mask=mask)
+
+
+def _shared_key(session_id: str) -> str:
+    return f"roi:session:{session_id}"
+
+
+def _raw(data: Any) -> Dict[str, Any]:
+    return json.loads(data) if isinstance(data, str) else data
+
+
+class SessionRois:
+    """Siste ROI per live-økt, så klienten bare sender masken når den endres.
+
+    Rå spesifikasjon i `shared_cache` (delt mellom workere), ferdigbygde
+    `RoiSpec` i en lokal LRU.
+    """
+
+    def __init__(self, maxsize: int = ROI_SESSION_CACHE_SIZE, ttl: float = ROI_SESSION_TTL_S):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._specs: "OrderedDict[str, RoiSpec]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, session_id: str, spec: RoiSpec) -> RoiSpec:
+        with self._lock:
+            current = self._specs.get(session_id)
+            if current is not None and current.key == spec.key:
+                spec = current  # samme ROI: behold de ferdigbygde maskene
+            self._specs[session_id] = spec
+            self._specs.move_to_end(session_id)
+            while len(self._specs) > self.maxsize:
+                self._specs.popitem(last=False)
+            return spec
+
+    def _from_shared(self, session_id: str, shared: Optional[Dict[str, Any]]) -> Optional[RoiSpec]:
+        if shared is None:
+            with self._lock:
+                self._specs.pop(session_id, None)
+            return None
+        with self._lock:
+            local = self._specs.get(session_id)
+            if local is not None and local.key == shared["key"]:
+                self._specs.move_to_end(session_id)
+                return local
+        # satt (eller endret) via en annen worker: bygg den her
+        return self._remember(session_id, parse_roi(shared["roi"]))
+
+    def resolve(self, session_id: Optional[str], data: Optional[Any]) -> Optional[RoiSpec]:
+        spec = parse_roi(data)
+        if not session_id:
+            return spec
+        if spec is not None:
+            shared_cache.cache.set(_shared_key(session_id), {"key": spec.key, "roi": _raw(data)}, ttl=self.ttl)
+            return self._remember(session_id, spec)
+        return self._from_shared(session_id, shared_cache.cache.get(_shared_key(session_id)))
+
+    async def resolve_async(self, session_id: Optional[str], data: Optional[Any]) -> Optional[RoiSpec]:
+        """Som `resolve`, men oppslag/skriving i den delte cachen skjer utenfor event-loopen."""
+        spec = parse_roi(data)
+        if not session_id:
+            return spec
+        if spec is not None:
+            await shared_cache.cache.set_async(_shared_key(session_id), {"key": spec.key, "roi": _raw(data)},
+                                               ttl=self.ttl)
+            return self._remember(session_id, spec)
+        return self._from_shared(session_id, await shared_cache.cache.get_async(_shared_key(session_id)))
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._specs.pop(session_id, None)
+        shared_cache.cache.delete(_shared_key(session_id))
+
+
+sessions = SessionRois()
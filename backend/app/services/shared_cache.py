@@ -0,0 +1,198 @@
+"""
+Resultat-cache som deles av alle uvicorn-workere på samme maskin.
+
+To nivåer:
+
+- L1: liten LRU i prosessen (ingen I/O). Holder den kodede JSON-en, så hver
+  kaller får sin egen kopi og kan endre resultatet uten å skade cachen.
+- L2: SQLite i WAL-modus på lokal disk. Lesere blokkerer ikke skrivere, og
+  siden filen ligger i sidecachen er et treff noen mikrosekunder. Det en
+  worker har regnet ut, finner de andre her.
+
+Verdiene er JSON (metrikker, dashboard-tall), ikke pickle – filen kan deles
+mellom prosesser uten at en av dem kan få de andre til å kjøre kode.
+Utløpte rader ryddes med jevne mellomrom ved skriving, og tabellen holdes
+under `max_entries` ved å slette de eldste.
+
+Fra async-kode brukes `*_async`-variantene: L2-oppslag, skriving og `compute`
+(f.eks. et Supabase-kall) kjøres i threadpoolen, ikke på event-loopen. Et
+L1-treff besvares direkte uten trådbytte.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .config import SHARED_CACHE_L1_SIZE, SHARED_CACHE_MAX_ENTRIES, SHARED_CACHE_PATH, SHARED_CACHE_TTL_S
+
+_PURGE_EVERY = 256  # skrivinger mellom hver opprydding
+
+
+class SharedCache:
+    def __init__(self, path: Optional[str] = SHARED_CACHE_PATH, l1_size: int = SHARED_CACHE_L1_SIZE,
+                 ttl: float = SHARED_CACHE_TTL_S, max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = Path(path) if path else None  # None/"" = bare L1
+        self.l1_size = l1_size
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._l1: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self.l1_hits = self.l2_hits = self.misses = self.errors = 0
+
+    @property
+    def conn(self) -> Optional[sqlite3.Connection]:
+        # ny tilkobling etter fork: en SQLite-tilkobling må ikke deles mellom prosesser
+        if self.path is None:
+            return None
+        if self._conn is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), timeout=5.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")  # en cache tåler å miste siste skriving ved strømbrudd
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, created REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache(created)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    # -- L1 ----------------------------------------------------------------
+
+    def _l1_get(self, key: str, now: float) -> Tuple[bool, Optional[str]]:
+        item = self._l1.get(key)
+        if item is None:
+            return False, None
+        if item[0] < now:
+            del self._l1[key]
+            return False, None
+        self._l1.move_to_end(key)
+        return True, item[1]
+
+    def _l1_set(self, key: str, encoded: str, expires: float) -> None:
+        if self.l1_size <= 0:
+            return
+        self._l1[key] = (expires, encoded)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_size:
+            self._l1.popitem(last=False)
+
+    # -- API ---------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            found, encoded = self._l1_get(key, now)
+            if found:
+                self.l1_hits += 1
+                return json.loads(encoded)
+            try:
+                row = self.conn.execute("SELECT value, expires FROM cache WHERE key = ? AND expires > ?",
+                                        (key, now)).fetchone() if self.path else None
+            except (sqlite3.Error, OSError):
+                self.errors += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._l1_set(key, row[0], row[1])
+            self.l2_hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        encoded = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            self._l1_set(key, encoded, expires)
+            if self.path is None:
+                return
+            try:
+                self.conn.execute("INSERT OR REPLACE INTO cache(key, value, expires, created) VALUES (?, ?, ?, ?)",
+                                  (key, encoded, expires, now))
+                self._writes += 1
+                if self._writes % _PURGE_EVERY == 0:
+                    self._purge(now)
+            except (sqlite3.Error, OSError):
+                self.errors += 1
+
+    def _purge(self, now: float) -> None:
+        self.conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+        if self.max_entries > 0:
+            self.conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+        return value
+
+    def _l1_lookup(self, key: str) -> Tuple[bool, Optional[Any]]:
+        with self._lock:
+            found, encoded = self._l1_get(key, time.time())
+            if found:
+                self.l1_hits += 1
+        return found, json.loads(encoded) if found else None
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        found, value = self._l1_lookup(key)
+        if found:
+            return value
+        return await run_in_threadpool(self.get, key)
+
+    async def set_async(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        if self.path is None:
+            self.set(key, value, ttl)  # bare L1: ingen I/O
+            return
+        await run_in_threadpool(self.set, key, value, ttl)
+
+    async def get_or_compute_async(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None) -> Any:
+        """Som `get_or_compute`, men `compute` er blokkerende I/O og kjøres i threadpoolen."""
+        value = await self.get_async(key)
+        if value is None:
+            value = await run_in_threadpool(compute)
+            if value is not None:
+                await self.set_async(key, value, ttl)
+        return value
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._l1.pop(key, None)
+            if self.path is not None:
+                self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._l1.clear()
+            if self.path is not None:
+                self.conn.execute("DELETE FROM cache")
+            self.l1_hits = self.l2_hits = self.misses = self.errors = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        stats = {"l1_size": len(self._l1), "l1_hits": self.l1_hits, "l2_hits": self.l2_hits,
+                 "misses": self.misses, "errors": self.errors,
+                 "hit_rate": round((self.l1_hits + self.l2_hits) / lookups, 4) if lookups else None,
+                 "shared": self.path is not None}
+        if self.path is not None:
+            with self._lock:
+                try:
+                    stats["l2_size"] = self.conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+                except sqlite3.Error:
+                    pass
+        return stats
+
+
+cache = SharedCache()
@@ -0,0 +1,444 @@
+"""
+Lagring av opplastinger og avledede filer (overlays, miniatyrer).
+
+Alle filer er innholdsadresserte blobs: `<kind-dir>/ab/cd/<sha256><ext>`.
+Samme innhold lagres bare én gang, og to nivåer med undermapper holder hver
+mappe liten selv med millioner av filer. En SQLite-indeks holder størrelse,
+siste tilgang og referanser (f.eks. "job:job_3") per blob, så kvoter og
+opprydding aldri trenger å liste mappene.
+
+Eldre flate filer direkte i en mappe (f.eks. `outputs/<navn>_cv_output.png`
+fra før blob-lageret) indekseres der de ligger (`path`), så de teller med i
+kvotene og kan hentes med filnavnet sitt.
+
+Kvoter gjelder per type. Over kvoten fjernes de minst nylig brukte blobene
+som ingen refererer til: avledede typer (kan lages på nytt) med en gang,
+originaler først etter `STORAGE_ORPHAN_GRACE_S`. En bakgrunnstråd kjører
+`sweep()` jevnlig: håndhever kvoter, fjerner indeksrader uten fil og gamle
+halvferdige opplastinger. Bare én prosess rydder om gangen (flock på en
+låsfil ved indeksen); de andre workerne prøver igjen neste intervall og tar
+over om den dør. Flate filer indekseres én gang når en prosess tar over, og
+rader uten fil sjekkes i en roterende batch per runde, ikke hele tabellen.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import fcntl  # låser mellom workere; finnes ikke på Windows
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .config import (
+    BACKEND_DIR, STORAGE_ACCESS_RESOLUTION_S, STORAGE_INDEX_PATH, STORAGE_ORPHAN_GRACE_S,
+    STORAGE_QUOTAS, STORAGE_SWEEP_CHECK_ROWS, STORAGE_SWEEP_INTERVAL_S,
+)
+from .uploads import StoredUpload, store_upload
+
+# type -> avledet (kan genereres på nytt og dermed fjernes fritt)
+DERIVED_KINDS = {"outputs": True, "thumbnails": True, "uploads": False}
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+STAGING_DIR = ".staging"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256      TEXT NOT NULL,
+    kind        TEXT NOT NULL,
+    ext         TEXT NOT NULL DEFAULT '',
+    size        INTEGER NOT NULL,
+    source      TEXT,
+    created_at  REAL NOT NULL,
+    last_access REAL NOT NULL,
+    path        TEXT,  -- eldre flat fil (relativt til mappen), NULL = sharded
+    PRIMARY KEY (sha256, kind)
+);
+CREATE INDEX IF NOT EXISTS idx_blobs_lru ON blobs(kind, last_access);
+CREATE INDEX IF NOT EXISTS idx_blobs_source ON blobs(source);
+CREATE TABLE IF NOT EXISTS refs (
+    sha256  TEXT NOT NULL,
+    kind    TEXT NOT NULL,
+    owner   TEXT NOT NULL,
+    PRIMARY KEY (sha256, kind, owner)
+);
+CREATE INDEX IF NOT EXISTS idx_refs_owner ON refs(owner);
+"""
+
+
+@dataclass
+class Blob:
+    sha256: str
+    kind: str
+    ext: str
+    size: int
+    path: Path
+    legacy: bool = False  # eldre flat fil: kan skrives over under samme navn, ikke immutable
+
+    @property
+    def name(self) -> str:
+        return f"{self.sha256}{self.ext}"
+
+
+class BlobStore:
+    def __init__(
+        self,
+        dirs: Dict[str, Path],
+        index_path: Union[str, Path],
+        quotas: Optional[Dict[str, int]] = None,
+        grace: float = STORAGE_ORPHAN_GRACE_S,
+    ):
+        self.dirs = {kind: Path(d) for kind, d in dirs.items()}
+        self.index_path = Path(index_path)
+        self.quotas = dict(STORAGE_QUOTAS if quotas is None else quotas)
+        self.grace = grace
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._sweep_fd: Optional[int] = None  # flock-en som gjør denne prosessen til den som rydder
+        self._check_after: Tuple[str, str] = ("", "")  # (sha256, kind) der neste fil-sjekk starter
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.index_path), timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            try:
+                conn.execute("ALTER TABLE blobs ADD COLUMN path TEXT")  # indekser fra før flate filer
+            except sqlite3.OperationalError:
+                pass
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_path ON blobs(kind, path)")
+            self._conn = conn
+        return self._conn
+
+    # -- stier -------------------------------------------------------------
+
+    def _dir(self, kind: str) -> Path:
+        if kind not in self.dirs:
+            raise KeyError(f"Unknown storage kind '{kind}', expected one of {sorted(self.dirs)}")
+        return self.dirs[kind]
+
+    def path_for(self, sha256: str, kind: str, ext: str = "") -> Path:
+        return self._dir(kind) / sha256[:2] / sha256[2:4] / f"{sha256}{ext}"
+
+    def _blob_path(self, sha256: str, kind: str, ext: str, legacy: Optional[str]) -> Path:
+        return self._dir(kind) / legacy if legacy else self.path_for(sha256, kind, ext)
+
+    def staging_dir(self, kind: str) -> Path:
+        return self._dir(kind) / STAGING_DIR
+
+    # -- skriving ----------------------------------------------------------
+
+    def adopt(self, tmp_path: Path, sha256: str, kind: str, ext: str = "",
+              owner: Optional[str] = None, source: Optional[str] = None) -> Blob:
+        """Flytt en ferdig skrevet fil inn under sitt innholdsnavn (eller forkast den som duplikat)."""
+        final = self.path_for(sha256, kind, ext)
+        try:
+            size = Path(tmp_path).stat().st_size
+        except FileNotFoundError:
+            # en samtidig lik opplasting har allerede flyttet filen på plass
+            if not final.exists():
+                raise
+            size = final.stat().st_size
+        else:
+            if final.exists():
+                os.unlink(tmp_path)
+            else:
+                final.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_path, final)
+        return self._index(sha256, kind, ext, size, final, owner, source)
+
+    def put_bytes(self, data: Union[bytes, bytearray, memoryview], kind: str, ext: str = "",
+                  owner: Optional[str] = None, source: Optional[str] = None) -> Blob:
+        sha256 = hashlib.sha256(data).hexdigest()
+        final = self.path_for(sha256, kind, ext)
+        if final.exists():
+            # duplikat: ingen ny skriving, bare indeks/referanse
+            return self._index(sha256, kind, ext, len(data), final, owner, source)
+        staging = self.staging_dir(kind)
+        staging.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=staging, prefix=".blob-", suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return self.adopt(Path(tmp), sha256, kind, ext, owner, source)
+
+    def _index(self, sha256: str, kind: str, ext: str, size: int, path: Path,
+               owner: Optional[str], source: Optional[str]) -> Blob:
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO blobs (sha256, kind, ext, size, source, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(sha256, kind) DO UPDATE SET last_access = excluded.last_access, "
+                "source = COALESCE(blobs.source, excluded.source)",
+                (sha256, kind, ext, size, source, now, now))
+            if owner:
+                self.conn.execute("INSERT OR IGNORE INTO refs (sha256, kind, owner) VALUES (?, ?, ?)",
+                                  (sha256, kind, owner))
+            self.conn.commit()
+        return Blob(sha256, kind, ext, size, path)
+
+    # -- lesing ------------------------------------------------------------
+
+    def get(self, sha256: str, kind: str, touch: bool = True) -> Optional[Blob]:
+        """Blob med filsti, eller None. Oppdaterer siste tilgang (grovt, for LRU)."""
+        if not SHA256_RE.match(sha256 or ""):
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT ext, size, last_access, path FROM blobs WHERE sha256 = ? AND kind = ?",
+                                    (sha256, kind)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            # ikke en skriving per lesing: bare når tidsstempelet er merkbart gammelt
+            if touch and now - row[2] > STORAGE_ACCESS_RESOLUTION_S:
+                self.conn.execute("UPDATE blobs SET last_access = ? WHERE sha256 = ? AND kind = ?",
+                                  (now, sha256, kind))
+                self.conn.commit()
+        path = self._blob_path(sha256, kind, row[0], row[3])
+        return Blob(sha256, kind, row[0], row[1], path, bool(row[3])) if path.exists() else None
+
+    def get_named(self, name: str, kind: str) -> Optional[Blob]:
+        """Blob fra et filnavn i URL-en: `<sha256><ext>`, eller en indeksert eldre flat fil."""
+        blob = self.get(Path(name).stem, kind)
+        if blob is not None:
+            return blob
+        with self._lock:
+            row = self.conn.execute("SELECT sha256 FROM blobs WHERE kind = ? AND path = ?", (kind, name)).fetchone()
+        return self.get(row[0], kind) if row else None
+
+    def derived_from(self, source: str, kind: str) -> List[Blob]:
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT sha256, ext, size, path FROM blobs WHERE source = ? AND kind = ?", (source, kind)).fetchall()
+        return [Blob(sha, kind, ext, size, self._blob_path(sha, kind, ext, legacy), bool(legacy))
+                for sha, ext, size, legacy in rows]
+
+    def index_flat_files(self) -> int:
+        """Indekser filer som ligger flatt i mappene (fra før blob-lageret). Returnerer antall nye."""
+        added = 0
+        for kind, root in self.dirs.items():
+            if not root.is_dir():
+                continue
+            with self._lock:
+                known = {r[0] for r in self.conn.execute(
+                    "SELECT path FROM blobs WHERE kind = ? AND path IS NOT NULL", (kind,))}
+            for entry in os.scandir(root):
+                if entry.name.startswith(".") or entry.name in known or not entry.is_file():
+                    continue  # skjulte mapper/filer (staging, .variants), shard-mapper
+                digest = hashlib.sha256()
+                with open(entry.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+                st = entry.stat()
+                with self._lock:
+                    # samme innhold som en sharded blob: den vinner, filen serveres fortsatt flatt
+                    cur = self.conn.execute(
+                        "INSERT OR IGNORE INTO blobs (sha256, kind, ext, size, source, created_at, last_access, path) "
+                        "VALUES (?, ?, ?, ?, NULL, ?, ?, ?)",
+                        (digest.hexdigest(), kind, Path(entry.name).suffix, st.st_size, st.st_mtime, st.st_mtime,
+                         entry.name))
+                    self.conn.commit()
+                added += cur.rowcount
+        return added
+
+    # -- referanser --------------------------------------------------------
+
+    def add_ref(self, sha256: str, kind: str, owner: str) -> bool:
+        with self._lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM blobs WHERE sha256 = ? AND kind = ?", (sha256, kind)).fetchone()
+            if exists is None:
+                return False
+            self.conn.execute("INSERT OR IGNORE INTO refs (sha256, kind, owner) VALUES (?, ?, ?)",
+                              (sha256, kind, owner))
+            self.conn.commit()
+        return True
+
+    def release(self, owner: str) -> int:
+        """Fjern alle referanser fra en eier (f.eks. en slettet jobb)."""
+        with self._lock:
+            cur = self.conn.execute("DELETE FROM refs WHERE owner = ?", (owner,))
+            self.conn.commit()
+        return cur.rowcount
+
+    def owners(self, prefix: str = "") -> List[str]:
+        """Eiere med referanser, f.eks. alle "job:"-eiere."""
+        with self._lock:
+            rows = self.conn.execute("SELECT DISTINCT owner FROM refs WHERE owner >= ? AND owner < ?",
+                                     (prefix, prefix + "\uffff")).fetchall()
+        return [r[0] for r in rows]
+
+    def refcount(self, sha256: str, kind: str) -> int:
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM refs WHERE sha256 = ? AND kind = ?", (sha256, kind)).fetchone()[0]
+
+    # -- kvoter og opprydding ----------------------------------------------
+
+    def usage(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            rows = self.conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM blobs GROUP BY kind").fetchall()
+        usage = {kind: {"files": 0, "bytes": 0, "quota": self.quotas.get(kind, 0)} for kind in self.dirs}
+        for kind, files, size in rows:
+            if kind in usage:
+                usage[kind].update(files=files, bytes=size)
+        return usage
+
+    def _delete(self, rows: Iterable) -> int:
+        freed = 0
+        for sha256, kind, ext, size, legacy in rows:
+            try:
+                os.unlink(self._blob_path(sha256, kind, ext, legacy))
+            except FileNotFoundError:
+                pass
+            self.conn.execute("DELETE FROM blobs WHERE sha256 = ? AND kind = ?", (sha256, kind))
+            freed += size
+        self.conn.commit()
+        return freed
+
+    def enforce_quota(self, kind: str, now: Optional[float] = None) -> int:
+        """Fjern LRU-blobs uten referanser til typen er under kvoten. Returnerer frigjorte bytes."""
+        quota = self.quotas.get(kind, 0)
+        if quota <= 0:
+            return 0
+        now = now or time.time()
+        cutoff = now if DERIVED_KINDS.get(kind, False) else now - self.grace
+        with self._lock:
+            used = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM blobs WHERE kind = ?", (kind,)).fetchone()[0]
+            excess = used - quota
+            if excess <= 0:
+                return 0
+            victims, total = [], 0
+            cursor = self.conn.execute(
+                "SELECT b.sha256, b.kind, b.ext, b.size, b.path FROM blobs b "
+                "WHERE b.kind = ? AND b.last_access <= ? "
+                "AND NOT EXISTS (SELECT 1 FROM refs r WHERE r.sha256 = b.sha256 AND r.kind = b.kind) "
+                "ORDER BY b.last_access", (kind, cutoff))
+            for row in cursor:
+                victims.append(row)
+                total += row[3]
+                if total >= excess:
+                    break
+            return self._delete(victims)
+
+    def _missing_rows(self, limit: int) -> List[Tuple[str, str]]:
+        """Neste batch indeksrader (i nøkkelrekkefølge, rundt og rundt) hvis fil er borte."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT sha256, kind, ext, path FROM blobs WHERE (sha256, kind) > (?, ?) "
+                "ORDER BY sha256, kind LIMIT ?", (*self._check_after, limit)).fetchall()
+        self._check_after = (rows[-1][0], rows[-1][1]) if len(rows) == limit else ("", "")
+        return [(sha, kind) for sha, kind, ext, legacy in rows
+                if kind in self.dirs and not self._blob_path(sha, kind, ext, legacy).exists()]
+
+    def sweep(self, staging_max_age: float = 3600.0, check_rows: int = STORAGE_SWEEP_CHECK_ROWS) -> Dict[str, int]:
+        """Kvoter + en batch rader uten fil + gamle .part-filer i staging."""
+        now = time.time()
+        report = {"freed_bytes": 0, "missing_rows": 0, "stale_parts": 0}
+        for kind in self.dirs:
+            report["freed_bytes"] += self.enforce_quota(kind, now)
+            staging = self.staging_dir(kind)
+            if staging.is_dir():
+                for part in staging.iterdir():
+                    try:
+                        if now - part.stat().st_mtime > staging_max_age:
+                            part.unlink()
+                            report["stale_parts"] += 1
+                    except FileNotFoundError:
+                        pass
+        missing = self._missing_rows(check_rows)
+        if missing:
+            with self._lock:
+                self.conn.executemany("DELETE FROM blobs WHERE sha256 = ? AND kind = ?", missing)
+                self.conn.commit()
+        report["missing_rows"] = len(missing)
+        return report
+
+    def claim_sweeper(self) -> bool:
+        """Ikke-blokkerende flock: True hvis denne prosessen er (eller nå ble) den som rydder."""
+        if self._sweep_fd is not None or fcntl is None:
+            return True
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.index_path.with_name(self.index_path.name + ".sweeper.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._sweep_fd = fd
+        return True
+
+    def start_sweeper(self, interval: float = STORAGE_SWEEP_INTERVAL_S) -> None:
+        if self._sweeper is not None and self._sweeper.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            indexed = False
+            while True:
+                if self.claim_sweeper():
+                    try:
+                        if not indexed:
+                            indexed = True
+                            self.index_flat_files()  # én gang, når denne prosessen tar over
+                        else:
+                            self.sweep()
+                    except Exception as e:
+                        print(f"[storage] sweep failed: {e!r}")
+                if self._stop.wait(interval):
+                    return
+
+        self._sweeper = threading.Thread(target=loop, name="storage-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+        if self._sweep_fd is not None:
+            os.close(self._sweep_fd)  # slipper låsen: en annen worker kan ta over
+            self._sweep_fd = None
+
+
+_stores: Dict[tuple, BlobStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(dirs: Dict[str, Path], index_path: Optional[Union[str, Path]] = None) -> BlobStore:
+    """Én BlobStore per sett med mapper (indeksen ligger ved siden av mappene som default)."""
+    dirs = {kind: Path(d) for kind, d in dirs.items()}
+    index = Path(index_path) if index_path else next(iter(dirs.values())).parent / "storage_index.sqlite"
+    key = (tuple(sorted((k, str(v)) for k, v in dirs.items())), str(index))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = BlobStore(dirs, index)
+        return store
+
+
+def default_store() -> BlobStore:
+    """Lageret for backend/uploads og backend/outputs (samme som app.main bruker)."""
+    outputs = BACKEND_DIR / "outputs"
+    return get_store({"uploads": BACKEND_DIR / "uploads", "outputs": outputs, "thumbnails": outputs / ".variants"},
+                     STORAGE_INDEX_PATH)
+
+
+async def ingest_upload(store: BlobStore, file, kind: str = "uploads", owner: Optional[str] = None,
+                        max_bytes: Optional[int] = None) -> Tuple[StoredUpload, Blob]:
+    """Strøm en opplasting via staging inn i blob-lageret (samme grenser som `store_upload`)."""
+    kwargs = {} if max_bytes is None else {"max_bytes": max_bytes}
+    upload = await store_upload(file, store.staging_dir(kind), **kwargs)
+    blob = store.adopt(upload.path, upload.sha256, kind, upload.path.suffix, owner=owner)
+    upload.path = blob.path
+    return upload, blob
@@ -0,0 +1,270 @@
+"""
+Tidsserier per kjøretøy/panel/metrikk (f.eks. "bil 123, panser, cqi over tid").
+
+Hver serie er en mappe med kolonnefiler som bare vokser i enden:
+
+    <root>/<vehicle>/<panel>/<metric>/
+        raw.ts      int64   unix-sekunder, sortert
+        raw.val     float32 verdien
+        hour.bin / day.bin / month.bin
+                    faste poster (start, min, max, sum, count) per bøtte
+
+Kolonnene leses med `np.memmap`, og tidsintervaller slås opp med
+`searchsorted` på den sorterte tidskolonnen – et oppslag berører noen få sider,
+ikke hele filen. Sammendragene oppdateres ved hver innskriving (bare siste
+bøtte skrives om), så en graf over flere år leser noen hundre månedsposter i
+stedet for hver enkelt analyse. Punkter som kommer i feil rekkefølge (backfill)
+flettes inn med en omskriving av serien.
+"""
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import TIMESERIES_DIR, TIMESERIES_MAX_POINTS
+
+try:
+    import fcntl  # låser mellom workere; finnes ikke på Windows
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+RESOLUTIONS = ("hour", "day", "month")
+BUCKET_DTYPE = np.dtype([("start", "<i8"), ("min", "<f4"), ("max", "<f4"), ("sum", "<f8"), ("count", "<u4")])
+DEFAULT_PANEL = "_"
+NAME_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+
+# Metrikker fra analyze_coating som lagres automatisk
+TRACKED_METRICS = ("cvi", "cqi", "coverage", "color_uniformity", "smoothness", "brightness_score")
+
+
+class SeriesNameError(ValueError):
+    pass
+
+
+def bucket_starts(ts: np.ndarray, resolution: str) -> np.ndarray:
+    """Start (unix-sekunder, UTC) på bøtta hvert tidspunkt hører til."""
+    ts = np.asarray(ts, dtype=np.int64)
+    if resolution == "hour":
+        return ts - ts % 3600
+    if resolution == "day":
+        return ts - ts % 86400
+    if resolution == "month":
+        return ts.astype("datetime64[s]").astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+    raise ValueError(f"Unknown resolution '{resolution}', expected one of {RESOLUTIONS}")
+
+
+def rollup(ts: np.ndarray, values: np.ndarray, resolution: str) -> np.ndarray:
+    """Sorterte punkter -> bøtteposter (min/max/sum/count), vektorisert med reduceat."""
+    starts = bucket_starts(ts, resolution)
+    if starts.size == 0:
+        return np.empty(0, dtype=BUCKET_DTYPE)
+    edges = np.flatnonzero(np.diff(starts)) + 1
+    idx = np.concatenate(([0], edges))
+    out = np.empty(idx.size, dtype=BUCKET_DTYPE)
+    out["start"] = starts[idx]
+    out["min"] = np.minimum.reduceat(values, idx)
+    out["max"] = np.maximum.reduceat(values, idx)
+    out["sum"] = np.add.reduceat(values.astype(np.float64), idx)
+    out["count"] = np.diff(np.concatenate((idx, [starts.size])))
+    return out
+
+
+def _merge_bucket(a: np.void, b: np.void) -> np.ndarray:
+    merged = np.empty(1, dtype=BUCKET_DTYPE)
+    merged["start"] = a["start"]
+    merged["min"] = min(a["min"], b["min"])
+    merged["max"] = max(a["max"], b["max"])
+    merged["sum"] = a["sum"] + b["sum"]
+    merged["count"] = a["count"] + b["count"]
+    return merged
+
+
+def _read(path: Path, dtype) -> np.ndarray:
+    """Kolonnefil som memmap (tom array hvis filen mangler/er tom)."""
+    if not path.exists() or path.stat().st_size == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class _SeriesLock:
+    def __init__(self, directory: Path, lock: threading.Lock):
+        self.path = directory / ".lock"
+        self.lock = lock
+        self._fh = None
+
+    def __enter__(self):
+        self.lock.acquire()
+        if fcntl is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.path, "a")
+            fcntl.flock(self._fh, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            fcntl.flock(self._fh, fcntl.LOCK_UN)
+            self._fh.close()
+            self._fh = None
+        self.lock.release()
+
+
+class TimeSeriesStore:
+    def __init__(self, root: Optional[str] = None, max_points: int = TIMESERIES_MAX_POINTS):
+        self.root = Path(root or TIMESERIES_DIR)
+        self.max_points = max_points
+        self._locks: Dict[Path, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def series_dir(self, vehicle_id: str, panel: Optional[str], metric: str) -> Path:
+        parts = (vehicle_id, panel or DEFAULT_PANEL, metric)
+        for part in parts:
+            if not NAME_RE.match(part or "") or part in (".", ".."):
+                raise SeriesNameError("vehicle_id, panel and metric must be 1-64 characters of [A-Za-z0-9_.:-]")
+        return self.root.joinpath(*parts)
+
+    def _lock(self, directory: Path) -> _SeriesLock:
+        with self._locks_guard:
+            lock = self._locks.setdefault(directory, threading.Lock())
+        return _SeriesLock(directory, lock)
+
+    # -- skriving ----------------------------------------------------------
+
+    def append(self, vehicle_id: str, panel: Optional[str], metric: str,
+               ts: Sequence[float], values: Sequence[float]) -> int:
+        """Legg til punkter i en serie. Returnerer antall lagrede punkter."""
+        directory = self.series_dir(vehicle_id, panel, metric)
+        ts = np.asarray(ts, dtype=np.float64).round().astype(np.int64)
+        values = np.asarray(values, dtype=np.float32)
+        keep = np.isfinite(values)
+        ts, values = ts[keep], values[keep]
+        if ts.size == 0:
+            return 0
+        order = np.argsort(ts, kind="stable")
+        ts, values = ts[order], values[order]
+
+        with self._lock(directory):
+            directory.mkdir(parents=True, exist_ok=True)
+            existing = _read(directory / "raw.ts", np.int64)
+            if existing.size and ts[0] < existing[-1]:
+                self._rewrite(directory, ts, values)
+                return int(ts.size)
+            with open(directory / "raw.ts", "ab") as f:
+                f.write(ts.tobytes())
+            with open(directory / "raw.val", "ab") as f:
+                f.write(values.tobytes())
+            for resolution in RESOLUTIONS:
+                self._extend_rollup(directory / f"{resolution}.bin", rollup(ts, values, resolution))
+        return int(ts.size)
+
+    def _extend_rollup(self, path: Path, new: np.ndarray) -> None:
+        record = BUCKET_DTYPE.itemsize
+        size = path.stat().st_size if path.exists() else 0
+        with open(path, "r+b" if size else "wb") as f:
+            if size:
+                f.seek(size - record)
+                last = np.frombuffer(f.read(record), dtype=BUCKET_DTYPE)[0]
+                if last["start"] == new[0]["start"]:
+                    # samme bøtte som sist: skriv om bare den siste posten
+                    f.seek(size - record)
+                    f.write(_merge_bucket(last, new[0]).tobytes())
+                    new = new[1:]
+            f.seek(0, 2)
+            f.write(new.tobytes())
+
+    def _rewrite(self, directory: Path, ts: np.ndarray, values: np.ndarray) -> None:
+        """Backfill: flett inn eldre punkter og bygg sammendragene på nytt."""
+        all_ts = np.concatenate((np.array(_read(directory / "raw.ts", np.int64)), ts))
+        all_values = np.concatenate((np.array(_read(directory / "raw.val", np.float32)), values))
+        order = np.argsort(all_ts, kind="stable")
+        all_ts, all_values = all_ts[order], all_values[order]
+        files = {"raw.ts": all_ts.tobytes(), "raw.val": all_values.tobytes()}
+        for resolution in RESOLUTIONS:
+            files[f"{resolution}.bin"] = rollup(all_ts, all_values, resolution).tobytes()
+        for name, data in files.items():
+            tmp = directory / f"{name}.tmp"
+            tmp.write_bytes(data)
+            tmp.replace(directory / name)
+
+    def record_analysis(self, vehicle_id: str, panel: Optional[str], metrics: Dict,
+                        ts: float, names: Iterable[str] = TRACKED_METRICS) -> int:
+        """Lagre de numeriske metrikkene fra én analyse."""
+        stored = 0
+        for name in names:
+            value = metrics.get(name)
+            if isinstance(value, (int, float)):
+                stored += self.append(vehicle_id, panel, name, [ts], [value])
+        return stored
+
+    # -- lesing ------------------------------------------------------------
+
+    def _range(self, column: np.ndarray, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        lo = 0 if start is None else int(np.searchsorted(column, int(start), side="left"))
+        hi = column.size if end is None else int(np.searchsorted(column, int(end), side="right"))
+        return lo, hi
+
+    def query(self, vehicle_id: str, panel: Optional[str], metric: str,
+              start: Optional[float] = None, end: Optional[float] = None,
+              resolution: str = "auto", max_points: Optional[int] = None) -> Dict:
+        """Punkter i [start, end]. `auto` velger den fineste oppløsningen som gir ≤ max_points."""
+        directory = self.series_dir(vehicle_id, panel, metric)
+        max_points = max_points or self.max_points
+        if resolution not in ("auto", "raw") + RESOLUTIONS:
+            raise ValueError(f"Unknown resolution '{resolution}'")
+
+        raw_ts = _read(directory / "raw.ts", np.int64)
+        lo, hi = self._range(raw_ts, start, end)
+        if resolution == "auto":
+            resolution = "raw"
+            if hi - lo > max_points:
+                for candidate in RESOLUTIONS:
+                    resolution = candidate
+                    buckets = _read(directory / f"{candidate}.bin", BUCKET_DTYPE)
+                    b_lo, b_hi = self._range(buckets["start"], self._bucket_floor(start, candidate), end)
+                    if b_hi - b_lo <= max_points:
+                        break
+
+        if resolution == "raw":
+            values = _read(directory / "raw.val", np.float32)[lo:hi]
+            points = [{"t": int(t), "value": round(float(v), 4)} for t, v in zip(raw_ts[lo:hi], values)]
+        else:
+            buckets = _read(directory / f"{resolution}.bin", BUCKET_DTYPE)
+            b_lo, b_hi = self._range(buckets["start"], self._bucket_floor(start, resolution), end)
+            chunk = np.array(buckets[b_lo:b_hi])
+            mean = chunk["sum"] / np.maximum(chunk["count"], 1)
+            points = [
+                {"t": int(b["start"]), "min": round(float(b["min"]), 4), "max": round(float(b["max"]), 4),
+                 "mean": round(float(m), 4), "count": int(b["count"])}
+                for b, m in zip(chunk, mean)
+            ]
+        return {
+            "vehicle_id": vehicle_id,
+            "panel": panel or DEFAULT_PANEL,
+            "metric": metric,
+            "resolution": resolution,
+            "total_points": int(raw_ts.size),
+            "points": points,
+        }
+
+    @staticmethod
+    def _bucket_floor(start: Optional[float], resolution: str) -> Optional[int]:
+        # en bøtte som starter før `start` kan fortsatt inneholde punkter i intervallet
+        return None if start is None else int(bucket_starts(np.array([int(start)]), resolution)[0])
+
+    def series(self, vehicle_id: str) -> List[Dict]:
+        """Alle (panel, metrikk) for et kjøretøy med antall punkter og tidsrom."""
+        vehicle_dir = self.series_dir(vehicle_id, None, "x").parent.parent
+        out = []
+        if not vehicle_dir.is_dir():
+            return out
+        for panel_dir in sorted(p for p in vehicle_dir.iterdir() if p.is_dir()):
+            for metric_dir in sorted(p for p in panel_dir.iterdir() if p.is_dir()):
+                ts = _read(metric_dir / "raw.ts", np.int64)
+                if ts.size:
+                    out.append({"panel": panel_dir.name, "metric": metric_dir.name, "points": int(ts.size),
+                                "first": int(ts[0]), "last": int(ts[-1])})
+        return out
+
+
+store = TimeSeriesStore()
@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
 
 class Phase(str, Enum):
@@ -37,3 +37,14 @@ class TrainingSession:
     def add_image(self, img_path: Path) -> None:
         """Legger til et bilde i denne treningsøkta."""
         self.image_paths.append(img_path)
+
+    def labels(self) -> Dict[str, str]:
+        """Etikettene som gjelder alle bilder i økta (brukes av datasett-manifestet)."""
+        return {
+            "session_id": self.id,
+            "phase": self.phase.value,
+            "car_brand": self.car_brand,
+            "panel": self.panel,
+            "color": self.color,
+            "color_code": self.color_code,
+        }
@@ -0,0 +1,322 @@
+"""
+Kjører train_multitask i en egen prosess, slik at treningen aldri deler
+GIL eller kjerner med API-et. Prosessen får egne trådgrenser, lavere
+prioritet (nice) og eventuelt egne CPU-kjerner, og rapporterer fremdrift
+via en JSON-fil som /api/training/status leser.
+
+Tilstanden ligger på disk, ikke i én workers minne: `start` tar en eksklusiv
+flock på `training.lock` i run-mappen og gir fd-en videre til barneprosessen,
+så låsen holdes nøyaktig så lenge treningen lever – uansett hvilken
+uvicorn-worker som startet den, og også etter en omstart av API-et. `status`
+og `stop` leser `run.json` (med pid) for siste kjøring og sjekker låsen.
+
+Hver kjøring har egen mappe med egne checkpoints. `resume=True` fortsetter
+bare siste kjøring hvis den ble avbrutt før den var ferdig; skriptet starter
+uansett på nytt hvis manifestet har endret seg siden checkpointet.
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+try:
+    import fcntl  # låser mellom workere; finnes ikke på Windows
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from . import concurrency
+from .config import (
+    REPO_DIR,
+    TRAINING_CPU_AFFINITY,
+    TRAINING_CV_THREADS,
+    TRAINING_NICE,
+    TRAINING_RUN_DIR,
+    TRAINING_TORCH_THREADS,
+    TRAINING_WORLD_SIZE,
+)
+
+TRAIN_SCRIPT = REPO_DIR / "coatvision-app" / "models" / "train_multitask.py"
+PROGRESS_FILE = "progress.json"
+RUN_FILE = "run.json"
+LOCK_FILE = "training.lock"
+LOG_FILE = "train.log"
+
+
+class TrainingAlreadyRunning(RuntimeError):
+    pass
+
+
+@dataclass
+class TrainingOptions:
+    epochs: int = 10
+    batch_size: int = 32
+    image_size: int = 224
+    workers: int = 2
+    lr: float = 3e-4
+    resume: bool = False
+    use_cache: bool = True
+    batch_augment: bool = False
+    threads: int = TRAINING_TORCH_THREADS
+    cv_threads: int = TRAINING_CV_THREADS
+    nice: int = TRAINING_NICE
+    cpu_affinity: str = TRAINING_CPU_AFFINITY
+    world_size: int = TRAINING_WORLD_SIZE
+
+
+def parse_cpu_list(spec: str) -> Set[int]:
+    """'0,2-3' -> {0, 2, 3}."""
+    cpus: Set[int] = set()
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def _limit_resources(pid: int, nice: int, cpus: Set[int]) -> None:
+    """Sett prioritet og kjerner på barneprosessen etter Popen.
+
+    Ikke preexec_fn: den er ikke trygg å bruke i en server med tråder. Barnet
+    har ennå ikke startet egne tråder, så de arver grensene.
+    """
+    if nice and hasattr(os, "setpriority"):
+        os.setpriority(os.PRIO_PROCESS, pid, os.getpriority(os.PRIO_PROCESS, 0) + nice)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(pid, cpus)
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # finnes, men eies av en annen bruker
+    return True
+
+
+def _read_json(path: Path) -> Dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+class TrainingRunner:
+    """Starter og følger én treningsprosess om gangen."""
+
+    def __init__(self, run_dir: Path = Path(TRAINING_RUN_DIR), script: Path = TRAIN_SCRIPT):
+        self.run_dir = Path(run_dir)
+        self.script = Path(script)
+        self._lock = threading.Lock()
+        self._process: Optional[subprocess.Popen] = None  # bare i workeren som startet kjøringen
+
+    def _latest_run(self) -> Optional[Dict]:
+        runs = [_read_json(p / RUN_FILE) for p in self.run_dir.glob("*") if (p / RUN_FILE).exists()]
+        runs = [r for r in runs if r.get("run_dir")]
+        return max(runs, key=lambda r: r.get("started_at", 0)) if runs else None
+
+    def _open_lock(self) -> int:
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+        return os.open(self.run_dir / LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _try_lock(self) -> Optional[int]:
+        """Eksklusiv, ikke-blokkerende flock; fd-en hvis vi fikk den, ellers None."""
+        fd = self._open_lock()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def is_running(self, run: Optional[Dict] = None) -> bool:
+        """Går en trening nå (startet av hvilken som helst worker)?
+
+        Låsen er fasiten: den slippes når prosessen dør, også som zombie. Uten
+        fcntl (Windows) sjekkes pid-en fra run.json.
+        """
+        if fcntl is None:
+            run = run if run is not None else self._latest_run()
+            return bool(run) and _pid_alive(run.get("pid"))
+        fd = self._try_lock()
+        if fd is None:
+            return True
+        os.close(fd)  # lukking slipper låsen
+        return False
+
+    def resumable_checkpoint_dir(self) -> Optional[Path]:
+        """Checkpoints fra siste kjøring hvis den ikke ble fullført, ellers None."""
+        run = self._latest_run()
+        if run is None:
+            return None
+        last = Path(run["run_dir"])
+        if _read_json(last / PROGRESS_FILE).get("state") == "completed":
+            return None
+        checkpoint_dir = Path(run.get("checkpoint_dir") or last / "checkpoints")
+        return checkpoint_dir if (checkpoint_dir / "last.pt").exists() else None
+
+    @staticmethod
+    def threads(options: TrainingOptions) -> int:
+        """Torch-tråder per rank: satt eksplisitt, ellers kjernene treningen får delt på ranks."""
+        if options.threads > 0:
+            return options.threads
+        cpus = len(parse_cpu_list(options.cpu_affinity)) or concurrency.available_cpus()
+        return max(1, cpus // max(1, options.world_size))
+
+    def _command(self, run_path: Path, options: TrainingOptions, checkpoint_dir: Path,
+                 resume: bool = False) -> List[str]:
+        cmd = [
+            sys.executable, str(self.script),
+            "--epochs", str(options.epochs),
+            "--batch-size", str(options.batch_size),
+            "--image-size", str(options.image_size),
+            "--workers", str(options.workers),
+            "--lr", str(options.lr),
+            "--threads", str(self.threads(options)),
+            "--cv-threads", str(options.cv_threads),
+            "--world-size", str(max(1, options.world_size)),
+            "--checkpoint-dir", str(checkpoint_dir),
+            "--progress-file", str(run_path / PROGRESS_FILE),
+            "--output", str(self.run_dir / "multitask.pt"),
+        ]
+        if resume:
+            cmd.append("--resume")
+        if options.use_cache:
+            cmd += ["--cache-dir", str(self.run_dir / "tensor_cache")]
+            if options.batch_augment:
+                cmd.append("--batch-augment")
+        return cmd
+
+    def _env(self, options: TrainingOptions) -> Dict[str, str]:
+        # API-workernes trådgrenser (services/concurrency.py) skal ikke arves av treningen
+        env = concurrency.child_env()
+        threads = str(self.threads(options))
+        # BLAS/OpenMP-pooler i barneprosessen skal ikke vokse utover grensen
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            env[var] = threads
+        env["PYTHONUNBUFFERED"] = "1"
+        return env
+
+    def start(self, options: Optional[TrainingOptions] = None) -> Dict:
+        options = options or TrainingOptions()
+        with self._lock:
+            if fcntl is None:
+                lock_fd = None
+                if self.is_running():
+                    raise TrainingAlreadyRunning("Training is already running")
+            else:
+                lock_fd = self._try_lock()
+                if lock_fd is None:
+                    raise TrainingAlreadyRunning("Training is already running")
+            try:
+                return self._start_locked(options, lock_fd)
+            finally:
+                if lock_fd is not None:
+                    os.close(lock_fd)  # barneprosessen har sin egen kopi og holder låsen
+
+    def _start_locked(self, options: TrainingOptions, lock_fd: Optional[int]) -> Dict:
+        run_id = time.strftime("%Y%m%d_%H%M%S") + "_" + uuid.uuid4().hex[:6]
+        run_path = self.run_dir / run_id
+        # finn en avbrutt kjøring før den nye mappen blir "siste kjøring"
+        resume_dir = self.resumable_checkpoint_dir() if options.resume else None
+        run_path.mkdir(parents=True, exist_ok=True)
+        checkpoint_dir = resume_dir or run_path / "checkpoints"
+        cpus = parse_cpu_list(options.cpu_affinity)
+
+        log = open(run_path / LOG_FILE, "ab")
+        try:
+            process = subprocess.Popen(
+                self._command(run_path, options, checkpoint_dir, resume=resume_dir is not None),
+                cwd=str(REPO_DIR),
+                env=self._env(options),
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                pass_fds=(lock_fd,) if lock_fd is not None else (),
+            )
+        finally:
+            log.close()  # barneprosessen har sin egen kopi av fd-en
+        try:
+            _limit_resources(process.pid, options.nice, cpus)
+        except OSError:
+            process.kill()
+            process.wait()
+            raise
+        self._process = process
+        # reap i bakgrunnen, ellers blir barnet en zombie til noen spør om status
+        threading.Thread(target=process.wait, name="training-reaper", daemon=True).start()
+
+        run = {
+            "run_id": run_id,
+            "run_dir": str(run_path),
+            "pid": process.pid,
+            "started_at": time.time(),
+            "checkpoint_dir": str(checkpoint_dir),
+            "resumed": resume_dir is not None,
+            "options": asdict(options),
+        }
+        (run_path / RUN_FILE).write_text(json.dumps(run), encoding="utf-8")
+        return run
+
+    def stop(self, timeout: float = 10.0) -> bool:
+        """Stopp pågående trening, også om en annen worker startet den."""
+        run = self._latest_run()
+        if run is None or not self.is_running(run):
+            return False
+        pid = run["pid"]
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return False
+        deadline = time.monotonic() + timeout
+        while self.is_running(run) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.is_running(run):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        return True
+
+    def status(self) -> Dict:
+        run = self._latest_run()
+        if run is None:
+            return {"status": "idle", "last_run": None}
+        running = self.is_running(run)
+        # returkoden kjenner bare workeren som startet prosessen
+        process = self._process
+        returncode = process.poll() if process is not None and process.pid == run.get("pid") else None
+        progress = _read_json(Path(run["run_dir"]) / PROGRESS_FILE)
+
+        if running:
+            status = "running"
+        elif progress.get("state") == "completed" and returncode in (None, 0):
+            status = "completed"
+        else:
+            status = "failed"
+
+        return {
+            "status": status,
+            "returncode": returncode,
+            "last_run": run,
+            "progress": {k: progress.get(k) for k in
+                         ("phase", "epoch", "epochs", "batch", "batches", "loss", "samples_per_sec",
+                          "world_size", "val_loss", "phase_accuracy", "updated_at") if k in progress},
+        }
+
+
+runner = TrainingRunner()
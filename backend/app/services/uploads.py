@@ -0,0 +1,95 @@
+import hashlib
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from fastapi import UploadFile
+
+from .config import MAX_UPLOAD_BYTES, UPLOAD_CHUNK_BYTES
+
+_SAFE_SUFFIX = re.compile(r"^\.[a-z0-9]{1,8}$")
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload exceeds the configured size limit."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"Upload exceeds limit of {limit} bytes")
+        self.limit = limit
+
+
+@dataclass
+class StoredUpload:
+    """
+    En opplasting som er lagret under et innholdsadressert navn.
+    `data` holder de samme bytene som ble skrevet til disk, slik at analysen
+    slipper å lese filen på nytt.
+    """
+    path: Path
+    sha256: str
+    size: int
+    data: bytearray
+    original_filename: Optional[str] = None
+
+
+def safe_suffix(filename: Optional[str], default: str = "") -> str:
+    """Return a lowercase file extension from a client filename, or `default`."""
+    suffix = Path(filename or "").suffix.lower()
+    return suffix if _SAFE_SUFFIX.match(suffix) else default
+
+
+async def store_upload(
+    file: UploadFile,
+    dest_dir: Path,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    chunk_size: int = UPLOAD_CHUNK_BYTES,
+) -> StoredUpload:
+    """Stream an upload to `dest_dir/<sha256><ext>` in fixed-size chunks.
+
+    The size limit is checked before reading (when the client sent a size)
+    and again per chunk, so an oversized body is rejected after at most
+    `max_bytes + chunk_size` bytes. The file is hashed while streaming and
+    only renamed into place once complete; identical content maps to the
+    same name, so concurrent uploads never overwrite a different file.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                if len(buffer) + len(chunk) > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                out.write(chunk)
+                buffer += chunk
+
+        sha256 = digest.hexdigest()
+        final_path = dest_dir / f"{sha256}{safe_suffix(file.filename)}"
+        if final_path.exists():
+            # Samme innhold finnes allerede – behold eksisterende fil
+            os.unlink(tmp_name)
+        else:
+            os.replace(tmp_name, final_path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+    return StoredUpload(
+        path=final_path,
+        sha256=sha256,
+        size=len(buffer),
+        data=buffer,
+        original_filename=file.filename,
+    )
@@ -0,0 +1,224 @@
+"""
+Analyse av videoopptak (walk-arounds) ved å plukke ut et lite utvalg bilder.
+
+En 60 s klipp i 30 fps er 1800 bilder; de fleste er nesten like. I stedet
+for å analysere alle:
+
+- `grab()` går forbi bilder uten å konvertere dem; bare utvalgte bilder hentes
+  med `retrieve()` (fargekonvertering + kopi).
+- Utvalget er tidsbasert (`every_s`), eller styrt av sceneskifte: et lite
+  gråtonebilde (64 px bredt) sammenlignes med forrige utvalgte bilde, og et
+  nytt tas når forskjellen er over terskelen (med `every_s` som lengste pause).
+- Bildene skaleres ned til analysestørrelsen før de legges i køen, og bare et
+  begrenset antall er underveis samtidig, så minnet er konstant for lange klipp.
+
+Analysen kjøres parallelt i workerens analyse-pool (services/concurrency.py),
+og resultatene sendes tilbake i rekkefølge, ett per linje (NDJSON).
+"""
+import asyncio
+import os
+import tempfile
+import threading
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+
+import cv2
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from . import concurrency
+from .config import UPLOAD_CHUNK_BYTES, VIDEO_MAX_FRAMES
+from .uploads import UploadTooLarge
+
+PROBE_WIDTH = 64  # bredde på gråtonebildet som brukes til sceneskifte
+
+
+class VideoError(ValueError):
+    pass
+
+
+@dataclass
+class SampledFrame:
+    index: int
+    t: float
+    reason: str  # "interval" | "scene" | "first"
+    image: np.ndarray
+    scene_score: Optional[float] = None
+
+
+async def spool_upload(file, max_bytes: int, suffix: str = ".mp4") -> Path:
+    """Strøm en videoopplasting til en midlertidig fil (VideoCapture trenger en sti).
+
+    I motsetning til bildeopplastinger holdes ingenting i minnet.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    fd, name = tempfile.mkstemp(prefix="video-", suffix=suffix)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(name)
+        raise
+    return Path(name)
+
+
+def _probe(image: np.ndarray) -> np.ndarray:
+    height = max(1, round(image.shape[0] * PROBE_WIDTH / image.shape[1]))
+    small = cv2.resize(image, (PROBE_WIDTH, height), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.int16)
+
+
+def _fit(image: np.ndarray, max_side: int) -> np.ndarray:
+    longest = max(image.shape[:2])
+    if max_side <= 0 or longest <= max_side:
+        return image
+    scale = max_side / longest
+    size = (max(1, round(image.shape[1] * scale)), max(1, round(image.shape[0] * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+class FrameSampler:
+    """Leser en video og gir utvalgte bilder (generator, ett bilde i minnet av gangen)."""
+
+    def __init__(self, path: Path, every_s: float = 1.0, scene_threshold: Optional[float] = None,
+                 probe_fps: float = 5.0, max_frames: int = VIDEO_MAX_FRAMES, max_side: int = 0):
+        self.cap = cv2.VideoCapture(str(path))
+        if not self.cap.isOpened():
+            raise VideoError("Could not open video")
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else 30.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH) or 0)
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT) or 0)
+        self.every = max(1, round(every_s * self.fps))
+        self.scene_threshold = scene_threshold
+        # sceneskifte: hent et lite utvalg (probe_fps) for sammenligning, ikke hvert bilde
+        self.probe_every = max(1, round(self.fps / probe_fps)) if scene_threshold is not None else self.every
+        self.max_frames = max_frames
+        self.max_side = max_side
+        self.decoded = 0  # bilder hentet med retrieve()
+        self._lock = threading.Lock()  # close() fra en annen tråd må ikke frigi midt i grab/retrieve
+
+    def info(self) -> Dict[str, Any]:
+        return {"fps": round(self.fps, 3), "frames": self.frame_count, "width": self.width, "height": self.height,
+                "duration_s": round(self.frame_count / self.fps, 3) if self.frame_count else None}
+
+    def __iter__(self) -> Iterator[SampledFrame]:
+        last_index, last_probe, emitted = None, None, 0
+        index = -1
+        try:
+            while emitted < self.max_frames:
+                with self._lock:
+                    if not self.cap.grab():  # False også etter close()
+                        break
+                index += 1
+                due = last_index is None or index - last_index >= self.every
+                if not due and index % self.probe_every:
+                    continue  # hoppes over uten dekoding til BGR
+                with self._lock:
+                    ok, frame = self.cap.retrieve()
+                if not ok:
+                    break
+                self.decoded += 1
+                reason, score = ("first" if last_index is None else "interval"), None
+                if self.scene_threshold is not None:
+                    probe = _probe(frame)
+                    if last_probe is not None:
+                        score = float(np.mean(np.abs(probe - last_probe))) / 255.0
+                        if not due and score < self.scene_threshold:
+                            continue
+                        if not due:
+                            reason = "scene"
+                    last_probe = probe
+                last_index = index
+                emitted += 1
+                yield SampledFrame(index, round(index / self.fps, 3), reason, _fit(frame, self.max_side), score)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Frigi dekoderen (idempotent, trygt fra en annen tråd enn den som itererer)."""
+        with self._lock:
+            self.cap.release()
+
+
+async def score_frames(sampler: FrameSampler, score, window: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """Analyser utvalgte bilder parallelt og gi resultatene i rekkefølge.
+
+    `score(image)` er en coroutine. Høyst `window` bilder er dekodet eller under
+    analyse samtidig (default 2 x analyse-poolen), så minnet er begrenset.
+    """
+    window = window or 2 * concurrency.current.pool_size
+    frames = iter(sampler)
+    pending: "deque[tuple]" = deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < window:
+                frame = await run_in_threadpool(next, frames, None)  # dekoding holder ikke event-loopen
+                if frame is None:
+                    exhausted = True
+                    break
+                pending.append((frame, asyncio.ensure_future(score(frame.image))))
+            if not pending:
+                return
+            frame, task = pending.popleft()
+            item = {"type": "frame", "index": frame.index, "t": frame.t, "reason": frame.reason}
+            if frame.scene_score is not None:
+                item["scene_score"] = round(frame.scene_score, 4)
+            try:
+                item["metrics"] = await task
+            except Exception as e:
+                item["error"] = str(e)
+            frame.image = None
+            yield item
+    finally:
+        # klienten koblet fra (eller feil): ikke la analyser og dekoder henge igjen
+        for _, task in pending:
+            task.cancel()
+        try:
+            frames.close()
+        except ValueError:  # avbrutt midt i en dekoding i tråden: frigis når den er ferdig
+            pass
+
+
+class Summary:
+    """Løpende oppsummering (holder ikke på resultatene, bare tallene)."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.worst: Optional[Dict[str, Any]] = None
+        self.best: Optional[float] = None
+
+    def add(self, item: Dict[str, Any]) -> None:
+        cqi = (item.get("metrics") or {}).get("cqi")
+        if cqi is None:
+            self.errors += "error" in item
+            return
+        self.count += 1
+        self.total += cqi
+        self.best = cqi if self.best is None else max(self.best, cqi)
+        if self.worst is None or cqi < self.worst["cqi"]:
+            self.worst = {"index": item["index"], "t": item["t"], "cqi": cqi}
+
+    def result(self, sampler: Optional[FrameSampler] = None) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"type": "summary", "frames_analyzed": self.count, "errors": self.errors}
+        if sampler is not None:
+            out["frames_decoded"] = sampler.decoded
+        if self.count:
+            out.update({"cqi_mean": round(self.total / self.count, 2), "cqi_max": round(self.best, 2),
+                        "worst_frame": self.worst})
+        return out
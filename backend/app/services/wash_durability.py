@@ -0,0 +1,248 @@
+"""
+Holdbarhetsprognose for coating per kjøretøy/panel fra analysehistorikken.
+
+Hver analyse med `vehicle_id` lagres som en observasjon (tid, CQI, glatthet) i
+en liten SQLite-logg. I minnet holdes bare tilstrekkelige størrelser per serie
+og metrikk (n, Σt, Σt², Σy, Σty, Σy²), så en ny observasjon er en addisjon og
+ikke en ny tilpasning over hele historikken. Lineær degraderingskurve
+y = a + b·t (t i dager fra seriens første analyse) løses deretter samlet for
+alle serier med NumPy – bare serier som har fått nye data siden sist regnes om.
+
+Prognosen er datoen der den tilpassede kurven krysser terskelen for ny coating
+(`WASH_RECOAT_CQI` / `WASH_RECOAT_SMOOTHNESS`); den tidligste av de to gjelder.
+"""
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import WASH_HISTORY_PATH, WASH_MIN_POINTS, WASH_RECOAT_CQI, WASH_RECOAT_SMOOTHNESS
+
+METRICS = ("cqi", "smoothness")
+DAY = 86400.0
+SeriesKey = Tuple[str, str]  # (vehicle_id, panel); panel "" = hele bilen
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicle_id  TEXT NOT NULL,
+    panel       TEXT NOT NULL DEFAULT '',
+    ts          REAL NOT NULL,
+    cqi         REAL,
+    smoothness  REAL
+);
+CREATE INDEX IF NOT EXISTS idx_observations_vehicle ON observations(vehicle_id, panel);
+"""
+
+
+def open_history(path: Optional[str] = None) -> sqlite3.Connection:
+    db_path = Path(path or WASH_HISTORY_PATH)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class DurabilityEngine:
+    """Inkrementelle lineære tilpasninger for alle serier, vektorisert over serier."""
+
+    def __init__(self, path: Optional[str] = None, capacity: int = 1024):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._last_id = 0
+        self._index: Dict[SeriesKey, int] = {}
+        self._vehicles: Dict[str, List[int]] = {}
+        self._keys: List[SeriesKey] = []
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int) -> None:
+        m = len(METRICS)
+        old = getattr(self, "_n", None)
+        size = 0 if old is None else len(self._keys)
+
+        def grow(arr, shape, fill=0.0):
+            new = np.full(shape, fill, dtype=np.float64)
+            if arr is not None:
+                new[:size] = arr[:size]
+            return new
+
+        self._n = grow(getattr(self, "_n", None), (capacity, m))
+        self._t0 = grow(getattr(self, "_t0", None), capacity, np.nan)
+        self._t_last = grow(getattr(self, "_t_last", None), capacity)
+        # tilstrekkelige størrelser per (serie, metrikk): Σt, Σt², Σy, Σty, Σy²
+        self._sums = grow(getattr(self, "_sums", None), (capacity, m, 5))
+        self._fit = grow(getattr(self, "_fit", None), (capacity, m, 3), np.nan)  # a, b, residual-std
+        dirty = np.ones(capacity, dtype=bool)
+        if old is not None:
+            dirty[:size] = self._dirty[:size]
+        self._dirty = dirty
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = open_history(self.path)
+        return self._conn
+
+    def _row(self, key: SeriesKey) -> int:
+        row = self._index.get(key)
+        if row is None:
+            row = len(self._keys)
+            if row == len(self._n):
+                self._alloc(2 * len(self._n))
+            self._index[key] = row
+            self._keys.append(key)
+            self._vehicles.setdefault(key[0], []).append(row)
+        return row
+
+    # -- data inn ----------------------------------------------------------
+
+    def _accumulate(self, keys: Sequence[SeriesKey], ts: np.ndarray, values: np.ndarray) -> None:
+        """Legg observasjoner inn i summene. values: (k, len(METRICS)), NaN = mangler."""
+        rows = np.fromiter((self._row(k) for k in keys), dtype=np.int64, count=len(keys))
+        # første tidspunkt per serie blir nullpunktet for t (holder summene små)
+        first = np.full(len(self._n), np.inf)
+        np.minimum.at(first, rows, ts)
+        fresh = np.isnan(self._t0) & np.isfinite(first)
+        self._t0[fresh] = first[fresh]
+        np.maximum.at(self._t_last, rows, ts)
+
+        t = ((ts - self._t0[rows]) / DAY)[:, None]
+        present = ~np.isnan(values)
+        y = np.where(present, values, 0.0)
+        w = present.astype(np.float64)
+        stacked = np.stack([w * t, w * t * t, y, y * t, y * y], axis=-1)
+        np.add.at(self._n, rows, w)
+        np.add.at(self._sums, rows, stacked)
+        self._dirty[rows] = True
+
+    def sync(self) -> int:
+        """Les nye observasjoner fra loggen (også fra andre workere). Antall nye."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, vehicle_id, panel, ts, cqi, smoothness FROM observations WHERE id > ? ORDER BY id",
+                (self._last_id,)).fetchall()
+            if not rows:
+                return 0
+            data = np.array([(r[3], np.nan if r[4] is None else r[4], np.nan if r[5] is None else r[5])
+                             for r in rows], dtype=np.float64)
+            self._accumulate([(r[1], r[2]) for r in rows], data[:, 0], data[:, 1:])
+            self._last_id = rows[-1][0]
+            return len(rows)
+
+    def record_many(self, observations: Iterable[Dict]) -> int:
+        """Lagre observasjoner {vehicle_id, panel?, ts?, cqi?, smoothness?}."""
+        now = time.time()
+        values = [
+            (o["vehicle_id"], o.get("panel") or "", float(o.get("ts") or now), o.get("cqi"), o.get("smoothness"))
+            for o in observations
+        ]
+        with self._lock:
+            self.conn.executemany(
+                "INSERT INTO observations (vehicle_id, panel, ts, cqi, smoothness) VALUES (?, ?, ?, ?, ?)", values)
+            self.conn.commit()
+        self.sync()
+        return len(values)
+
+    def record(self, vehicle_id: str, metrics: Dict, panel: Optional[str] = None, ts: Optional[float] = None) -> None:
+        self.record_many([{"vehicle_id": vehicle_id, "panel": panel, "ts": ts,
+                           **{m: metrics.get(m) for m in METRICS}}])
+
+    # -- tilpasning --------------------------------------------------------
+
+    def _refit(self) -> None:
+        """Løs minste kvadrater for alle serier med nye data, samlet."""
+        size = len(self._keys)
+        rows = np.flatnonzero(self._dirty[:size])
+        if rows.size == 0:
+            return
+        n = self._n[rows]
+        st, stt, sy, sty, syy = np.moveaxis(self._sums[rows], -1, 0)
+        det = n * stt - st * st
+        with np.errstate(invalid="ignore", divide="ignore"):
+            b = np.where(det > 1e-9, (n * sty - st * sy) / det, 0.0)
+            a = np.where(n > 0, (sy - b * st) / n, np.nan)
+            # restkvadratsum fra summene: Σ(y - a - bt)²
+            sse = syy - 2 * a * sy - 2 * b * sty + a * a * n + 2 * a * b * st + b * b * stt
+            resid = np.sqrt(np.maximum(sse, 0.0) / np.maximum(n - 2, 1))
+        self._fit[rows] = np.stack([a, b, resid], axis=-1)
+        self._dirty[rows] = False
+
+    def forecast_rows(self, rows: np.ndarray, now: Optional[float] = None) -> List[Dict]:
+        now = now or time.time()
+        self._refit()
+        thresholds = np.array([WASH_RECOAT_CQI, WASH_RECOAT_SMOOTHNESS])
+        n = self._n[rows]
+        a, b, resid = np.moveaxis(self._fit[rows], -1, 0)
+        t_now = (now - self._t0[rows]) / DAY
+        current = a + b * t_now[:, None]
+        enough = n >= WASH_MIN_POINTS
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t_hit = np.where(b < 0, (thresholds - a) / b, np.inf)
+        # allerede under terskelen: forfalt nå, uansett retning på kurven
+        t_hit = np.where(current < thresholds, t_now[:, None], np.maximum(t_hit, t_now[:, None]))
+        t_hit = np.where(enough, t_hit, np.inf)
+        hit_ts = self._t0[rows][:, None] + t_hit * DAY
+        recoat = hit_ts.min(axis=1)
+        limiting = hit_ts.argmin(axis=1)
+
+        results = []
+        for i, row in enumerate(rows.tolist()):
+            vehicle_id, panel = self._keys[row]
+            metrics = {}
+            for j, name in enumerate(METRICS):
+                metrics[name] = {
+                    "points": int(n[i, j]),
+                    "current": None if not enough[i, j] else round(float(current[i, j]), 2),
+                    "slope_per_30d": None if not enough[i, j] else round(float(b[i, j] * 30), 3),
+                    "residual_std": None if not enough[i, j] else round(float(resid[i, j]), 3),
+                }
+            due = bool(np.isfinite(recoat[i]) and recoat[i] <= now)
+            results.append({
+                "vehicle_id": vehicle_id,
+                "panel": panel,
+                "last_analysis": _iso(self._t_last[row]),
+                "recoat_date": _iso(recoat[i]) if np.isfinite(recoat[i]) else None,
+                "days_left": round(float(max(recoat[i] - now, 0.0) / DAY), 1) if np.isfinite(recoat[i]) else None,
+                "limiting_metric": METRICS[limiting[i]] if np.isfinite(recoat[i]) else None,
+                "recommendation": "recoat_recommended" if due else "continue",
+                "metrics": metrics,
+            })
+        return results
+
+    def forecast(self, requests: Optional[Iterable[Tuple[str, Optional[str]]]] = None,
+                 now: Optional[float] = None) -> Tuple[List[Dict], List[Tuple[str, Optional[str]]]]:
+        """Prognose for (vehicle_id, panel)-par; panel None = alle paneler. None = alle serier.
+
+        Returnerer (resultater, ukjente forespørsler).
+        """
+        self.sync()
+        with self._lock:
+            if requests is None:
+                rows = list(range(len(self._keys)))
+                missing = []
+            else:
+                rows, missing = [], []
+                for vehicle_id, panel in requests:
+                    found = self._vehicles.get(vehicle_id, []) if panel is None else (
+                        [self._index[(vehicle_id, panel)]] if (vehicle_id, panel) in self._index else [])
+                    if found:
+                        rows.extend(found)
+                    else:
+                        missing.append((vehicle_id, panel))
+            return self.forecast_rows(np.asarray(rows, dtype=np.int64), now), missing
+
+    def stats(self) -> Dict:
+        return {"series": len(self._keys), "vehicles": len(self._vehicles), "last_observation_id": self._last_id}
+
+
+engine = DurabilityEngine()
@@ -0,0 +1,109 @@
+"""
+Auto-tuning av workere x tråder for denne maskinen.
+
+Starter for hver kombinasjon like mange prosesser som uvicorn-workere. Hver
+prosess setter `cv2.setNumThreads`/BLAS-grensene og kjører `analyze_coating`
+med samme analyse-pool som i produksjon (services/concurrency.py). Resultatet
+er bilder per sekund for hele maskinen, og den beste kombinasjonen lagres som
+profil (`CONCURRENCY_PROFILE`). Workerne leser den ved oppstart og bruker
+den beste målingen for sitt eget antall workere.
+
+Usage:
+    python backend/scripts/autotune_concurrency.py [--seconds 3] [--workers 2] [--no-write]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.app.services import concurrency  # noqa: E402  (før numpy: BLAS-variablene)
+from backend.app.services.config import CONCURRENCY_PROFILE  # noqa: E402
+
+
+def _worker(cv_threads, pool_size, seconds, size, start, queue):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import cv2
+    import numpy as np
+
+    from backend.app.core.coatvision_core import analyze_coating
+
+    cv2.setNumThreads(cv_threads)
+    rng = np.random.default_rng(os.getpid())
+    image = cv2.GaussianBlur(rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8), (9, 9), 0)
+    analyze_coating(image)  # oppvarming
+
+    def loop(deadline):
+        done = 0
+        while time.perf_counter() < deadline:
+            analyze_coating(image)
+            done += 1
+        return done
+
+    start.wait()
+    deadline = time.perf_counter() + seconds
+    with ThreadPoolExecutor(pool_size) as pool:
+        queue.put(sum(pool.map(loop, [deadline] * pool_size)))
+
+
+def measure(workers, cv_threads, pool_size, args):
+    ctx = multiprocessing.get_context("spawn")
+    for var in concurrency.BLAS_ENV_VARS:
+        os.environ[var] = str(cv_threads)  # arves av barneprosessene før numpy lastes
+    start, queue = ctx.Event(), ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(cv_threads, pool_size, args.seconds, args.size, start, queue))
+             for _ in range(workers)]
+    for p in procs:
+        p.start()
+    time.sleep(1.0)  # la alle importere og varme opp
+    start.set()
+    done = sum(queue.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return done / args.seconds
+
+
+def candidates(cpus, fixed_workers=None):
+    for workers in ([fixed_workers] if fixed_workers else range(1, cpus + 1)):
+        budget = max(1, cpus // workers)
+        # cv_threads = cpus er bibliotekenes default (overabonnert når workers > 1): referansen
+        for cv_threads in sorted({1, min(2, budget), budget, cpus}):
+            yield workers, cv_threads, max(1, budget // cv_threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=3.0, help="measuring window per combination")
+    parser.add_argument("--workers", type=int, default=0, help="only tune threads for this worker count")
+    parser.add_argument("--size", type=int, nargs=2, default=(1280, 960), metavar=("W", "H"))
+    parser.add_argument("--profile", default=CONCURRENCY_PROFILE)
+    parser.add_argument("--no-write", action="store_true")
+    args = parser.parse_args()
+
+    cpus = concurrency.available_cpus()
+    print(f"cpus={cpus} (cgroup limit {concurrency.cgroup_cpu_limit()}), image {args.size[0]}x{args.size[1]}")
+    print(f"{'workers':>7} {'cv/blas':>7} {'pool':>5} {'img/s':>8}")
+    results = []
+    for workers, cv_threads, pool_size in candidates(cpus, args.workers or None):
+        rate = measure(workers, cv_threads, pool_size, args)
+        results.append({"workers": workers, "cv_threads": cv_threads, "pool_size": pool_size,
+                        "images_per_s": round(rate, 2)})
+        print(f"{workers:>7} {cv_threads:>7} {pool_size:>5} {rate:>8.2f}")
+
+    best = max(results, key=lambda r: r["images_per_s"])
+    print(f"\nbest: WEB_CONCURRENCY={best['workers']} CONCURRENCY_POOL_SIZE={best['pool_size']} "
+          f"CONCURRENCY_CV_THREADS={best['cv_threads']} ({best['images_per_s']} img/s)")
+    if not args.no_write:
+        profile = {"cpus": cpus, "best": best, "measured_at": time.time(), "results": results}
+        os.makedirs(os.path.dirname(os.path.abspath(args.profile)), exist_ok=True)
+        with open(args.profile, "w", encoding="utf-8") as f:
+            json.dump(profile, f, indent=2)
+        print(f"profile written to {args.profile}")
+
+
+if __name__ == "__main__":
+    main()
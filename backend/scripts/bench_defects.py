@@ -0,0 +1,70 @@
+"""
+Benchmark: kostnaden ved defektlokalisering i analyze_coating.
+
+Kjører analysen med og uten `defects=True` på samme bilde (vekselvis, så
+termisk/turbo-effekter treffer begge likt) og rapporterer medianen og
+merkostnaden i prosent.
+
+Usage:
+    python backend/scripts/bench_defects.py [image.jpg] [--runs 50] [--size 1280 960]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from backend.app.services import concurrency  # noqa: E402,F401  (før numpy: trådgrenser)
+
+
+def _synthetic(width, height):
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    img = np.full((height, width, 3), (40, 40, 160), np.float64) + rng.normal(0, 3, (height, width, 3))
+    img = cv2.GaussianBlur(img.clip(0, 255).astype(np.uint8), (5, 5), 0)
+    cv2.line(img, (width // 12, height * 5 // 6), (width // 2, height * 4 // 5), (230, 230, 230), 2)
+    for i in range(6):
+        y, x = rng.integers(0, height - 60), rng.integers(0, width - 60)
+        img[y:y + 50, x:x + 60] = rng.integers(0, 255, (50, 60, 3), dtype=np.uint8)
+    return img
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("image", nargs="?")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--size", type=int, nargs=2, default=(1280, 960), metavar=("W", "H"))
+    args = parser.parse_args()
+
+    import cv2
+
+    from backend.app.core.coatvision_core import analyze_coating
+
+    concurrency.apply()
+    img = cv2.imread(args.image) if args.image else _synthetic(*args.size)
+    if img is None:
+        sys.exit(f"Could not read image: {args.image}")
+
+    timings = {False: [], True: []}
+    for flag in (False, True):  # oppvarming
+        analyze_coating(img, defects=flag)
+    for _ in range(args.runs):
+        for flag in (False, True):
+            started = time.perf_counter()
+            analyze_coating(img, defects=flag)
+            timings[flag].append(time.perf_counter() - started)
+
+    base = statistics.median(timings[False]) * 1000
+    with_defects = statistics.median(timings[True]) * 1000
+    regions = analyze_coating(img, defects=True)["defects"]
+    print(f"image {img.shape[1]}x{img.shape[0]}, {args.runs} runs, cv2 threads {cv2.getNumThreads()}")
+    print(f"baseline      {base:7.2f} ms")
+    print(f"with defects  {with_defects:7.2f} ms  (+{(with_defects / base - 1) * 100:.1f}%, {len(regions)} regions)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark: treffrate for resultat-cachen med flere workere.
+
+Simulerer N uvicorn-workere (egne prosesser) som får forespørsler fra samme
+Zipf-fordelte mengde bilder (noen bilder/URL-er er mye mer populære enn andre).
+Hver bom koster en ekte `analyze_coating` på et lite bilde. Sammenligner:
+
+- local:  bare L1 i hver prosess (slik en in-process cache oppfører seg)
+- shared: L1 + delt SQLite-WAL (backend.app.services.shared_cache)
+
+Usage:
+    python backend/scripts/bench_shared_cache.py [--workers 4] [--requests 2000] [--keys 500]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+
+def _worker(seed, path, args, queue):
+    import numpy as np
+
+    from backend.app.core.coatvision_core import analyze_coating
+    from backend.app.services.shared_cache import SharedCache
+
+    cache = SharedCache(path, l1_size=args.l1)
+    rng = np.random.default_rng(seed)
+    ranks = np.arange(1, args.keys + 1)
+    weights = 1.0 / ranks ** args.zipf
+    keys = rng.choice(args.keys, size=args.requests, p=weights / weights.sum())
+    image = rng.integers(0, 255, (240, 320, 3), dtype=np.uint8)
+
+    started = time.perf_counter()
+    for key in keys:
+        cache.get_or_compute(f"bench:{key}", lambda: analyze_coating(image))
+    queue.put((time.perf_counter() - started, cache.stats()))
+
+
+def run(mode, args):
+    path = None
+    if mode == "shared":
+        path = os.path.join(tempfile.mkdtemp(), "cache.sqlite")
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(seed, path, args, queue)) for seed in range(args.workers)]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    total = {k: sum(r[1][k] for r in results) for k in ("l1_hits", "l2_hits", "misses")}
+    lookups = sum(total.values())
+    wall = max(r[0] for r in results)
+    print(f"{mode:>6}: hit rate {(total['l1_hits'] + total['l2_hits']) / lookups:6.1%}  "
+          f"(L1 {total['l1_hits']}, L2 {total['l2_hits']}, misses {total['misses']})  "
+          f"slowest worker {wall:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=2000, help="requests per worker")
+    parser.add_argument("--keys", type=int, default=500, help="distinct images")
+    parser.add_argument("--l1", type=int, default=256, help="L1 entries per worker")
+    parser.add_argument("--zipf", type=float, default=1.0, help="popularity skew")
+    args = parser.parse_args()
+    print(f"{args.workers} workers x {args.requests} requests over {args.keys} images (zipf {args.zipf})")
+    for mode in ("local", "shared"):
+        run(mode, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+
+import backend.app.main as app_main
+from backend.app.services import artifacts
+from backend.app.services.artifacts import parse_range
+
+client = TestClient(app_main.app)
+
+
+def _overlay(monkeypatch, tmp_path, width=900, height=600):
+    monkeypatch.setattr(app_main, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(app_main, "OUTPUT_DIR", tmp_path / "outputs")
+    monkeypatch.setattr(app_main, "STORAGE_INDEX_PATH", tmp_path / "storage_index.sqlite")
+    img = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    blob = app_main.storage().put_bytes(data, "outputs", ".png", source="x")
+    return blob, data
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None  # flere intervaller: hele filen
+    for bad in ("bytes=100-", "bytes=5-4", "bytes=-0"):
+        try:
+            parse_range(bad, 100)
+        except ValueError:
+            continue
+        raise AssertionError(bad)
+
+
+def test_content_hash_url_is_immutable_and_revalidates(monkeypatch, tmp_path):
+    blob, data = _overlay(monkeypatch, tmp_path)
+
+    r = client.get(f"/outputs/{blob.name}")
+    assert r.status_code == 200
+    assert r.content == data
+    assert r.headers["etag"] == f'"{blob.sha256}"'
+    assert "immutable" in r.headers["cache-control"]
+    assert r.headers["accept-ranges"] == "bytes"
+    assert r.headers["content-type"] == "image/png"
+
+    r = client.get(f"/outputs/{blob.name}", headers={"If-None-Match": f'W/"other", "{blob.sha256}"'})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert client.get("/outputs/" + "0" * 64 + ".png").status_code == 404
+
+
+def test_range_requests(monkeypatch, tmp_path):
+    blob, data = _overlay(monkeypatch, tmp_path)
+    url = f"/outputs/{blob.name}"
+
+    r = client.get(url, headers={"Range": "bytes=10-19"})
+    assert r.status_code == 206
+    assert r.content == data[10:20]
+    assert r.headers["content-range"] == f"bytes 10-19/{len(data)}"
+
+    r = client.get(url, headers={"Range": "bytes=-5"})
+    assert r.status_code == 206 and r.content == data[-5:]
+
+    r = client.get(url, headers={"Range": f"bytes={len(data)}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(data)}"
+
+    # If-Range med gammel ETag: hele (nye) filen
+    r = client.get(url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200 and r.content == data
+
+
+def test_sendfile_extension_is_used_when_offered(monkeypatch, tmp_path):
+    blob, data = _overlay(monkeypatch, tmp_path)
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopy":
+            sent.append(os.pread(message["file"], message["count"], message["offset"]))
+        elif message["type"] == "http.response.body":
+            raise AssertionError("body should not be copied through the application")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    from starlette.requests import Request
+    import anyio
+
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"",
+             "headers": [(b"range", b"bytes=4-11")], "extensions": {"http.response.zerocopy": {}}}
+    response = artifacts.ArtifactResponse(blob.path, '"x"', artifacts.IMMUTABLE, Request(scope))
+    anyio.run(response, scope, receive, send)
+    assert sent == [data[4:12]]
+
+
+def test_width_variant_generated_once(monkeypatch, tmp_path):
+    blob, _ = _overlay(monkeypatch, tmp_path)
+    calls = []
+    render = artifacts._render_variant
+    monkeypatch.setattr(artifacts, "_render_variant", lambda path, width: calls.append(width) or render(path, width))
+
+    r = client.get(f"/outputs/{blob.name}?w=390")
+    assert r.status_code == 200
+    small = cv2.imdecode(np.frombuffer(r.content, np.uint8), cv2.IMREAD_COLOR)
+    assert small.shape[:2] == (267, 400)  # rundet opp til 400, samme sideforhold
+    assert "immutable" in r.headers["cache-control"]
+    assert r.headers["etag"] != f'"{blob.sha256}"'
+
+    again = client.get(f"/outputs/{blob.name}?w=400")
+    assert again.content == r.content
+    assert calls == [400]
+    assert app_main.storage().usage()["thumbnails"]["files"] == 1
+
+    # bredere enn originalen: originalen sendes uendret
+    assert client.get(f"/outputs/{blob.name}?w=1280").headers["etag"] == f'"{blob.sha256}"'
+
+
+def test_router_serves_legacy_flat_files(monkeypatch, tmp_path):
+    from fastapi import FastAPI
+    from backend.app.routers import artifacts as artifacts_router
+    from backend.app.services import storage
+
+    outputs = tmp_path / "outputs"
+    (outputs / "job1").mkdir(parents=True)
+    (outputs / "job1" / "overlay.png").write_bytes(b"legacy-bytes")
+    (tmp_path / "secret.txt").write_text("nope")
+    store = storage.BlobStore({"outputs": outputs, "thumbnails": outputs / ".variants"}, tmp_path / "idx.sqlite")
+    monkeypatch.setattr(artifacts_router, "OUTPUTS_DIR", outputs.resolve())
+    monkeypatch.setattr(storage, "default_store", lambda: store)
+    app = FastAPI()
+    app.include_router(artifacts_router.router)
+    c = TestClient(app)
+
+    r = c.get("/outputs/job1/overlay.png")
+    assert r.status_code == 200 and r.content == b"legacy-bytes"
+    assert "immutable" not in r.headers["cache-control"]
+    assert c.get("/outputs/job1/overlay.png", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+    assert c.get("/outputs/..%2Fsecret.txt").status_code == 404
+
+    blob = store.put_bytes(b"hashed", "outputs", ".png", source="x")
+    r = c.get(f"/outputs/{blob.name}", headers={"Range": "bytes=1-2"})
+    assert r.status_code == 206 and r.content == b"as"
+
+
+def test_main_serves_flat_overlays_from_before_the_blob_store(monkeypatch, tmp_path):
+    _overlay(monkeypatch, tmp_path)
+    legacy = tmp_path / "outputs" / "Skjermbilde 2025-11-22 020543_cv_output.png"
+    legacy.write_bytes(b"old-overlay")
+
+    r = client.get(f"/outputs/{legacy.name}")  # ikke indeksert ennå: flat fil
+    assert r.status_code == 200 and r.content == b"old-overlay"
+    assert app_main.storage().index_flat_files() == 1
+    r = client.get(f"/outputs/{legacy.name}")
+    assert r.status_code == 200 and r.content == b"old-overlay"
+    assert "immutable" not in r.headers["cache-control"]
+    assert client.get("/outputs/missing_cv_output.png").status_code == 404
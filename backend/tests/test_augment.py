@@ -0,0 +1,42 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "coatvision-app", "models"))
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from augment import BatchAugment  # noqa: E402
+
+
+def _images(n=4, size=40, seed=1):
+    g = torch.Generator().manual_seed(seed)
+    return torch.randint(0, 256, (n, size, size, 3), dtype=torch.uint8, generator=g)
+
+
+def test_same_seed_gives_same_output():
+    images = _images()
+    a = BatchAugment(24, seed=7)(images)
+    assert torch.equal(a, BatchAugment(24, seed=7)(images))
+    assert not torch.equal(a, BatchAugment(24, seed=8)(images))
+
+
+def test_output_shape_and_layout():
+    out = BatchAugment(24, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])(_images(n=5, size=37))
+    assert out.shape == (5, 3, 24, 24) and out.dtype == torch.float32
+    assert out.is_contiguous(memory_format=torch.channels_last)
+
+
+def test_colour_matrix_is_identity_without_jitter():
+    aug = BatchAugment(24, brightness=0.0, contrast=0.0, hue=0.0)
+    matrix, c, b = aug.color_params(3)
+    assert torch.allclose(matrix, torch.eye(3).expand(3, 3, 3), atol=1e-5)
+    assert torch.equal(c, torch.ones(3)) and torch.equal(b, torch.ones(3))
+
+    # uten utsnitt, speiling og støy er hele augmenteringen da identiteten
+    plain = BatchAugment(40, scale=(1.0, 1.0), ratio=(1.0, 1.0), flip_p=0.0,
+                         brightness=0.0, contrast=0.0, hue=0.0, noise_std=0.0)
+    images = _images()
+    expected = images.permute(0, 3, 1, 2).float() / 255.0
+    assert torch.allclose(plain(images), expected, atol=1e-4)
@@ -0,0 +1,75 @@
+import sys
+import os
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import pytest
+
+from backend.app.services.batching import Histogram, MicroBatcher
+
+
+def test_histogram_cumulative_buckets():
+    h = Histogram([1, 2, 4])
+    for v in (1, 1, 3, 10):
+        h.observe(v)
+    snap = h.snapshot()
+    assert snap["buckets"] == {"1": 2, "2": 2, "4": 3, "+Inf": 4}
+    assert snap["count"] == 4 and snap["mean"] == 3.75
+
+
+def test_concurrent_submits_share_one_batch():
+    calls = []
+
+    def double(items):
+        calls.append(list(items))
+        return [i * 2 for i in items]
+
+    batcher = MicroBatcher(double, max_batch=8, max_delay_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    assert asyncio.run(main()) == [0, 2, 4, 6, 8]
+    assert calls == [[0, 1, 2, 3, 4]]
+    stats = batcher.stats()
+    assert stats["batch_size"]["count"] == 1 and stats["batch_size"]["sum"] == 5
+    assert stats["queue_delay_ms"]["count"] == 5
+
+
+def test_max_batch_splits_batches():
+    sizes = []
+
+    def fn(items):
+        sizes.append(len(items))
+        return items
+
+    batcher = MicroBatcher(fn, max_batch=3, max_delay_ms=50)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(i) for i in range(7)))
+
+    assert asyncio.run(main()) == list(range(7))
+    assert sizes == [3, 3, 1]
+
+
+def test_errors_propagate_to_every_waiter():
+    def boom(items):
+        raise ValueError("bad batch")
+
+    batcher = MicroBatcher(boom, max_delay_ms=20)
+
+    async def main():
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+    # Batcheren overlever feilen og kan brukes i en ny event-loop
+    batcher.fn = lambda items: items
+    assert asyncio.run(batcher.submit(42)) == 42
+
+
+def test_result_count_mismatch_is_an_error():
+    batcher = MicroBatcher(lambda items: [], max_delay_ms=1)
+    with pytest.raises(RuntimeError):
+        asyncio.run(batcher.submit(1))
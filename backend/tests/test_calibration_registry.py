@@ -0,0 +1,88 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, event
+
+from backend.app.services import color_calibration
+from backend.app.services.calibration_registry import CalibrationRegistry
+
+
+def _params(device_id, camera="", gain=1.0):
+    measured = np.clip(color_calibration.COLORCHECKER_SRGB * gain, 0, 1)
+    return color_calibration.fit_calibration(device_id, measured, camera=camera)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path}/registry.db")
+
+
+def _count_queries(engine):
+    calls = []
+    event.listen(engine, "before_cursor_execute", lambda *a: calls.append(a[2]))
+    return calls
+
+
+def test_lookup_is_served_from_memory(engine):
+    registry = CalibrationRegistry(engine, poll_interval=3600)
+    registry.save(_params("phone-1"))
+    queries = _count_queries(engine)
+
+    lut = registry.resolve("phone-1")
+    assert lut is not None and registry.resolve("phone-1") is lut
+    assert registry.resolve("unknown") is None and registry.resolve(None) is None
+    assert queries == []
+
+
+def test_camera_falls_back_to_device_default(engine):
+    registry = CalibrationRegistry(engine)
+    registry.save(_params("phone-1"))
+    registry.save(_params("phone-1", camera="tele", gain=0.9))
+
+    assert registry.get("phone-1", "tele").camera == "tele"
+    assert registry.get("phone-1", "wide").camera == ""
+    with pytest.raises(color_calibration.CalibrationError):
+        registry.get("../etc/passwd")
+
+
+def test_other_worker_sees_changes_by_event_version(engine):
+    writer = CalibrationRegistry(engine)
+    reader = CalibrationRegistry(engine, poll_interval=0)
+    writer.save(_params("phone-1"))
+    writer.save(_params("phone-2"))
+    assert reader.get("phone-1").version == 1
+    first = reader.resolve("phone-1")
+
+    writer.save(_params("phone-1", gain=0.8))
+    assert reader.get("phone-1").version == 2
+    assert reader.resolve("phone-1") is not first
+    assert reader.get("phone-2").version == 1
+
+    queries = _count_queries(engine)
+    reader.get("phone-2")
+    # uendret: bare MAX(id)-sjekken, ingen profiler lastes på nytt
+    assert len(queries) == 1 and "max" in queries[0].lower()
+
+    writer.delete("phone-1")
+    assert reader.get("phone-1") is None and reader.get("phone-2") is not None
+
+
+def test_background_poller_picks_up_changes(engine):
+    import time
+
+    writer = CalibrationRegistry(engine)
+    reader = CalibrationRegistry(engine, poll_interval=0.05)
+    reader.refresh()
+    reader.start()
+    try:
+        writer.save(_params("phone-1"))
+        deadline = time.monotonic() + 5
+        while reader.stats()["profiles"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert reader.get("phone-1") is not None
+    finally:
+        reader.stop()
@@ -0,0 +1,82 @@
+import sys
+import os
+import base64
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.services import color_calibration
+from backend.app.services.color_calibration import COLORCHECKER_SRGB
+
+# Kamera som løfter skyggene (gamma) og blander kanalene litt
+CAMERA_MIX = np.array([[0.85, 0.10, 0.05], [0.05, 0.90, 0.05], [0.02, 0.13, 0.85]])
+
+
+def _camera(rgb):
+    return np.clip((rgb ** 0.8) @ CAMERA_MIX.T + 0.02, 0, 1)
+
+
+def _chart_photo(cell=40):
+    """BGR-bilde av referansekartet slik kameraet ser det."""
+    patches = _camera(COLORCHECKER_SRGB).reshape(4, 6, 3)
+    rgb = np.repeat(np.repeat(patches, cell, axis=0), cell, axis=1)
+    return np.rint(rgb[..., ::-1] * 255).astype(np.uint8)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    from backend.app.services import calibration_registry, shared_cache
+
+    monkeypatch.setattr(shared_cache, "cache", shared_cache.SharedCache(None))
+    registry = calibration_registry.CalibrationRegistry(create_engine(f"sqlite:///{tmp_path}/cal.db"))
+    monkeypatch.setattr(calibration_registry, "registry", registry)
+    for module in ("analyze", "calibration", "coatvision_v1"):
+        monkeypatch.setattr(f"backend.app.routers.{module}.registry", registry)
+    return registry
+
+
+def test_fit_reduces_error_and_lut_matches_float_path():
+    measured = color_calibration.sample_patches(_chart_photo())
+    params = color_calibration.fit_calibration("phone-1", measured)
+    assert params.error_after < params.error_before / 4
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+    lut_out = color_calibration.CalibrationLUT(params, size=64).apply(image)
+    float_out = params.transform(image[..., ::-1] / 255.0)[..., ::-1] * 255
+    assert lut_out.dtype == np.uint8 and lut_out.shape == image.shape
+    # nærmeste node i et 64^3-gitter: maks ~2 % avvik
+    assert np.abs(lut_out.astype(float) - float_out).mean() < 3
+
+
+def test_fit_endpoint_then_analyze_with_device(registry):
+    from backend.app.routers import analyze, calibration
+
+    app = FastAPI()
+    app.include_router(calibration.router)
+    app.include_router(analyze.router)
+    ok, png = cv2.imencode(".png", _chart_photo())
+    with TestClient(app) as client:
+        r = client.post("/api/calibration/devices/phone-1/fit",
+                        files=[("files", ("chart.png", png.tobytes(), "image/png"))] * 2)
+        assert r.status_code == 200, r.text
+        fitted = r.json()
+        params = client.get("/api/calibration/parameters", params={"device_id": "phone-1"}).json()
+
+        image = base64.b64encode(png.tobytes()).decode()
+        raw = client.post("/api/analyze/base64", json={"image": image}).json()["metrics"]
+        calibrated = client.post("/api/analyze/base64", json={"image": image, "device_id": "phone-1"}).json()["metrics"]
+        unknown = client.post("/api/analyze/base64?device_id=other", json={"image": image}).json()["metrics"]
+
+    assert fitted["patches"] == 48 and fitted["error_after"] < fitted["error_before"]
+    assert params["version"] == 1 and len(params["matrix"]) == 4
+    assert calibrated["calibrated"] is True and raw["calibrated"] is False
+    assert unknown["calibrated"] is False
+    # kameraet løfter lysstyrken; kalibreringen tar den tilbake mot referansen
+    assert calibrated["brightness_score"] < raw["brightness_score"]
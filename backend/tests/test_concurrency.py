@@ -0,0 +1,78 @@
+import sys
+import os
+import asyncio
+import threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import pytest
+
+from backend.app.services import concurrency
+
+
+@pytest.fixture(autouse=True)
+def no_env_overrides(monkeypatch):
+    monkeypatch.setattr(concurrency, "CONCURRENCY_POOL_SIZE", 0)
+    monkeypatch.setattr(concurrency, "CONCURRENCY_CV_THREADS", 0)
+
+
+def test_cgroup_quota_v2_and_v1(tmp_path):
+    (tmp_path / "cpu.max").write_text("250000 100000\n")
+    assert concurrency.cgroup_cpu_limit(tmp_path) == 2.5
+
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert concurrency.cgroup_cpu_limit(tmp_path) is None
+
+    (tmp_path / "cpu.max").unlink()
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("200000")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    assert concurrency.cgroup_cpu_limit(tmp_path) == 2.0
+    assert concurrency.available_cpus(tmp_path) <= 2
+
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1")
+    assert concurrency.cgroup_cpu_limit(tmp_path) is None
+
+
+def test_plan_splits_cpus_between_workers_and_pool():
+    p = concurrency.plan(cpus=4, workers=4, profile={})
+    assert (p.pool_size, p.cv_threads, p.blas_threads) == (1, 1, 1)
+    p = concurrency.plan(cpus=4, workers=1, profile={})
+    assert (p.pool_size, p.cv_threads) == (4, 1)
+    p = concurrency.plan(cpus=2, workers=8, profile={})
+    assert (p.pool_size, p.cv_threads) == (1, 1)
+
+
+def test_plan_uses_autotune_profile_for_same_host(monkeypatch):
+    profile = {"cpus": 4, "results": [
+        {"workers": 2, "cv_threads": 2, "pool_size": 1, "images_per_s": 30.0},
+        {"workers": 2, "cv_threads": 1, "pool_size": 2, "images_per_s": 41.0},
+        {"workers": 1, "cv_threads": 4, "pool_size": 1, "images_per_s": 90.0},
+    ]}
+    p = concurrency.plan(cpus=4, workers=2, profile=profile)
+    assert (p.pool_size, p.cv_threads, p.source) == (2, 1, "profile")
+    # annen maskinstørrelse: profilen gjelder ikke
+    assert concurrency.plan(cpus=8, workers=2, profile=profile).source == "auto"
+
+    monkeypatch.setattr(concurrency, "CONCURRENCY_CV_THREADS", 3)
+    p = concurrency.plan(cpus=4, workers=2, profile=profile)
+    assert (p.cv_threads, p.source) == (3, "env")
+
+
+def test_run_cpu_uses_bounded_analysis_pool(monkeypatch):
+    import cv2
+
+    monkeypatch.setattr(concurrency, "_pool", None)
+    monkeypatch.setattr(concurrency, "current", concurrency.ThreadPlan(4, 2, 2, 1, 1))
+    before = cv2.getNumThreads()
+    try:
+        async def names_of_threads():
+            return await asyncio.gather(
+                *[concurrency.run_cpu(lambda: threading.current_thread().name) for _ in range(6)])
+
+        names = asyncio.run(names_of_threads())
+        assert all(n.startswith("analysis") for n in names)
+        assert concurrency.analysis_pool()._max_workers == 2
+        assert cv2.getNumThreads() == 1 and concurrency.status()["applied"] is True
+    finally:
+        concurrency.analysis_pool().shutdown()
+        cv2.setNumThreads(before)
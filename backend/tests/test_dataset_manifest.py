@@ -0,0 +1,74 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+
+from backend.app.services import dataset_manifest as manifest
+from backend.app.services.training import Phase, TrainingSession
+
+
+def _write_image(path, value):
+    img = np.full((48, 64, 3), value, dtype=np.uint8)
+    cv2.imwrite(str(path), img)
+    return path
+
+
+def test_sync_is_incremental_and_tracks_removals(tmp_path):
+    data_dir = tmp_path / "training_data"
+    data_dir.mkdir()
+    for i in range(4):
+        _write_image(data_dir / f"train_{i}.png", 40 * i)
+    (data_dir / "notes.txt").write_text("ignored")
+
+    conn = manifest.open_manifest(str(tmp_path / "manifest.sqlite"))
+    assert manifest.sync_directories(conn, [data_dir]) == {"added_or_updated": 4, "removed": 0, "total": 4}
+    first_hash = manifest.manifest_hash(conn)
+
+    # Ingen endringer -> ingen nye dekodinger, samme hash
+    assert manifest.sync_directories(conn, [data_dir])["added_or_updated"] == 0
+    assert manifest.manifest_hash(conn) == first_hash
+
+    (data_dir / "train_0.png").unlink()
+    result = manifest.sync_directories(conn, [data_dir])
+    assert result["removed"] == 1 and result["total"] == 3
+    assert manifest.manifest_hash(conn) != first_hash
+
+    row = manifest.query(conn)[0]
+    assert (row["width"], row["height"]) == (64, 48)
+    assert len(row["sha256"]) == 64
+    assert "cqi" in row["metrics"] and row["cqi"] == row["metrics"]["cqi"]
+
+
+def test_session_labels_queries_and_split(tmp_path):
+    conn = manifest.open_manifest(str(tmp_path / "manifest.sqlite"))
+    session = TrainingSession(
+        id="s1", car_brand="Tesla", panel="hood", color="black", color_code="PBSB",
+        phase=Phase.NEW_LIGHT,
+    )
+    for i in range(20):
+        session.add_image(_write_image(tmp_path / f"img_{i}.png", i * 10))
+    assert manifest.record_session(conn, session) == 20
+
+    rows = manifest.query(conn, phase=Phase.NEW_LIGHT.value, panel="hood")
+    assert len(rows) == 20 and rows[0]["car_brand"] == "Tesla"
+    assert manifest.query(conn, phase=Phase.BASE_INFO.value) == []
+
+    train, val = manifest.split(conn, val_fraction=0.25, seed=1)
+    assert len(train) + len(val) == 20
+    assert {r["path"] for r in train}.isdisjoint(r["path"] for r in val)
+    assert manifest.split(conn, val_fraction=0.25, seed=1) == (train, val)
+
+
+def test_upsert_many_writes_a_batch_in_one_transaction(tmp_path):
+    paths = [_write_image(tmp_path / f"img{i}.png", i * 40) for i in range(3)]
+    conn = manifest.open_manifest(str(tmp_path / "manifest.sqlite"))
+    statements = []
+    conn.set_trace_callback(statements.append)
+
+    assert manifest.upsert_many(conn, paths + [tmp_path / "gone.png"]) == 3
+    assert sum(s.startswith("INSERT") for s in statements) == 3
+    assert sum(s == "COMMIT" for s in statements) == 1
+    assert manifest.upsert_many(conn, paths) == 0
+    assert manifest.count(conn) == 3
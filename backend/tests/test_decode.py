@@ -0,0 +1,46 @@
+import sys
+import os
+import base64
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+
+from backend.app.core.coatvision_core import (
+    decode_base64_image,
+    decode_image_bytes,
+    process_image_file,
+    read_image_size,
+)
+
+
+def _encode(ext, width, height):
+    img = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    _, buffer = cv2.imencode(ext, img)
+    return buffer.tobytes()
+
+
+def test_read_image_size_from_headers():
+    assert read_image_size(_encode(".jpg", 320, 240)) == (320, 240)
+    assert read_image_size(_encode(".png", 50, 70)) == (50, 70)
+    assert read_image_size(b"not an image") is None
+
+
+def test_large_jpeg_is_decoded_reduced():
+    data = _encode(".jpg", 2048, 1536)
+    assert decode_image_bytes(data, target_max_side=500).shape == (384, 512, 3)
+    assert decode_image_bytes(data, target_max_side=1024).shape == (768, 1024, 3)
+    assert decode_image_bytes(data, target_max_side=0).shape == (1536, 2048, 3)
+
+
+def test_small_and_non_jpeg_images_keep_full_size(tmp_path):
+    jpeg = _encode(".jpg", 640, 480)
+    assert decode_base64_image(base64.b64encode(jpeg).decode(), target_max_side=500).shape == (480, 640, 3)
+
+    png = _encode(".png", 2048, 1024)
+    assert decode_image_bytes(png, target_max_side=256).shape == (1024, 2048, 3)
+
+    path = tmp_path / "panel.jpg"
+    path.write_bytes(_encode(".jpg", 1600, 1200))
+    metrics = process_image_file(str(path), target_max_side=400)
+    assert "cqi" in metrics
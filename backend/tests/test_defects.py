@@ -0,0 +1,71 @@
+import sys
+import os
+import base64
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.core.coatvision_core import analyze_coating, create_analysis_overlay
+
+
+def _panel(spots=((200, 900),), streak=True):
+    rng = np.random.default_rng(0)
+    img = np.full((960, 1280, 3), (40, 40, 160), np.float64) + rng.normal(0, 3, (960, 1280, 3))
+    img = cv2.GaussianBlur(img.clip(0, 255).astype(np.uint8), (5, 5), 0)
+    if streak:
+        cv2.line(img, (100, 800), (700, 780), (230, 230, 230), 2)
+    for y, x in spots:
+        img[y:y + 100, x:x + 120] = rng.integers(0, 255, (100, 120, 3), dtype=np.uint8)
+    return img
+
+
+def _contains(region, x, y):
+    return region["x"] <= x <= region["x"] + region["w"] and region["y"] <= y <= region["y"] + region["h"]
+
+
+def test_defects_are_localized():
+    metrics = analyze_coating(_panel(), defects=True)
+    spot, streak = metrics["defects"]
+    assert _contains(spot, 960, 250) and spot["shape"] == "spot"
+    assert _contains(streak, 400, 790) and streak["shape"] == "streak"
+    assert spot["severity"] > streak["severity"] > 0
+    assert 0 < streak["area"] < spot["area"] < 5
+
+    assert "defects" not in analyze_coating(_panel())
+    assert analyze_coating(_panel(spots=(), streak=False), defects=True)["defects"] == []
+
+
+def test_top_k_keeps_the_largest():
+    spots = [(100 + 250 * (i // 4), 100 + 300 * (i % 4)) for i in range(8)]
+    regions = analyze_coating(_panel(spots=spots), defects=True, top_k=3)["defects"]
+    assert len(regions) == 3
+    assert all(r["shape"] == "spot" for r in regions)
+
+
+def test_overlay_marks_defects():
+    img = _panel()
+    metrics = analyze_coating(img, defects=True)
+    overlay = create_analysis_overlay(img, metrics)
+    spot = metrics["defects"][0]
+    assert tuple(overlay[spot["y"], spot["x"] + spot["w"] // 2]) == (0, 0, 255)
+
+
+def test_defects_query_flag(monkeypatch):
+    from backend.app.routers import analyze
+    from backend.app.services import shared_cache
+
+    monkeypatch.setattr(shared_cache, "cache", shared_cache.SharedCache(None))
+    app = FastAPI()
+    app.include_router(analyze.router)
+    client = TestClient(app)
+    payload = {"image": base64.b64encode(cv2.imencode(".png", _panel())[1].tobytes()).decode()}
+
+    plain = client.post("/api/analyze/base64", json=payload).json()["metrics"]
+    located = client.post("/api/analyze/base64?defects=true", json=payload).json()["metrics"]
+    assert "defects" not in plain
+    assert len(located["defects"]) == 2
+    assert located["cqi"] == pytest.approx(plain["cqi"])
@@ -0,0 +1,109 @@
+import sys
+import os
+import base64
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.routers import analyze
+from backend.app.services import inference, shared_cache
+
+app = FastAPI()
+app.include_router(analyze.router)
+client = TestClient(app)
+
+PHASES = ["phase_1_base_info", "phase_2_coating_vs_no"]
+
+
+def _image_b64():
+    img = np.zeros((80, 120, 3), dtype=np.uint8)
+    img[:, :60] = [255, 0, 0]
+    _, buffer = cv2.imencode(".png", img)
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def _export_tiny_model(model_dir, size=16, stem="multitask", variant="fp32"):
+    torch = pytest.importorskip("torch")
+
+    class Tiny(torch.nn.Module):
+        def forward(self, x):
+            pooled = x.mean(dim=(2, 3))
+            return pooled[:, :2] * 10.0, torch.sigmoid(pooled[:, 1:3])
+
+    torch.jit.trace(Tiny(), torch.zeros(1, 3, size, size)).save(str(model_dir / f"{stem}.ts"))
+    (model_dir / f"{stem}.json").write_text(json.dumps({
+        "phases": PHASES, "metrics": ["cvi", "cqi"], "image_size": size,
+        "mean": [0.0, 0.0, 0.0], "std": [1.0, 1.0, 1.0], "variant": variant,
+    }))
+
+
+@pytest.fixture(autouse=True)
+def result_cache(monkeypatch, tmp_path):
+    cache = shared_cache.SharedCache(str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(shared_cache, "cache", cache)
+    return cache
+
+
+@pytest.fixture
+def model_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(inference, "MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(inference, "_engine", None)
+    monkeypatch.setattr(inference, "_batcher", None)
+    return tmp_path
+
+
+def test_preprocess_reuses_decoded_image():
+    img = np.full((50, 70, 3), [0, 0, 255], dtype=np.uint8)  # BGR rød
+    x = inference.preprocess(img, 32, mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5])
+    assert x.shape == (3, 32, 32) and x.dtype == np.float32
+    assert np.allclose(x[0], 1.0) and np.allclose(x[2], -1.0)  # RGB-rekkefølge
+
+
+def test_model_engine_unavailable_returns_503(model_dir):
+    r = client.post("/api/analyze/base64?engine=model", json={"image": _image_b64()})
+    assert r.status_code == 503
+    assert client.get("/api/analyze/engine").json()["loaded"] is False
+
+    # Heuristikk virker fortsatt uten modell
+    r = client.post("/api/analyze/base64", json={"image": _image_b64()})
+    assert r.status_code == 200 and "cqi" in r.json()["metrics"]
+
+
+def test_model_and_both_engines(model_dir):
+    _export_tiny_model(model_dir)
+    assert inference.warmup() is True
+
+    r = client.post("/api/analyze/base64?engine=model", json={"image": _image_b64()})
+    assert r.status_code == 200
+    prediction = r.json()["metrics"]
+    assert prediction["engine"] == "model"
+    assert prediction["phase"] in PHASES
+    assert 0 <= prediction["cqi"] <= 100
+
+    r = client.post("/api/analyze/base64?engine=both", json={"image": _image_b64()})
+    metrics = r.json()["metrics"]
+    assert "cvi" in metrics and metrics["model"]["phase"] == prediction["phase"]
+
+    status = client.get("/api/analyze/engine").json()
+    assert status["loaded"] is True and status["backend"] == "torchscript"
+    assert status["batching"]["batch_size"]["count"] >= 2
+
+
+def test_variant_selects_quantized_files(model_dir, monkeypatch):
+    assert inference.model_file_stem("multitask", "") == "multitask"
+    assert inference.model_file_stem("multitask", "int8") == "multitask_int8"
+
+    _export_tiny_model(model_dir, stem="multitask_int8", variant="int8")
+    monkeypatch.setattr(inference, "MODEL_VARIANT", "int8")
+    assert inference.warmup() is True
+    assert inference.engine_status()["variant"] == "int8"
+
+
+def test_unknown_engine_rejected():
+    r = client.post("/api/analyze/base64?engine=gpu", json={"image": _image_b64()})
+    assert r.status_code == 422
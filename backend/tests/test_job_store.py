@@ -0,0 +1,45 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.routers import jobs as jobs_router
+from backend.app.services import jobs, storage
+
+
+def _setup(monkeypatch, tmp_path):
+    blobs = storage.BlobStore({"uploads": tmp_path / "uploads"}, tmp_path / "index.sqlite")
+    monkeypatch.setattr(jobs_router, "default_store", lambda: blobs)
+    monkeypatch.setattr(jobs, "store", jobs.JobStore(tmp_path / "jobs.sqlite"))
+    app = FastAPI()
+    app.include_router(jobs_router.router)
+    return TestClient(app), blobs
+
+
+def test_jobs_and_their_refs_survive_a_restart(monkeypatch, tmp_path):
+    client, blobs = _setup(monkeypatch, tmp_path)
+    upload = blobs.put_bytes(b"image", "uploads", ".jpg")
+    created = client.post("/api/jobs/", json={"name": "a", "uploads": [upload.sha256]}).json()["job"]
+    client.post("/api/jobs/", json={"name": "b"})
+    assert client.post("/api/jobs/", json={"name": "c", "uploads": ["0" * 64]}).status_code == 404
+
+    restarted = jobs.JobStore(tmp_path / "jobs.sqlite")  # ny prosess: samme jobber
+    assert [j["name"] for j in restarted.list()] == ["a", "b"]
+    assert restarted.get(created["id"])["uploads"] == [upload.sha256]
+    assert restarted.reconcile_refs(blobs) == 0 and blobs.refcount(upload.sha256, "uploads") == 1
+
+    r = client.delete(f"/api/jobs/{created['id']}")
+    assert r.json() == {"status": "deleted", "released_refs": 1}
+    assert client.post("/api/jobs/", json={"name": "d"}).json()["job"]["id"] == "job_4"  # id-er gjenbrukes ikke
+
+
+def test_reconcile_releases_refs_of_unknown_jobs(monkeypatch, tmp_path):
+    _, blobs = _setup(monkeypatch, tmp_path)
+    upload = blobs.put_bytes(b"image", "uploads", ".jpg")
+    blobs.add_ref(upload.sha256, "uploads", "job:job_7")  # fra før jobbene ble lagret
+    blobs.add_ref(upload.sha256, "uploads", "report:r1")
+    assert jobs.store.reconcile_refs(blobs) == 1
+    assert blobs.owners() == ["report:r1"]
@@ -0,0 +1,126 @@
+import sys
+import os
+import asyncio
+import base64
+import importlib.util
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import cv2
+import numpy as np
+import pytest
+
+from backend.app.core import coatvision_core
+
+
+def _load_analyzer():
+    """Ny modul per test: cache, semafor og tellere starter tomme."""
+    spec = importlib.util.spec_from_file_location("live_analyzer", os.path.join(ROOT, ".vscode", "analyzer.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _frame(seed, size=(640, 480)):
+    img = np.random.default_rng(seed).integers(0, 255, (size[1] // 8, size[0] // 8, 3), dtype=np.uint8)
+    img = cv2.resize(img, size, interpolation=cv2.INTER_NEAREST)
+    return base64.b64encode(cv2.imencode(".jpg", img)[1].tobytes()).decode()
+
+
+class FakeClient:
+    """Som AsyncOpenAI: client.chat.completions.create(...), teller samtidige kall."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.gate = None  # asyncio.Event: holder kallene ute til testen slipper dem
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.gate is not None:
+                await self.gate.wait()
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        message = type("M", (), {"content": '{"overall_condition": "good", "call": %d}' % self.calls})
+        return type("R", (), {"choices": [type("C", (), {"message": message})]})
+
+
+@pytest.fixture
+def live(monkeypatch):
+    analyzer = _load_analyzer()
+    client = FakeClient()
+    monkeypatch.setattr(analyzer, "_get_client", lambda: client)
+    return analyzer, client
+
+
+def test_decode_targets_the_model_input_size(monkeypatch):
+    analyzer = _load_analyzer()
+    targets = []
+    decode = coatvision_core.decode_image_bytes
+    monkeypatch.setattr(coatvision_core, "decode_image_bytes",
+                        lambda data, target_max_side=None: targets.append(target_max_side) or decode(data, target_max_side))
+
+    frame = analyzer.preprocess_frame(_frame(0, (4032, 3024)), detail="high")
+    assert frame["size"] == (1024, 768) and targets == [1024]
+    # 4032 // 2 = 2016 >= 1024: JPEG-en dekodes i halv oppløsning
+    assert coatvision_core.reduced_decode_flag((4032, 3024), 1024) == cv2.IMREAD_REDUCED_COLOR_2
+    assert analyzer.preprocess_frame(_frame(0, (4032, 3024)), detail="low")["size"] == (512, 384)
+
+
+def test_near_identical_frames_are_answered_from_cache(live):
+    analyzer, client = live
+
+    async def run():
+        first = await analyzer.analyze_live_frame(_frame(1))
+        again = await analyzer.analyze_live_frame(_frame(1))
+        other = await analyzer.analyze_live_frame(_frame(2))
+        return first, again, other
+
+    first, again, other = asyncio.run(run())
+    assert client.calls == 2 and again["cached"] and "cached" not in first and "cached" not in other
+    assert analyzer.live_stats()["cache_hits"] == 1
+
+
+def test_semaphore_bounds_upstream_calls(live, monkeypatch):
+    analyzer, client = live
+    monkeypatch.setattr(analyzer, "LIVE_MAX_CONCURRENCY", 2)
+
+    async def run():
+        return await asyncio.gather(*(analyzer.analyze_live_frame(_frame(10 + i)) for i in range(6)))
+
+    results = asyncio.run(run())
+    assert client.calls == 6 and client.max_in_flight == 2
+    assert all(r["overall_condition"] == "good" for r in results)
+
+
+def test_latest_frame_wins_per_client(live):
+    analyzer, client = live
+
+    async def until(condition):
+        while not condition():
+            await asyncio.sleep(0.005)
+
+    async def run():
+        client.gate = asyncio.Event()
+        first = asyncio.ensure_future(analyzer.analyze_live_frame(_frame(20), client_id="phone-1"))
+        await until(lambda: client.calls == 1)  # første kall er ute hos modellen
+        waiting = [asyncio.ensure_future(analyzer.analyze_live_frame(_frame(21 + i), client_id="phone-1"))
+                   for i in range(3)]
+        await until(lambda: analyzer.live_stats()["frames"] == 4)  # alle tre står i kø bak låsen
+        client.gate.set()
+        other = await analyzer.analyze_live_frame(_frame(30), client_id="phone-2")
+        return await first, await asyncio.gather(*waiting), other
+
+    first, waiting, other = asyncio.run(run())
+    # dekodingen skjer i tråder, så rekkefølgen i køen er ikke gitt; nøyaktig én av dem vinner
+    assert sorted(str(r.get("status")) for r in waiting) == ["None", "superseded", "superseded"]
+    assert first["overall_condition"] == other["overall_condition"] == "good"
+    assert client.calls == 3 and analyzer.live_stats()["superseded"] == 2
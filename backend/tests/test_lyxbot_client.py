@@ -0,0 +1,164 @@
+import sys
+import os
+import asyncio
+import importlib.util
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.services import lyxbot_client
+
+
+class FakeCompletions(BaseHTTPRequestHandler):
+    """Minimal /v1/chat/completions som svarer med brukerens melding baklengs."""
+
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeCompletions.requests.append(body)
+        reply = "Svar: " + body["messages"][-1]["content"][::-1]
+        base = {"id": "chatcmpl-1", "created": 0, "model": body["model"]}
+        if not body.get("stream"):
+            payload = json.dumps({**base, "object": "chat.completion", "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}]})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload.encode())
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for token in reply.split(" "):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": [
+                {"index": 0, "delta": {"content": token + " "}, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeCompletions)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    FakeCompletions.requests = []
+    monkeypatch.setattr(lyxbot_client, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(lyxbot_client, "OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(lyxbot_client, "_state", None)
+    lyxbot_client.response_cache.clear()
+    yield FakeCompletions.requests
+    server.shutdown()
+    server.server_close()
+
+
+def _load_router(name):
+    # coatvision-app er ikke en importerbar pakke (bindestrek i navnet)
+    path = os.path.join(ROOT, "coatvision-app", "routers", f"{name}.py")
+    spec = importlib.util.spec_from_file_location(f"coatvision_app_{name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _client(name="lyxbot"):
+    app = FastAPI()
+    app.include_router(_load_router(name).router)
+    return TestClient(app)
+
+
+def test_normalized_cache_key():
+    a = lyxbot_client.cache_key("sys", "  Hvordan VASKER jeg bilen?? ")
+    b = lyxbot_client.cache_key("sys", "hvordan vasker   jeg bilen")
+    assert a == b
+    assert a != lyxbot_client.cache_key("annen prompt", "hvordan vasker jeg bilen")
+
+
+def test_ttl_cache_evicts_oldest_and_expired():
+    cache = lyxbot_client.TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1
+
+    cache.ttl = -1
+    cache.set("d", 4)
+    assert cache.get("d") is None
+
+
+def test_chat_is_cached_on_normalized_message(fake_api):
+    with _client() as client:
+        first = client.post("/api/lyxbot/chat", json={"message": "Hva er coating?"}).json()
+        second = client.post("/api/lyxbot/chat", json={"message": "  hva er COATING "}).json()
+    assert first["reply"].startswith("Svar: ") and first["cached"] is False
+    assert second["reply"] == first["reply"] and second["cached"] is True
+    assert len(fake_api) == 1
+
+
+def test_identical_concurrent_questions_share_one_call(fake_api):
+    messages = lyxbot_client.build_messages("sys", "hei")
+    key = lyxbot_client.cache_key("sys", "hei")
+
+    async def main():
+        return await asyncio.gather(*(lyxbot_client.complete(messages, key=key) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert {reply for reply, _ in results} == {"Svar: ieh"}
+    assert len(fake_api) == 1
+
+
+def test_stream_emits_sse_deltas_and_fills_cache(fake_api):
+    with _client("analyze") as client:
+        r = client.post("/api/lyxbot/chat/stream", json={"message": "polering av lakk"})
+        assert r.headers["content-type"].startswith("text/event-stream")
+        events = [json.loads(line[6:]) for line in r.text.splitlines() if line.startswith("data: ")]
+        deltas = [e["delta"] for e in events if "delta" in e]
+        assert len(deltas) > 1
+        assert "".join(deltas).strip() == "Svar: kkal va gnirelop"
+        assert events[-1] == {"done": True, "cached": False}
+
+        again = client.post("/api/lyxbot/chat", json={"message": "Polering av lakk!"}).json()
+    assert again["cached"] is True
+    assert fake_api[0]["stream"] is True and len(fake_api) == 1
+
+
+def test_session_chat_sends_history_and_skips_cache(fake_api, monkeypatch):
+    from backend.app.services import lyxbot_sessions
+
+    monkeypatch.setattr(lyxbot_sessions, "store", lyxbot_sessions.ConversationStore())
+    with _client() as client:
+        body = {"message": "Hva er coating?", "session_id": "app-session-1"}
+        first = client.post("/api/lyxbot/chat", json=body).json()
+        r = client.post("/api/lyxbot/chat/stream", json={**body, "message": "Hvor lenge varer den?"})
+        assert '"done": true' in r.text
+        info = client.get("/api/lyxbot/sessions/app-session-1").json()
+        assert client.delete("/api/lyxbot/sessions/app-session-1").json() == {"deleted": True}
+        assert client.get("/api/lyxbot/sessions/app-session-1").status_code == 404
+        assert client.post("/api/lyxbot/chat", json={"message": "hei", "session_id": "x"}).status_code == 422
+
+    assert first["session_id"] == "app-session-1" and first["cached"] is False
+    assert [m["role"] for m in fake_api[1]["messages"]] == ["system", "user", "assistant", "user"]
+    assert fake_api[1]["messages"][2]["content"] == first["reply"]
+    assert info["total_turns"] == 4
+
+
+def test_missing_api_key_returns_503(monkeypatch):
+    monkeypatch.setattr(lyxbot_client, "OPENAI_API_KEY", None)
+    monkeypatch.setattr(lyxbot_client, "_state", None)
+    lyxbot_client.response_cache.clear()
+    with _client() as client:
+        assert client.post("/api/lyxbot/chat", json={"message": "hei"}).status_code == 503
+        r = client.post("/api/lyxbot/chat/stream", json={"message": "hei"})
+    assert "event: error" in r.text
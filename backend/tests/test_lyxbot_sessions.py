@@ -0,0 +1,109 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import pytest
+
+from backend.app.services import lyxbot_sessions
+from backend.app.services.lyxbot_sessions import ConversationStore, InvalidSessionId
+
+SYSTEM = "Du er LYXbot."
+SESSION = "session-0001"
+
+
+def _prompt_tokens(messages):
+    return sum(lyxbot_sessions.message_tokens(m["content"]) for m in messages)
+
+
+def test_context_stays_within_budget_for_long_conversations():
+    store = ConversationStore(context_tokens=300, summary_tokens=80, max_turns=1000)
+    sizes = []
+    for i in range(60):
+        message = f"Spørsmål {i}: hvordan polerer jeg panser nummer {i} uten hologrammer?"
+        messages = store.context(SESSION, SYSTEM, message)
+        sizes.append(_prompt_tokens(messages))
+        store.record(SESSION, message, f"Svar {i}. " + "Bruk myk pad og lav hastighet. " * 3)
+
+    assert max(sizes) <= 300
+    assert messages[0] == {"role": "system", "content": SYSTEM}  # festet systemprompt
+    assert messages[1]["content"].startswith(lyxbot_sessions.SUMMARY_HEADER)
+    assert messages[2]["role"] == "user"  # historikken starter med en brukertur
+    assert messages[-1]["content"].startswith("Spørsmål 59")
+
+    info = store.info(SESSION)
+    assert info["total_turns"] == 120
+    assert info["summary_tokens"] <= 80 and "Bruker: Spørsmål" in info["summary"]
+
+
+def test_short_conversation_is_sent_verbatim():
+    store = ConversationStore()
+    store.record(SESSION, "Hei", "Hei! Hva lurer du på?")
+    messages = store.context(SESSION, SYSTEM, "Hva er coating?")
+    assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+
+
+def test_max_turns_folds_oldest_into_summary():
+    store = ConversationStore(max_turns=4)
+    for i in range(4):
+        store.record(SESSION, f"melding {i}", f"svar {i}")
+    info = store.info(SESSION)
+    assert info["turns"] == 4 and "melding 0" in info["summary"]
+
+
+def test_sessions_are_bounded_and_validated():
+    store = ConversationStore(max_sessions=2)
+    for sid in ("session-a1", "session-b2", "session-c3"):
+        store.record(sid, "hei", "hei")
+    assert len(store) == 2 and store.info("session-a1") is None
+    assert store.delete("session-c3") is True
+
+    with pytest.raises(InvalidSessionId):
+        store.context("../etc", SYSTEM, "hei")
+
+
+def test_prompt_prefix_is_cached():
+    assert lyxbot_sessions.prompt_prefix(SYSTEM) is lyxbot_sessions.prompt_prefix(SYSTEM)
+
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "sessions.sqlite")
+    worker_a, worker_b = ConversationStore(path), ConversationStore(path, max_sessions=2)
+    worker_a.record(SESSION, "Hei", "Hei! Hva lurer du på?")
+    messages = worker_b.context(SESSION, SYSTEM, "Hva er coating?")
+    assert [m["content"] for m in messages[1:]] == ["Hei", "Hei! Hva lurer du på?", "Hva er coating?"]
+
+    worker_b.record(SESSION, "Hva er coating?", "Et beskyttende lag.")
+    assert worker_a.info(SESSION)["total_turns"] == 4
+
+    for sid in ("session-b2", "session-c3"):
+        worker_b.record(sid, "hei", "hei")
+    assert len(worker_a) == 2 and worker_a.info(SESSION) is None
+    assert worker_a.delete("session-c3") is True and worker_b.info("session-c3") is None
+
+
+def test_failed_reply_is_not_recorded():
+    store = ConversationStore()
+    store.record(SESSION, "Hei", "")
+    assert store.info(SESSION) is None
+    messages = store.context(SESSION, SYSTEM, "Hei igjen")
+    assert [m["role"] for m in messages] == ["system", "user"]
+
+
+def test_async_api_runs_sqlite_rounds_off_the_event_loop(tmp_path):
+    import asyncio
+    import threading
+
+    store = ConversationStore(str(tmp_path / "sessions.sqlite"))
+    threads = []
+    context = store.context
+    store.context = lambda *a: threads.append(threading.get_ident()) or context(*a)
+
+    async def run():
+        await store.record_async(SESSION, "Hei", "Hei! Hva lurer du på?")
+        messages = await store.context_async(SESSION, SYSTEM, "Hva er coating?")
+        info = await store.info_async(SESSION)
+        return threading.get_ident(), messages, info, await store.delete_async(SESSION)
+
+    loop_thread, messages, info, deleted = asyncio.run(run())
+    assert threads and threads[0] != loop_thread
+    assert len(messages) == 4 and info["total_turns"] == 2 and deleted is True
@@ -0,0 +1,166 @@
+import sys
+import os
+import base64
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.core.coatvision_core import analyze_coating
+from backend.app.services import roi
+from backend.app.services.roi import RoiError, RoiSpec, SessionRois, parse_roi
+
+PANEL = (320, 240, 960, 720)  # x0, y0, x1, y1 i et 1280x960-bilde
+
+
+def _scene(spot=None):
+    """Glatt panel midt i bildet, støyete bakgrunn (hjul, himmel ...) rundt."""
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 255, (960, 1280, 3), dtype=np.uint8)
+    x0, y0, x1, y1 = PANEL
+    panel = np.full((y1 - y0, x1 - x0, 3), (40, 40, 160), np.float64) + rng.normal(0, 2, (y1 - y0, x1 - x0, 3))
+    img[y0:y1, x0:x1] = cv2.GaussianBlur(panel.clip(0, 255).astype(np.uint8), (5, 5), 0)
+    if spot is not None:
+        y, x = spot
+        img[y:y + 80, x:x + 80] = rng.integers(0, 255, (80, 80, 3), dtype=np.uint8)
+    return img
+
+
+def _rel_polygon(points):
+    return [[x / 1279, y / 959] for x, y in points]
+
+
+def test_rect_roi_equals_analysing_the_crop():
+    img = _scene()
+    x0, y0, x1, y1 = PANEL
+    spec = parse_roi({"rect": [x0 / 1280, y0 / 960, (x1 - x0) / 1280, (y1 - y0) / 960]})
+    metrics = analyze_coating(img, roi=spec)
+    assert metrics.pop("roi") == {"x": x0, "y": y0, "w": x1 - x0, "h": y1 - y0, "area": 25.0}
+    assert metrics == analyze_coating(img[y0:y1, x0:x1])
+    assert metrics["smoothness"] > analyze_coating(img)["smoothness"]
+
+
+def test_full_mask_matches_unmasked_statistics():
+    img = _scene()
+    spec = RoiSpec(mask=np.full((10, 10), 255, np.uint8))
+    masked, plain = analyze_coating(img, roi=spec), analyze_coating(img)
+    # meanStdDev/maskert histogram gir samme tall som hele bildet når masken dekker alt
+    for key in ("coverage", "color_uniformity", "saturation_score", "brightness_score"):
+        assert masked[key] == pytest.approx(plain[key], abs=0.01)
+    assert masked["roi"]["area"] == 100.0
+
+
+def test_polygon_ignores_background_and_offsets_defects():
+    x0, y0, x1, y1 = PANEL
+    # trapes (panel sett på skrå) innenfor panelet; hjørnet utenfor er bakgrunn
+    polygon = _rel_polygon([(x0 + 40, y0), (x1 - 1, y0), (x1 - 1, y1 - 1), (x0, y1 - 1)])
+    clean = analyze_coating(_scene(), roi=parse_roi({"polygon": polygon}), defects=True)
+    assert clean["smoothness"] > 90 and clean["color_uniformity"] > 90 and clean["edge_density"] < 1
+    assert clean["defects"] == []  # bakgrunnen utenfor polygonet gir ingen defekter
+
+    metrics = analyze_coating(_scene(spot=(500, 600)), roi=parse_roi({"polygon": polygon}), defects=True)
+    (spot,) = metrics["defects"]
+    assert spot["x"] <= 620 <= spot["x"] + spot["w"] and spot["y"] <= 520 <= spot["y"] + spot["h"]
+
+
+def test_mask_image_is_scaled_to_the_frame():
+    x0, y0, x1, y1 = PANEL
+    small = np.zeros((96, 128), np.uint8)
+    small[y0 // 10:y1 // 10, x0 // 10:x1 // 10] = 255
+    _, png = cv2.imencode(".png", small)
+    spec = parse_roi({"mask": base64.b64encode(png.tobytes()).decode()})
+    region = spec.region((960, 1280, 3))
+    assert (region.x, region.y, region.w, region.h) == (x0, y0, x1 - x0, y1 - y0)
+    assert spec.region((960, 1280, 3)) is region  # bygges én gang per bildestørrelse
+    assert analyze_coating(_scene(), roi=spec)["smoothness"] > 90
+
+
+@pytest.mark.parametrize("data", [
+    {"rect": [0, 0, 1]},
+    {"rect": [0, 0, 2, 1]},
+    {"polygon": [[0, 0], [1, 1]]},
+    {"rect": [0, 0, 1, 1], "polygon": [[0, 0], [1, 0], [1, 1]]},
+    {"mask": "not base64!"},
+    "[1, 2]",
+])
+def test_invalid_roi(data):
+    with pytest.raises(RoiError):
+        parse_roi(data)
+
+
+def test_empty_region_is_an_error():
+    with pytest.raises(RoiError):
+        RoiSpec(mask=np.zeros((4, 4), np.uint8)).region((100, 100, 3))
+
+
+def test_session_keeps_last_roi(monkeypatch):
+    from backend.app.services import shared_cache
+
+    monkeypatch.setattr(shared_cache, "cache", shared_cache.SharedCache(None))
+    sessions = SessionRois(maxsize=2)
+    first = sessions.resolve("a", {"rect": [0.1, 0.1, 0.5, 0.5]})
+    assert sessions.resolve("a", None) is first
+    assert sessions.resolve("a", {"rect": [0.1, 0.1, 0.5, 0.5]}) is first  # samme ROI: gjenbruk maskene
+    assert sessions.resolve(None, None) is None
+    sessions.resolve("b", {"rect": [0, 0, 1, 1]})
+    sessions.resolve("c", {"rect": [0, 0, 1, 1]})
+    rebuilt = sessions.resolve("a", None)  # ute av den lokale LRU-en, bygges fra den delte cachen
+    assert rebuilt is not first and rebuilt.key == first.key
+    sessions.clear("a")
+    assert sessions.resolve("a", None) is None
+
+
+def test_session_roi_is_shared_between_workers(tmp_path, monkeypatch):
+    from backend.app.services import shared_cache
+
+    def new_process():  # egen L1, samme SQLite-fil
+        monkeypatch.setattr(shared_cache, "cache", shared_cache.SharedCache(tmp_path / "cache.sqlite"))
+
+    worker_a, worker_b = SessionRois(), SessionRois()
+    new_process()
+    rect = worker_a.resolve("s1", json.dumps({"rect": [0.1, 0.1, 0.5, 0.5]}))
+    new_process()
+    assert worker_b.resolve("s1", None).key == rect.key
+
+    # ny ROI via worker B: worker A bytter ut sin lokale spesifikasjon
+    new_process()
+    polygon = worker_b.resolve("s1", {"polygon": [[0, 0], [1, 0], [0, 1]]})
+    assert worker_a.resolve("s1", None).key == polygon.key != rect.key
+    assert worker_a.resolve("s2", None) is None
+
+
+def test_endpoints_accept_roi(monkeypatch):
+    from backend.app.routers import analyze, coatvision_v1
+    from backend.app.services import shared_cache
+
+    monkeypatch.setattr(shared_cache, "cache", shared_cache.SharedCache(None))
+    monkeypatch.setattr(roi, "sessions", SessionRois())
+    monkeypatch.setattr(coatvision_v1, "insert_analysis_payload", lambda result: None)
+    app = FastAPI()
+    app.include_router(analyze.router)
+    app.include_router(coatvision_v1.router)
+    client = TestClient(app)
+
+    _, jpg = cv2.imencode(".jpg", _scene())
+    image = base64.b64encode(jpg.tobytes()).decode()
+    rect = {"rect": [0.25, 0.25, 0.5, 0.5]}
+
+    plain = client.post("/api/analyze/base64", json={"image": image}).json()["metrics"]
+    cropped = client.post("/api/analyze/base64", json={"image": image, "roi": rect}).json()["metrics"]
+    assert "roi" not in plain and cropped["roi"]["area"] == 25.0  # ikke samme cachenøkkel
+
+    upload = client.post("/api/analyze/", files={"file": ("car.jpg", jpg.tobytes(), "image/jpeg")},
+                         data={"roi": json.dumps(rect)})
+    assert upload.json()["metrics"]["roi"] == cropped["roi"]
+    assert client.post("/api/analyze/base64", json={"image": image, "roi": {"rect": [0, 0]}}).status_code == 400
+
+    live = {"frame": {"frameBase64": image}, "sessionId": "s1"}
+    first = client.post("/v1/coatvision/analyze-live", json={**live, "roi": rect})
+    assert first.status_code == 200
+    again = client.post("/v1/coatvision/analyze-live", json=live)
+    assert again.json()["result"]["roi"] == first.json()["result"]["roi"] == cropped["roi"]
+    assert roi.sessions.resolve("s1", None).key == parse_roi(rect).key
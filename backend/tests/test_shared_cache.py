@@ -0,0 +1,138 @@
+import sys
+import os
+import base64
+import multiprocessing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.services import inference, shared_cache
+from backend.app.services.shared_cache import SharedCache
+
+
+def _worker(path, keys, queue):
+    cache = SharedCache(path, l1_size=8)
+    queue.put([cache.get(k) for k in keys])
+
+
+def test_l1_then_l2_and_copies(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    a = SharedCache(path)
+    a.set("k", {"cqi": 80.5, "tags": ["x"]})
+    value = a.get("k")
+    value["cqi"] = 0  # endring hos kalleren skader ikke cachen
+    assert a.get("k") == {"cqi": 80.5, "tags": ["x"]}
+    assert a.stats()["l1_hits"] == 2
+
+    b = SharedCache(path)  # "en annen worker"
+    assert b.get("k") == {"cqi": 80.5, "tags": ["x"]}
+    assert b.get("k") is not None
+    stats = b.stats()
+    assert (stats["l2_hits"], stats["l1_hits"], stats["misses"]) == (1, 1, 0)
+    assert b.get("missing") is None and b.stats()["misses"] == 1
+
+
+def test_hits_across_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    SharedCache(path).set("analysis:a", {"cqi": 1})
+    queue = multiprocessing.get_context("spawn").Queue()
+    proc = multiprocessing.get_context("spawn").Process(target=_worker, args=(path, ["analysis:a", "b"], queue))
+    proc.start()
+    result = queue.get(timeout=30)
+    proc.join(timeout=30)
+    assert result == [{"cqi": 1}, None]
+
+
+def test_ttl_and_max_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_cache, "_PURGE_EVERY", 1)
+    cache = SharedCache(str(tmp_path / "cache.sqlite"), l1_size=0, max_entries=3)
+    cache.set("old", 1, ttl=-1)
+    assert cache.get("old") is None
+    for i in range(5):
+        cache.set(f"k{i}", i)
+    assert cache.stats()["l2_size"] == 3
+    assert cache.get("k4") == 4 and cache.get("k0") is None
+
+
+def test_l1_only_without_path():
+    cache = SharedCache(None)
+    assert cache.get_or_compute("k", lambda: [1, 2]) == [1, 2]
+    assert cache.get_or_compute("k", lambda: 1 / 0) == [1, 2]
+    assert cache.stats()["shared"] is False
+
+
+def test_analyze_endpoint_uses_shared_cache(tmp_path, monkeypatch):
+    from backend.app.routers import analyze
+
+    path = str(tmp_path / "cache.sqlite")
+    monkeypatch.setattr(shared_cache, "cache", SharedCache(path))
+    calls = []
+    original = inference.analyze_async
+
+    async def counting(image, engine="heuristic", calibration=None, **kwargs):
+        calls.append(engine)
+        return await original(image, engine, calibration, **kwargs)
+
+    monkeypatch.setattr(inference, "analyze_async", counting)
+    app = FastAPI()
+    app.include_router(analyze.router)
+    client = TestClient(app)
+    img = np.zeros((60, 80, 3), dtype=np.uint8)
+    img[:, :40] = [0, 200, 0]
+    payload = {"image": base64.b64encode(cv2.imencode(".png", img)[1].tobytes()).decode()}
+
+    first = client.post("/api/analyze/base64", json=payload).json()["metrics"]
+    # ny "worker": tom L1, samme fil
+    monkeypatch.setattr(shared_cache, "cache", SharedCache(path))
+    second = client.post("/api/analyze/base64", json=payload).json()["metrics"]
+    assert first == second and calls == ["heuristic"]
+    assert client.get("/api/analyze/engine").json()["result_cache"]["l2_hits"] == 1
+
+    assert client.post("/api/analyze/base64", json={"image": "aGVsbG8="}).status_code == 400
+
+
+def test_async_api_keeps_io_off_the_event_loop(tmp_path):
+    import asyncio
+    import threading
+
+    cache = SharedCache(str(tmp_path / "cache.sqlite"))
+    threads = []
+
+    def compute():
+        threads.append(threading.get_ident())
+        return {"total": 3}
+
+    async def run():
+        loop_thread = threading.get_ident()
+        first = await cache.get_or_compute_async("dashboard:summary", compute)
+        again = await cache.get_or_compute_async("dashboard:summary", lambda: 1 / 0)
+        return loop_thread, first, again
+
+    loop_thread, first, again = asyncio.run(run())
+    assert first == again == {"total": 3} and threads and threads[0] != loop_thread
+    assert SharedCache(str(tmp_path / "cache.sqlite")).get("dashboard:summary") == {"total": 3}
+
+
+def test_cache_hit_is_not_recorded_twice(monkeypatch):
+    from backend.app.routers import coatvision_v1
+
+    monkeypatch.setattr(shared_cache, "cache", SharedCache(None))
+    monkeypatch.setattr(coatvision_v1, "insert_analysis_payload", lambda result: None)
+    recorded = []
+    monkeypatch.setattr(coatvision_v1.timeseries.store, "record_analysis", lambda *a, **kw: recorded.append(a))
+    monkeypatch.setattr(coatvision_v1.wash_durability.engine, "record", lambda *a, **kw: None)
+    app = FastAPI()
+    app.include_router(coatvision_v1.router)
+    client = TestClient(app)
+    img = np.zeros((60, 80, 3), dtype=np.uint8)
+    img[:, :40] = [0, 200, 0]
+    live = {"frame": {"frameBase64": base64.b64encode(cv2.imencode(".png", img)[1].tobytes()).decode()},
+            "vehicleId": "car-1"}
+
+    first = client.post("/v1/coatvision/analyze-live", json=live)
+    again = client.post("/v1/coatvision/analyze-live", json=live)
+    assert first.status_code == again.status_code == 200
+    assert first.json()["result"] == again.json()["result"] and len(recorded) == 1
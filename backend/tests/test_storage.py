@@ -0,0 +1,111 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import time
+
+import pytest
+
+from backend.app.services.storage import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore({"uploads": tmp_path / "uploads", "outputs": tmp_path / "outputs"},
+                     tmp_path / "index.sqlite", quotas={"uploads": 250, "outputs": 250}, grace=60)
+
+
+def _age(store, blob, seconds):
+    store.conn.execute("UPDATE blobs SET last_access = last_access - ? WHERE sha256 = ?", (seconds, blob.sha256))
+    store.conn.commit()
+
+
+def test_dedupe_and_sharding(store, tmp_path):
+    a = store.put_bytes(b"x" * 100, "uploads", ".jpg")
+    b = store.put_bytes(b"x" * 100, "uploads", ".jpg")
+    assert a.path == b.path and a.path.relative_to(tmp_path / "uploads").parts[:2] == (a.sha256[:2], a.sha256[2:4])
+    assert store.usage()["uploads"] == {"files": 1, "bytes": 100, "quota": 250}
+    assert store.get(a.sha256, "uploads").path == a.path
+    assert store.get("../etc/passwd", "uploads") is None
+
+
+def test_derived_outputs_evicted_lru_unless_referenced(store):
+    blobs = [store.put_bytes(bytes([i]) * 100, "outputs", ".png") for i in range(3)]
+    for i, blob in enumerate(blobs):
+        _age(store, blob, 100 - i * 10)  # blobs[0] eldst
+    store.add_ref(blobs[0].sha256, "outputs", "job:job_1")
+
+    assert store.enforce_quota("outputs") == 100
+    remaining = {b.sha256 for b in blobs if store.get(b.sha256, "outputs", touch=False)}
+    assert remaining == {blobs[0].sha256, blobs[2].sha256}
+    assert not blobs[1].path.exists()
+
+
+def test_originals_only_evicted_after_grace(store):
+    fresh = [store.put_bytes(bytes([i]) * 100, "uploads") for i in range(3)]
+    assert store.enforce_quota("uploads") == 0  # for nye til å fjernes
+
+    _age(store, fresh[0], 3600)
+    store.add_ref(fresh[1].sha256, "uploads", "job:job_2")
+    _age(store, fresh[1], 3600)
+    assert store.enforce_quota("uploads") == 100
+    assert not fresh[0].path.exists() and fresh[1].path.exists()
+
+    assert store.release("job:job_2") == 1 and store.refcount(fresh[1].sha256, "uploads") == 0
+
+
+def test_sweep_reconciles_index_and_staging(store):
+    blob = store.put_bytes(b"gone", "outputs", ".png")
+    blob.path.unlink()
+    staging = store.staging_dir("uploads")
+    staging.mkdir(parents=True)
+    part = staging / ".upload-abc.part"
+    part.write_bytes(b"half")
+    old = time.time() - 7200
+    os.utime(part, (old, old))
+
+    report = store.sweep()
+    assert report["missing_rows"] == 1 and report["stale_parts"] == 1
+    assert store.usage()["outputs"]["files"] == 0 and not part.exists()
+
+
+def test_flat_files_are_indexed_in_place(store, tmp_path):
+    outputs = tmp_path / "outputs"
+    outputs.mkdir()
+    old = outputs / "car_cv_output.png"
+    old.write_bytes(b"o" * 200)
+    os.utime(old, (time.time() - 7200, time.time() - 7200))
+
+    assert store.index_flat_files() == 1
+    assert store.index_flat_files() == 0  # bare én gang
+    blob = store.get_named("car_cv_output.png", "outputs")
+    assert blob.path == old and blob.legacy and store.usage()["outputs"]["bytes"] == 200
+
+    store.put_bytes(b"n" * 100, "outputs", ".png")  # over kvoten: den eldste (flate) filen går først
+    assert store.enforce_quota("outputs") == 200
+    assert not old.exists() and store.get_named("car_cv_output.png", "outputs") is None
+
+
+def test_owners_by_prefix(store):
+    blob = store.put_bytes(b"u", "uploads")
+    for owner in ("job:job_1", "job:job_2", "report:r1"):
+        store.add_ref(blob.sha256, "uploads", owner)
+    assert sorted(store.owners("job:")) == ["job:job_1", "job:job_2"]
+
+
+def test_missing_row_check_is_incremental(store):
+    blobs = [store.put_bytes(bytes([i]) * 10, "outputs", ".png") for i in range(5)]
+    for blob in blobs:
+        blob.path.unlink()
+    reports = [store.sweep(check_rows=2)["missing_rows"] for _ in range(3)]
+    assert reports == [2, 2, 1] and store.usage()["outputs"]["files"] == 0
+
+
+def test_only_one_process_sweeps(store, tmp_path):
+    other = BlobStore(store.dirs, tmp_path / "index.sqlite")  # samme indeks, "en annen worker"
+    assert store.claim_sweeper() is True and store.claim_sweeper() is True
+    assert other.claim_sweeper() is False
+    store.stop_sweeper()
+    assert other.claim_sweeper() is True
+    other.stop_sweeper()
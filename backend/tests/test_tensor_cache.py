@@ -0,0 +1,71 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "coatvision-app", "models"))
+
+import cv2
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import tensor_cache  # noqa: E402
+
+
+def _rows(tmp_path, colours):
+    rows = []
+    for i, (bgr, phase, cqi) in enumerate(colours):
+        path = tmp_path / f"img{i}.jpg"
+        cv2.imwrite(str(path), np.full((96, 128, 3), bgr, dtype=np.uint8))
+        rows.append({"path": str(path), "sha256": f"{i:064x}", "width": 128, "height": 96,
+                     "phase": phase, "cvi": 0.5, "cqi": cqi})
+    return rows
+
+
+def _targets(row):
+    return (0 if row["phase"] == "before" else 1), [row["cvi"], row["cqi"]]
+
+
+def test_rebuilds_only_when_the_manifest_hash_changes(tmp_path, monkeypatch):
+    rows = _rows(tmp_path, [((0, 0, 255), "before", 0.2), ((255, 0, 0), "after", 0.9)])
+    cache_dir = tmp_path / "cache"
+    builds = []
+    build = tensor_cache.build_cache
+    monkeypatch.setattr(tensor_cache, "build_cache", lambda *a: builds.append(a[3]) or build(*a))
+
+    tensor_cache.load_or_build(rows, cache_dir, 32, "hash-a")
+    assert tensor_cache.load_or_build(rows, cache_dir, 32, "hash-a")["manifest_hash"] == "hash-a"
+    assert builds == ["hash-a"]
+
+    index = tensor_cache.load_or_build(rows[:1], cache_dir, 32, "hash-b")
+    assert builds == ["hash-a", "hash-b"] and index["shape"] == [1, 32, 32, 3]
+    assert not (tmp_path / "cache.building").exists()
+
+
+def test_memmap_dataset_returns_sample_and_labels(tmp_path):
+    rows = _rows(tmp_path, [((0, 0, 255), "before", 0.2), ((255, 0, 0), "after", 0.9)])
+    tensor_cache.build_cache(rows, tmp_path / "cache", 32, "hash-a")
+
+    val = tensor_cache.MemmapDataset(tmp_path / "cache", _targets, indices=[1])
+    assert len(val) == 1
+    image, phase, metrics = val[0]
+    assert image.shape == (32, 32, 3) and image.dtype == torch.uint8
+    assert image[..., 2].float().mean() > 240 and image[..., 0].float().mean() < 15  # RGB: blå
+    assert phase.item() == 1 and metrics.tolist() == pytest.approx([0.5, 0.9])
+
+    image, phase, _ = tensor_cache.MemmapDataset(tmp_path / "cache", _targets)[0]
+    assert image[..., 0].float().mean() > 240 and phase.item() == 0  # rød, "before"
+
+
+def test_non_square_images_are_centre_cropped(tmp_path):
+    img = np.zeros((96, 192, 3), dtype=np.uint8)
+    img[:, :48] = (255, 0, 0)  # blå kant til venstre, rød til høyre, grønt i midten
+    img[:, 48:144] = (0, 255, 0)
+    img[:, 144:] = (0, 0, 255)
+    path = tmp_path / "wide.png"
+    cv2.imwrite(str(path), img)
+
+    out = tensor_cache._decode_square(str(path), 32, 192, 96)
+    assert out.shape == (32, 32, 3)
+    assert out[..., 1].min() > 240 and out[..., 0].max() < 15 and out[..., 2].max() < 15  # bare midten
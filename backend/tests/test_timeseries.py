@@ -0,0 +1,74 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.services import timeseries
+from backend.app.services.timeseries import TimeSeriesStore
+
+T0 = 1_704_067_200  # 2024-01-01T00:00:00Z
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = TimeSeriesStore(str(tmp_path), max_points=50)
+    monkeypatch.setattr(timeseries, "store", store)
+    return store
+
+
+def test_rollups_match_raw_and_survive_incremental_appends(store):
+    rng = np.random.default_rng(0)
+    ts = T0 + np.sort(rng.integers(0, 400 * 86400, size=3000))
+    values = rng.uniform(50, 100, size=3000).astype(np.float32)
+    # i biter, med bøtter som deles mellom bitene
+    for chunk in np.array_split(np.arange(3000), 7):
+        store.append("car-1", "hood", "cqi", ts[chunk], values[chunk])
+
+    month = store.query("car-1", "hood", "cqi", resolution="month")["points"]
+    assert len(month) == 14 and sum(p["count"] for p in month) == 3000
+    jan = values[ts < T0 + 31 * 86400]
+    assert month[0]["count"] == jan.size
+    assert month[0]["mean"] == pytest.approx(float(jan.mean()), abs=1e-3)
+    assert month[0]["min"] == pytest.approx(float(jan.min())) and month[0]["max"] == pytest.approx(float(jan.max()))
+
+    day = store.query("car-1", "hood", "cqi", start=T0 + 10 * 86400, end=T0 + 12 * 86400 - 1, resolution="day")
+    assert [p["t"] for p in day["points"]] == [T0 + 10 * 86400, T0 + 11 * 86400]
+
+
+def test_auto_resolution_and_raw_range(store):
+    ts = T0 + np.arange(0, 3 * 365 * 86400, 6 * 3600)  # hver 6. time i tre år
+    store.append("car-1", None, "cqi", ts, np.full(ts.size, 80.0))
+
+    overview = store.query("car-1", None, "cqi")
+    assert overview["resolution"] == "month" and len(overview["points"]) <= 50
+    week = store.query("car-1", None, "cqi", start=T0, end=T0 + 7 * 86400)
+    assert week["resolution"] == "raw" and len(week["points"]) == 29
+
+
+def test_backfill_rewrites_in_order(store):
+    store.append("car-1", "door", "cqi", [T0 + 7200, T0 + 10800], [70, 60])
+    store.append("car-1", "door", "cqi", [T0], [90])
+    raw = store.query("car-1", "door", "cqi", resolution="raw")["points"]
+    assert [p["value"] for p in raw] == [90, 70, 60]
+    assert store.query("car-1", "door", "cqi", resolution="day")["points"][0]["count"] == 3
+    with pytest.raises(timeseries.SeriesNameError):
+        store.append("../x", None, "cqi", [T0], [1])
+
+
+def test_history_router(store):
+    from backend.app.routers import history
+
+    app = FastAPI()
+    app.include_router(history.router)
+    with TestClient(app) as client:
+        body = {"points": [{"ts": T0 + i * 86400, "value": 90 - i} for i in range(5)]}
+        assert client.post("/api/history/car-9/hood/cqi", json=body).json() == {"stored": 5}
+        series = client.get("/api/history/car-9").json()["series"]
+        r = client.get("/api/history/car-9/hood/cqi", params={"resolution": "month"}).json()
+    assert series == [{"panel": "hood", "metric": "cqi", "points": 5, "first": T0, "last": T0 + 4 * 86400}]
+    assert r["points"][0]["count"] == 5 and r["points"][0]["mean"] == 88.0
@@ -0,0 +1,47 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "coatvision-app", "models"))
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+import train_multitask as tm  # noqa: E402
+
+
+def _heads(phase_t, metric_t):
+    torch.manual_seed(0)
+    phase_head, metric_head = torch.nn.Linear(4, len(tm.PHASES)), torch.nn.Linear(4, 2)
+    feats = torch.randn(len(phase_t), 4)
+    loss = tm.multitask_loss(phase_head(feats), metric_head(feats), phase_t, metric_t)
+    loss.backward()
+    return loss, phase_head, metric_head
+
+
+def test_unlabelled_batch_still_touches_both_heads():
+    # umerket manifest: DDP krever gradient (også 0) for fasehodet på hver rank
+    phase_t = torch.full((3,), tm.IGNORE_INDEX)
+    loss, phase_head, metric_head = _heads(phase_t, torch.rand(3, 2))
+    assert loss.item() > 0
+    assert phase_head.weight.grad is not None and float(phase_head.weight.grad.abs().sum()) == 0
+    assert float(metric_head.weight.grad.abs().sum()) > 0
+
+
+def test_no_targets_gives_zero_loss_with_gradient():
+    nan = torch.full((2, 2), float("nan"))
+    loss, phase_head, metric_head = _heads(torch.full((2,), tm.IGNORE_INDEX), nan)
+    assert loss.item() == 0 and loss.requires_grad
+    assert metric_head.weight.grad is not None
+
+
+def test_matches_mean_reduced_losses():
+    phase_t = torch.tensor([0, tm.IGNORE_INDEX, 1])
+    metric_t = torch.tensor([[0.5, float("nan")], [0.2, 0.3], [float("nan"), float("nan")]])
+    logits, pred = torch.randn(3, len(tm.PHASES)), torch.rand(3, 2)
+    mask = ~torch.isnan(metric_t)
+    expected = (torch.nn.functional.cross_entropy(logits, phase_t, ignore_index=tm.IGNORE_INDEX)
+                + torch.nn.functional.mse_loss(pred[mask], metric_t[mask]))
+    assert tm.multitask_loss(logits, pred, phase_t, metric_t).item() == pytest.approx(expected.item())
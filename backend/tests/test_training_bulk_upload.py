@@ -0,0 +1,150 @@
+import sys
+import os
+import importlib.util
+import io
+import types
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.services import dataset_manifest
+
+
+class FakeSession:
+    """Det opplastingen bruker av en SQLAlchemy-session: add_all/flush/commit."""
+
+    def __init__(self):
+        self.rows, self.commits = [], 0
+
+    def add_all(self, rows):
+        for row in rows:
+            self.rows.append(row)
+            row.id = len(self.rows)
+
+    def flush(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+
+class TrainingImage:
+    def __init__(self, **columns):
+        self.id = None
+        self.__dict__.update(columns)
+
+
+def _load_training_router(session):
+    """coatvision-app/routers/training.py med `..db`/`..db_models` fra testen (finnes ikke i treet)."""
+    package = types.ModuleType("cvapp")
+    package.__path__ = [os.path.join(ROOT, "coatvision-app")]
+    routers = types.ModuleType("cvapp.routers")
+    routers.__path__ = [os.path.join(ROOT, "coatvision-app", "routers")]
+    db = types.ModuleType("cvapp.db")
+    db.get_db = lambda: session
+    db_models = types.ModuleType("cvapp.db_models")
+    db_models.TrainingImage = TrainingImage
+    saved = {name: sys.modules.get(name) for name in ("cvapp", "cvapp.routers", "cvapp.db", "cvapp.db_models")}
+    sys.modules.update({"cvapp": package, "cvapp.routers": routers, "cvapp.db": db, "cvapp.db_models": db_models})
+    try:
+        path = os.path.join(ROOT, "coatvision-app", "routers", "training.py")
+        spec = importlib.util.spec_from_file_location("cvapp.routers.training", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        for name, previous in saved.items():
+            if previous is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = previous
+    return module
+
+
+def _png(value):
+    img = np.full((40, 60, 3), value, dtype=np.uint8)
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+@pytest.fixture
+def bulk(tmp_path, monkeypatch):
+    session = FakeSession()
+    training = _load_training_router(session)
+    monkeypatch.setattr(training, "TRAINING_DIR", tmp_path / "training_data")
+    monkeypatch.setattr(training, "DERIVATIVES_DIR", tmp_path / "training_data" / "derivatives")
+    monkeypatch.setattr(training, "BULK_MAX_ENTRY_BYTES", 20_000)
+    monkeypatch.setattr(training, "_derivative_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(dataset_manifest, "DATASET_MANIFEST_PATH", str(tmp_path / "manifest.sqlite"))
+    (tmp_path / "training_data").mkdir()
+    app = FastAPI()
+    app.include_router(training.router)
+    app.dependency_overrides[training.get_db] = lambda: session
+    return training, session, TestClient(app), tmp_path / "training_data"
+
+
+def _zip(entries):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def test_zip_upload_stores_dedupes_and_caps(bulk):
+    training, session, client, training_dir = bulk
+    big = np.random.default_rng(0).integers(0, 255, (200, 200, 3), dtype=np.uint8)
+    archive = _zip({
+        "a.png": _png(10),
+        "b.png": _png(200),
+        "copy-of-a.png": _png(10),
+        "huge.png": cv2.imencode(".png", big)[1].tobytes(),
+        "notes.txt": b"ikke et bilde",
+    })
+
+    r = client.post("/api/training/upload-bulk", files=[("files", ("batch.zip", archive, "application/zip"))],
+                    data={"purpose": "before"})
+    training._derivative_pool.shutdown(wait=True)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["count"] == 2 and body["ids"] == [1, 2] and session.commits == 1
+    assert {s["name"]: s["reason"] for s in body["skipped"]} == {"copy-of-a.png": "duplicate", "huge.png": "too large"}
+
+    stored = sorted(p.name for p in training_dir.iterdir() if p.is_file())
+    assert len(stored) == 2 and not [n for n in stored if n.endswith(".part")]
+    assert {row.purpose for row in session.rows} == {"before"}
+    thumbs = sorted(p.name for p in (training_dir / "derivatives").iterdir())
+    assert len(thumbs) == 4  # thumb + preview per bilde
+
+    # samme ZIP en gang til: alt finnes allerede i manifestet
+    training._derivative_pool = ThreadPoolExecutor(max_workers=1)
+    again = client.post("/api/training/upload-bulk", files=[("files", ("batch.zip", archive, "application/zip"))])
+    assert again.status_code == 400
+    assert sorted(s["reason"] for s in again.json()["detail"]["skipped"]) == ["duplicate"] * 3 + ["too large"]
+
+
+def test_failing_entry_leaves_no_part_file(bulk, monkeypatch):
+    training, _, client, training_dir = bulk
+    monkeypatch.setattr(training, "BULK_MAX_ENTRY_BYTES", 10 ** 6)
+    archive = bytearray(_zip({"ok.png": _png(50), "broken.png": _png(90)}))
+    data = _png(90)
+    start = archive.index(data, archive.index(b"broken.png"))
+    archive[start + len(data) // 2] ^= 0xFF  # CRC-feil midt i oppføringen
+
+    r = client.post("/api/training/upload-bulk", files=[("files", ("batch.zip", bytes(archive), "application/zip"))])
+    training._derivative_pool.shutdown(wait=True)
+    assert r.status_code == 200 and r.json()["count"] == 1
+    assert r.json()["skipped"][0]["name"] == "broken.png"
+    assert [p.suffix for p in training_dir.iterdir() if p.is_file()] == [".png"]
+
+
+def test_background_failures_are_logged(bulk, capsys):
+    training = bulk[0]
+    training._submit(lambda: 1 / 0).exception()
+    training._derivative_pool.shutdown(wait=True)
+    assert "Background task failed: ZeroDivisionError" in capsys.readouterr().out
@@ -0,0 +1,139 @@
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.routers import training
+from backend.app.services import training_runner
+
+FAKE_TRAINER = """
+import argparse, json, os
+p = argparse.ArgumentParser()
+p.add_argument("--progress-file")
+p.add_argument("--epochs", type=int)
+p.add_argument("--world-size", type=int)
+args, _ = p.parse_known_args()
+state = {"state": "completed", "phase": "done", "epoch": args.epochs, "epochs": args.epochs,
+         "loss": 0.5, "samples_per_sec": 12.0, "world_size": args.world_size, "omp": os.environ.get("OMP_NUM_THREADS"),
+         "nice": os.nice(0)}
+with open(args.progress_file, "w") as f:
+    json.dump(state, f)
+"""
+
+
+def _wait_finished(runner):
+    for _ in range(100):
+        status = runner.status()
+        if status["status"] != "running":
+            return status
+        time.sleep(0.05)
+    raise AssertionError("fake trainer did not finish")
+
+
+def _client(monkeypatch, tmp_path):
+    script = tmp_path / "fake_train.py"
+    script.write_text(FAKE_TRAINER)
+    runner = training_runner.TrainingRunner(run_dir=tmp_path / "runs", script=script)
+    monkeypatch.setattr(training_runner, "runner", runner)
+    app = FastAPI()
+    app.include_router(training.router)
+    return TestClient(app), runner
+
+
+def test_status_idle_before_first_run(monkeypatch, tmp_path):
+    client, _ = _client(monkeypatch, tmp_path)
+    assert client.get("/api/training/status").json() == {"status": "idle", "last_run": None}
+
+
+def test_start_runs_trainer_in_separate_process(monkeypatch, tmp_path):
+    client, runner = _client(monkeypatch, tmp_path)
+    r = client.post("/api/training/start", json={"epochs": 3, "threads": 2, "nice": 5, "world_size": 2})
+    assert r.status_code == 200
+    run = r.json()["run"]
+    assert run["pid"] != os.getpid()
+    assert run["options"]["epochs"] == 3
+
+    status = _wait_finished(runner)
+    assert status["status"] == "completed"
+    assert status["progress"]["epoch"] == 3
+    assert status["progress"]["samples_per_sec"] == 12.0
+    assert status["progress"]["world_size"] == 2
+
+    progress_file = os.path.join(run["run_dir"], training_runner.PROGRESS_FILE)
+    with open(progress_file) as f:
+        raw = f.read()
+    assert '"omp": "2"' in raw
+    assert '"nice": %d' % (os.nice(0) + 5) in raw
+
+
+def test_parse_cpu_list():
+    assert training_runner.parse_cpu_list("0, 2-4") == {0, 2, 3, 4}
+    assert training_runner.parse_cpu_list("") == set()
+
+
+def test_resume_only_continues_an_interrupted_run(monkeypatch, tmp_path):
+    client, runner = _client(monkeypatch, tmp_path)
+    first = client.post("/api/training/start", json={"epochs": 1}).json()["run"]
+    _wait_finished(runner)
+    assert first["checkpoint_dir"].startswith(first["run_dir"])  # egne checkpoints per kjøring
+
+    # fullført kjøring: ingenting å fortsette, selv om last.pt finnes
+    os.makedirs(first["checkpoint_dir"])
+    open(os.path.join(first["checkpoint_dir"], "last.pt"), "wb").close()
+    assert runner.resumable_checkpoint_dir() is None
+
+    # avbrutt kjøring: fortsett fra dens checkpoint bare når det er bedt om
+    with open(os.path.join(first["run_dir"], training_runner.PROGRESS_FILE), "w") as f:
+        f.write('{"state": "running", "epoch": 1}')
+    assert str(runner.resumable_checkpoint_dir()) == first["checkpoint_dir"]
+    fresh = client.post("/api/training/start", json={"epochs": 1}).json()["run"]
+    assert fresh["resumed"] is False and fresh["checkpoint_dir"] != first["checkpoint_dir"]
+    _wait_finished(runner)
+
+    os.makedirs(fresh["checkpoint_dir"])
+    open(os.path.join(fresh["checkpoint_dir"], "last.pt"), "wb").close()
+    with open(os.path.join(fresh["run_dir"], training_runner.PROGRESS_FILE), "w") as f:
+        f.write('{"state": "running", "epoch": 1}')
+    resumed = client.post("/api/training/start", json={"epochs": 2, "resume": True}).json()["run"]
+    assert resumed["resumed"] is True and resumed["checkpoint_dir"] == fresh["checkpoint_dir"]
+    _wait_finished(runner)
+
+
+def test_training_env_drops_api_worker_thread_limits(monkeypatch, tmp_path):
+    from backend.app.services import concurrency
+
+    monkeypatch.setattr(concurrency, "INJECTED_ENV", {"OMP_NUM_THREADS": "1", "BLIS_NUM_THREADS": "1"})
+    monkeypatch.setenv("OMP_NUM_THREADS", "1")
+    monkeypatch.setenv("BLIS_NUM_THREADS", "1")
+    monkeypatch.setattr(concurrency, "available_cpus", lambda: 8)
+    runner = training_runner.TrainingRunner(run_dir=tmp_path)
+
+    env = runner._env(training_runner.TrainingOptions(threads=0))
+    assert env["OMP_NUM_THREADS"] == "8" and "BLIS_NUM_THREADS" not in env
+    assert runner._env(training_runner.TrainingOptions(threads=0, world_size=2))["MKL_NUM_THREADS"] == "4"
+    assert runner._env(training_runner.TrainingOptions(threads=0, cpu_affinity="2-3"))["OMP_NUM_THREADS"] == "2"
+
+
+def test_state_is_shared_between_workers(tmp_path):
+    script = tmp_path / "slow_train.py"
+    script.write_text("import time\ntime.sleep(30)\n")
+    worker_a = training_runner.TrainingRunner(run_dir=tmp_path / "runs", script=script)
+    worker_b = training_runner.TrainingRunner(run_dir=tmp_path / "runs", script=script)  # annen uvicorn-worker
+
+    run = worker_a.start(training_runner.TrainingOptions(nice=0))
+    status = worker_b.status()
+    assert status["status"] == "running" and status["last_run"]["pid"] == run["pid"]
+    try:
+        worker_b.start(training_runner.TrainingOptions(nice=0))
+        raise AssertionError("second start should be refused")
+    except training_runner.TrainingAlreadyRunning:
+        pass
+
+    assert worker_b.stop(timeout=5) is True
+    assert worker_a.status()["status"] == "failed"
+    # "omstart": en ny instans uten minne om prosessen ser samme kjøring
+    restarted = training_runner.TrainingRunner(run_dir=tmp_path / "runs", script=script)
+    assert restarted.status()["last_run"]["run_id"] == run["run_id"] and restarted.stop() is False
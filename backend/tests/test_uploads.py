@@ -0,0 +1,62 @@
+import sys
+import os
+import hashlib
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+
+import backend.app.main as app_main
+
+client = TestClient(app_main.app)
+
+
+def _png_bytes():
+    img = np.zeros((64, 64, 3), dtype=np.uint8)
+    img[16:48, 16:48] = [0, 0, 255]
+    _, buffer = cv2.imencode(".png", img)
+    return buffer.tobytes()
+
+
+def _use_tmp_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(app_main, "UPLOAD_DIR", tmp_path / "uploads")
+    monkeypatch.setattr(app_main, "OUTPUT_DIR", tmp_path / "outputs")
+    monkeypatch.setattr(app_main, "STORAGE_INDEX_PATH", tmp_path / "storage_index.sqlite")
+    (tmp_path / "uploads").mkdir()
+    (tmp_path / "outputs").mkdir()
+
+
+def _stored_files(directory):
+    # blobs ligger sharded: <dir>/ab/cd/<sha><ext>; staging skal være tom
+    return sorted(p.relative_to(directory).as_posix() for p in directory.rglob("*") if p.is_file())
+
+
+def test_analyze_upload_is_content_addressed(monkeypatch, tmp_path):
+    _use_tmp_dirs(monkeypatch, tmp_path)
+    data = _png_bytes()
+    sha = hashlib.sha256(data).hexdigest()
+
+    r = client.post("/analyze", files={"file": ("../../evil name.PNG", data, "image/png")})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["original_filename"] == "../../evil name.PNG"
+    assert body["output_filename"].endswith(".png")
+    assert _stored_files(tmp_path / "uploads") == [f"{sha[:2]}/{sha[2:4]}/{sha}.png"]
+    assert client.get(f"/outputs/{body['output_filename']}").status_code == 200
+
+    # Samme innhold på nytt gir samme fil, ingen rester av .part-filer
+    r = client.post("/analyze", files={"file": ("other.png", data, "image/png")})
+    assert r.status_code == 200
+    assert _stored_files(tmp_path / "uploads") == [f"{sha[:2]}/{sha[2:4]}/{sha}.png"]
+    assert r.json()["output_filename"] == body["output_filename"]
+    assert len(_stored_files(tmp_path / "outputs")) == 1
+
+
+def test_analyze_upload_too_large(monkeypatch, tmp_path):
+    _use_tmp_dirs(monkeypatch, tmp_path)
+    monkeypatch.setattr(app_main, "MAX_UPLOAD_BYTES", 1024)
+
+    r = client.post("/analyze", files={"file": ("big.jpg", b"x" * 4096, "image/jpeg")})
+    assert r.status_code == 413
+    assert _stored_files(tmp_path / "uploads") == []
@@ -0,0 +1,124 @@
+import sys
+import os
+import json
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.routers import analyze
+from backend.app.services import video
+
+app = FastAPI()
+app.include_router(analyze.router)
+client = TestClient(app)
+
+
+@pytest.fixture
+def clip(tmp_path):
+    """3 s i 30 fps: tre 'scener' med ulik farge/tekstur."""
+    path = tmp_path / "walkaround.mp4"
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 30, (320, 240))
+    if not writer.isOpened():
+        pytest.skip("no mp4v encoder in this OpenCV build")
+    rng = np.random.default_rng(0)
+    for i in range(90):
+        frame = np.full((240, 320, 3), (40 + 60 * (i // 30), 60 + 50 * (i // 30), 160), np.uint8)
+        frame[100:140, 100:220] = rng.integers(0, 40, (40, 120, 3), dtype=np.uint8) + 80 * (i // 30)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def test_interval_sampling_decodes_only_sampled_frames(clip):
+    sampler = video.FrameSampler(clip, every_s=1.0)
+    frames = list(sampler)
+    assert [f.index for f in frames] == [0, 30, 60]
+    assert [f.reason for f in frames] == ["first", "interval", "interval"]
+    assert sampler.decoded == 3
+
+
+def test_scene_change_sampling(clip):
+    sampler = video.FrameSampler(clip, every_s=10.0, scene_threshold=0.1, probe_fps=5)
+    frames = list(sampler)
+    assert [(f.index, f.reason) for f in frames] == [(0, "first"), (30, "scene"), (60, "scene")]
+    assert sampler.decoded == 15  # hvert 6. bilde (5 fps), ikke alle 90
+
+
+def test_max_frames_and_downscale(clip):
+    frames = list(video.FrameSampler(clip, every_s=0.1, max_frames=4, max_side=160))
+    assert len(frames) == 4 and frames[0].image.shape == (120, 160, 3)
+
+
+def test_video_endpoint_streams_ndjson(clip, monkeypatch):
+    spooled = []
+    original = video.spool_upload
+
+    async def spool(*args, **kwargs):
+        spooled.append(await original(*args, **kwargs))
+        return spooled[-1]
+
+    monkeypatch.setattr(video, "spool_upload", spool)
+    with open(clip, "rb") as f:
+        r = client.post("/api/analyze/video?every_s=0.5&defects=true", files={"file": ("walk.mp4", f, "video/mp4")})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines[0]["type"] == "video" and lines[0]["frames"] == 90
+    frames = [line for line in lines if line["type"] == "frame"]
+    assert [f["index"] for f in frames] == [0, 15, 30, 45, 60, 75]
+    assert all("cqi" in f["metrics"] and "defects" in f["metrics"] for f in frames)
+    summary = lines[-1]
+    assert summary["type"] == "summary" and summary["frames_analyzed"] == 6 and summary["errors"] == 0
+    assert summary["worst_frame"]["cqi"] == min(f["metrics"]["cqi"] for f in frames)
+    assert spooled and not spooled[0].exists()
+
+
+def test_video_endpoint_rejects_bad_input(monkeypatch):
+    r = client.post("/api/analyze/video", files={"file": ("x.mp4", b"not a video", "video/mp4")})
+    assert r.status_code == 400
+
+    monkeypatch.setattr(analyze, "VIDEO_MAX_UPLOAD_BYTES", 4)
+    r = client.post("/api/analyze/video", files={"file": ("x.mp4", b"0123456789", "video/mp4")})
+    assert r.status_code == 413
+
+
+def test_disconnect_before_streaming_removes_temp_file(clip, monkeypatch):
+    import asyncio
+    from starlette.datastructures import Headers, UploadFile
+
+    spooled, samplers = [], []
+    original_spool, original_sampler = video.spool_upload, video.FrameSampler
+
+    async def spool(*args, **kwargs):
+        spooled.append(await original_spool(*args, **kwargs))
+        return spooled[-1]
+
+    def sampler(*args, **kwargs):
+        samplers.append(original_sampler(*args, **kwargs))
+        return samplers[-1]
+
+    monkeypatch.setattr(video, "spool_upload", spool)
+    monkeypatch.setattr(video, "FrameSampler", sampler)
+    sent = []
+
+    async def receive():
+        return {"type": "http.disconnect"}  # klienten er borte før første linje
+
+    async def send(message):
+        sent.append(message["type"])
+
+    async def run():
+        with open(clip, "rb") as f:
+            upload = UploadFile(f, filename="walk.mp4", headers=Headers({"content-type": "video/mp4"}))
+            response = await analyze.analyze_video(file=upload, engine="heuristic", device_id=None, camera=None,
+                                                   defects=False, every_s=1.0, scene=None, roi=None)
+            assert spooled[0].exists()
+            await response({"type": "http"}, receive, send)
+
+    asyncio.run(run())
+    assert "http.response.body" not in sent[2:]  # strømmen ble avbrutt, ikke fullført
+    assert not spooled[0].exists() and not samplers[0].cap.isOpened()
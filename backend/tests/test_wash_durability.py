@@ -0,0 +1,86 @@
+import sys
+import os
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend.app.services import wash_durability
+from backend.app.services.wash_durability import DAY, DurabilityEngine
+
+T0 = 1_700_000_000.0
+
+
+def _history(vehicles=200, points=6, seed=0):
+    """CQI faller lineært med ulik fart per bil; glatthet faller saktere."""
+    rng = np.random.default_rng(seed)
+    slopes = rng.uniform(-0.5, -0.05, size=vehicles)  # CQI per dag
+    rows = []
+    for v, slope in enumerate(slopes):
+        for k in range(points):
+            day = k * 30
+            rows.append({"vehicle_id": f"car-{v}", "panel": "hood", "ts": T0 + day * DAY,
+                         "cqi": 90 + slope * day + rng.normal(0, 0.5), "smoothness": 95 + slope * 0.2 * day})
+    return rows, slopes
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = DurabilityEngine(str(tmp_path / "history.sqlite"), capacity=16)
+    monkeypatch.setattr(wash_durability, "engine", engine)
+    return engine
+
+
+def test_vectorized_fit_matches_polyfit(engine):
+    rows, _ = _history(vehicles=50)
+    engine.record_many(rows)
+    results, missing = engine.forecast(now=T0 + 150 * DAY)
+    assert len(results) == 50 and missing == []
+
+    for result, v in zip(results, range(50)):
+        series = [r for r in rows if r["vehicle_id"] == f"car-{v}"]
+        t = np.array([(r["ts"] - T0) / DAY for r in series])
+        b, a = np.polyfit(t, [r["cqi"] for r in series], 1)
+        assert result["metrics"]["cqi"]["slope_per_30d"] == pytest.approx(b * 30, abs=1e-3)
+        assert result["limiting_metric"] == "cqi"
+        days_left = (60 - a) / b - 150
+        if days_left > 0:
+            assert result["days_left"] == pytest.approx(days_left, abs=0.1)
+            assert result["recommendation"] == "continue"
+        else:
+            assert result["recommendation"] == "recoat_recommended" and result["days_left"] == 0
+
+
+def test_incremental_updates_only_refit_changed_series(engine, tmp_path):
+    rows, _ = _history(vehicles=3)
+    engine.record_many(rows[:12])
+    engine.forecast()
+    engine.record_many(rows[12:])
+    assert engine._dirty[:3].tolist() == [False, False, True]
+
+    # annen worker leser samme logg og kommer til samme resultat
+    other = DurabilityEngine(str(tmp_path / "history.sqlite"))
+    assert other.forecast(now=T0)[0] == engine.forecast(now=T0)[0]
+
+
+def test_forecast_endpoint_batch(engine):
+    from backend.app.routers import wash
+
+    app = FastAPI()
+    app.include_router(wash.router)
+    rows, _ = _history(vehicles=20, points=4)
+    with TestClient(app) as client:
+        assert client.post("/api/wash/observations", json={"observations": rows}).json()["recorded"] == 80
+        r = client.post("/api/wash/forecast", json={"vehicles": [
+            {"vehicle_id": f"car-{i}"} for i in range(20)] + [{"vehicle_id": "ghost"}]})
+        analyzed = client.post("/api/wash/analyze", json={"vehicle_id": "car-0", "panel": "hood"}).json()
+        legacy = client.post("/api/wash/analyze", json={"wash_count": 10}).json()
+
+    body = r.json()
+    assert body["count"] == 20 and body["missing"] == [{"vehicle_id": "ghost", "panel": None}]
+    assert all(f["recoat_date"] for f in body["forecasts"])
+    assert analyzed["forecast"]["vehicle_id"] == "car-0"
+    assert legacy["durability_score"] == 80 and legacy["forecast"] is None
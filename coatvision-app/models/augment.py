@@ -0,0 +1,185 @@
+# Intern / Konfidensiell – batch-augmentering for train_multitask
+#
+# Augmenterer hele uint8-batcher (N, H, W, 3) fra tensor-cachen i stedet for
+# ett og ett bilde i Python. Variasjonene etterligner treningsfasene:
+#   NEW_DISTANCE      tilfeldig utsnitt/zoom (+ speilvending)
+#   NEW_LIGHT         lysstyrke, kontrast og fargetone (YIQ-rotasjon)
+#   BACKGROUND_NOISE  gaussisk sensorstøy
+# Utsnitt, speiling og skalering er ett affine_grid/grid_sample-kall for hele
+# batchen; lys/kontrast/fargetone er lineære og slås sammen til én 3x3-matrise
+# (+ offset) per bilde. All tilfeldighet kommer fra en seedet torch.Generator.
+#
+#   python coatvision-app/models/augment.py --batch-size 64 --image-size 224
+
+import argparse
+import json
+import math
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import torch
+import torch.nn.functional as F
+
+# RGB -> YIQ; Y-raden er luminansen som kontrast justeres rundt
+_RGB_TO_YIQ = torch.tensor([
+    [0.299, 0.587, 0.114],
+    [0.596, -0.274, -0.322],
+    [0.211, -0.523, 0.312],
+])
+_YIQ_TO_RGB = torch.linalg.inv(_RGB_TO_YIQ)
+
+
+def _uniform(n: int, low: float, high: float, generator: torch.Generator) -> torch.Tensor:
+    return torch.rand(n, generator=generator) * (high - low) + low
+
+
+class BatchAugment:
+    """uint8 (N, H, W, 3) -> augmentert float (N, 3, S, S), normalisert og channels_last.
+
+    Avvik fra torchvision.ColorJitter: fast rekkefølge (tone, lys, kontrast) og
+    klipping til [0, 1] bare til slutt, siden leddene er slått sammen.
+    """
+
+    def __init__(
+        self,
+        out_size: int,
+        scale: Sequence[float] = (0.6, 1.0),
+        ratio: Sequence[float] = (3 / 4, 4 / 3),
+        flip_p: float = 0.5,
+        brightness: float = 0.3,
+        contrast: float = 0.3,
+        hue: float = 0.05,
+        noise_std: float = 0.02,
+        mean: Optional[Sequence[float]] = None,
+        std: Optional[Sequence[float]] = None,
+        seed: int = 0,
+    ):
+        self.out_size = out_size
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.flip_p = flip_p
+        self.brightness = brightness
+        self.contrast = contrast
+        self.hue = hue
+        self.noise_std = noise_std
+        self.mean = torch.tensor(mean).view(1, 3, 1, 1) if mean is not None else None
+        self.std = torch.tensor(std).view(1, 3, 1, 1) if std is not None else None
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def crop_theta(self, n: int) -> torch.Tensor:
+        """Affine (N, 2, 3) for tilfeldig utsnitt + speiling i normaliserte koordinater."""
+        g = self.generator
+        area = _uniform(n, self.scale[0], self.scale[1], g)
+        ratio = torch.exp(_uniform(n, self.log_ratio[0], self.log_ratio[1], g))
+        w = torch.sqrt(area * ratio).clamp(max=1.0)
+        h = torch.sqrt(area / ratio).clamp(max=1.0)
+        cx = (torch.rand(n, generator=g) * 2 - 1) * (1 - w)
+        cy = (torch.rand(n, generator=g) * 2 - 1) * (1 - h)
+        flip = torch.where(torch.rand(n, generator=g) < self.flip_p, -1.0, 1.0)
+        theta = torch.zeros(n, 2, 3)
+        theta[:, 0, 0] = w * flip
+        theta[:, 0, 2] = cx
+        theta[:, 1, 1] = h
+        theta[:, 1, 2] = cy
+        return theta
+
+    def color_params(self, n: int):
+        """Per-bilde (3x3-matrise, kontrastfaktor, lysfaktor)."""
+        g = self.generator
+        b = _uniform(n, 1 - self.brightness, 1 + self.brightness, g)
+        c = _uniform(n, 1 - self.contrast, 1 + self.contrast, g)
+        angle = _uniform(n, -self.hue, self.hue, g) * 2 * math.pi
+        cos, sin = torch.cos(angle), torch.sin(angle)
+        rot = torch.zeros(n, 3, 3)
+        rot[:, 0, 0] = 1.0
+        rot[:, 1, 1], rot[:, 1, 2] = cos, -sin
+        rot[:, 2, 1], rot[:, 2, 2] = sin, cos
+        hue = _YIQ_TO_RGB @ rot @ _RGB_TO_YIQ  # rotasjon i IQ-planet beholder Y
+        return (b * c).view(n, 1, 1) * hue, c, b
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        n = images.shape[0]
+        x = images.permute(0, 3, 1, 2).float().div_(255.0)
+        grid = F.affine_grid(self.crop_theta(n), [n, 3, self.out_size, self.out_size], align_corners=False)
+        x = F.grid_sample(x, grid, mode="bilinear", padding_mode="reflection", align_corners=False)
+
+        matrix, c, b = self.color_params(n)
+        # kontrast rundt bildets snittluminans etter lysjustering: (1 - c) * b * mean(Y)
+        mean_luma = x.mean(dim=(2, 3)) @ _RGB_TO_YIQ[0]
+        offset = ((1 - c) * b * mean_luma).view(n, 1, 1, 1)
+        x = torch.einsum("nij,njhw->nihw", matrix, x).add_(offset)
+
+        if self.noise_std > 0:
+            sigma = torch.rand(n, 1, 1, 1, generator=self.generator) * self.noise_std
+            x.add_(torch.randn(x.shape, generator=self.generator).mul_(sigma))
+        x.clamp_(0.0, 1.0)
+
+        if self.mean is not None:
+            x.sub_(self.mean).div_(self.std)
+        return x.contiguous(memory_format=torch.channels_last)
+
+
+def per_sample_transform(out_size: int, scale=(0.6, 1.0), brightness=0.3, contrast=0.3, hue=0.05):
+    """Tilsvarende torchvision-pipeline, brukt som referanse i benchmarken."""
+    import torchvision.transforms as T
+
+    return T.Compose([
+        T.RandomResizedCrop(out_size, scale=scale, antialias=True),
+        T.RandomHorizontalFlip(),
+        T.ColorJitter(brightness=brightness, contrast=contrast, hue=hue),
+    ])
+
+
+def benchmark(batch_size: int = 64, image_size: int = 224, batches: int = 10, cache_dir: Optional[str] = None,
+              threads: int = 0, seed: int = 0) -> dict:
+    import train_multitask as tm
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if cache_dir:
+        import numpy as np
+        import tensor_cache
+
+        index = tensor_cache.read_index(cache_dir)
+        images = np.memmap(Path(cache_dir) / tensor_cache.IMAGES_FILE, mode="r", dtype=np.uint8,
+                           shape=tuple(index["shape"]))
+        data = torch.from_numpy(np.array(images[:batch_size]))
+        image_size = data.shape[1]
+    else:
+        g = torch.Generator().manual_seed(seed)
+        data = torch.randint(0, 256, (batch_size, image_size, image_size, 3), dtype=torch.uint8, generator=g)
+
+    batch_aug = BatchAugment(image_size, mean=tm.IMAGENET_MEAN, std=tm.IMAGENET_STD, seed=seed)
+    per_sample = per_sample_transform(image_size)
+    mean = torch.tensor(tm.IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(tm.IMAGENET_STD).view(1, 3, 1, 1)
+
+    def run_per_sample(images):
+        chw = images.permute(0, 3, 1, 2)
+        out = torch.stack([per_sample(img) for img in chw]).float().div_(255.0)
+        return out.sub_(mean).div_(std)
+
+    results = {"batch_size": len(data), "image_size": image_size, "threads": torch.get_num_threads()}
+    for name, fn in (("per_sample", run_per_sample), ("batch", batch_aug)):
+        fn(data)  # oppvarming
+        started = time.perf_counter()
+        for _ in range(batches):
+            fn(data)
+        elapsed = time.perf_counter() - started
+        results[f"{name}_images_per_sec"] = round(batches * len(data) / elapsed, 1)
+    results["speedup"] = round(results["batch_images_per_sec"] / results["per_sample_images_per_sec"], 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark: batch-augmentering vs torchvision per bilde")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--batches", type=int, default=10)
+    parser.add_argument("--cache-dir", default=None, help="Bruk bilder fra tensor-cachen i stedet for syntetiske")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.batch_size, args.image_size, args.batches, args.cache_dir,
+                               args.threads, args.seed)))
@@ -0,0 +1,83 @@
+# Intern / Konfidensiell – eksport av multitask-modellen for CPU-serving
+#
+# Leser checkpointen fra train_multitask (multitask.pt) og skriver
+#   <out>/multitask.ts    TorchScript (frosset: vekter som konstanter, BN foldet inn)
+#   <out>/multitask.onnx  ONNX (hvis onnx-eksport er tilgjengelig)
+#   <out>/multitask.json  metadata: faser, metrikker, bildestørrelse, normalisering
+#
+#   python coatvision-app/models/export_multitask.py --checkpoint local_data/models/multitask.pt
+
+import argparse
+import json
+from pathlib import Path
+
+import torch
+
+import train_multitask as tm
+
+
+def load_trained(checkpoint: Path) -> tuple:
+    state = torch.load(checkpoint, map_location="cpu", weights_only=False)
+    model = tm.MultiTaskNet(num_phases=len(state["phases"]), num_metrics=len(state["metrics"]))
+    model.load_state_dict(state["model"])
+    model.eval()
+    return model, state
+
+
+def metadata_for(state: dict, variant: str = "fp32") -> dict:
+    return {
+        "phases": list(state["phases"]),
+        "metrics": list(state["metrics"]),
+        "image_size": int(state["image_size"]),
+        "mean": list(tm.IMAGENET_MEAN),
+        "std": list(tm.IMAGENET_STD),
+        "variant": variant,
+    }
+
+
+def export_torchscript(model, image_size: int, path: Path) -> None:
+    example = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        traced = torch.jit.freeze(traced)
+    traced.save(str(path))
+
+
+def export_onnx(model, image_size: int, path: Path) -> bool:
+    example = torch.zeros(1, 3, image_size, image_size)
+    try:
+        torch.onnx.export(
+            model, example, str(path),
+            input_names=["images"], output_names=["phase_logits", "metrics"],
+            dynamic_axes={"images": {0: "batch"}, "phase_logits": {0: "batch"}, "metrics": {0: "batch"}},
+            opset_version=17,
+            dynamo=False,
+        )
+        return True
+    except Exception as e:  # onnx-pakken er valgfri
+        print(f"[export] ONNX export skipped: {e}")
+        return False
+
+
+def export(checkpoint: Path, out_dir: Path, name: str = "multitask", onnx: bool = True) -> dict:
+    model, state = load_trained(checkpoint)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    size = int(state["image_size"])
+
+    export_torchscript(model, size, out_dir / f"{name}.ts")
+    has_onnx = onnx and export_onnx(model, size, out_dir / f"{name}.onnx")
+
+    meta = metadata_for(state)
+    meta["formats"] = ["torchscript"] + (["onnx"] if has_onnx else [])
+    (out_dir / f"{name}.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Eksporter multitask-modellen til TorchScript/ONNX")
+    parser.add_argument("--checkpoint", default=str(tm.REPO_DIR / "local_data" / "models" / "multitask.pt"))
+    parser.add_argument("--out-dir", default=str(tm.REPO_DIR / "local_data" / "models"))
+    parser.add_argument("--name", default="multitask")
+    parser.add_argument("--no-onnx", action="store_true")
+    args = parser.parse_args()
+    print(json.dumps(export(Path(args.checkpoint), Path(args.out_dir), args.name, onnx=not args.no_onnx)))
@@ -0,0 +1,233 @@
+# Intern / Konfidensiell – INT8-kvantisering og pruning av multitask-modellen
+#
+# Lager CPU-varianter av checkpointen fra train_multitask (multitask.pt):
+#   dynamic  nn.Linear-lagene kvantiseres dynamisk (vekter int8, aktiveringer ved kjøring)
+#   static   hele nettet kvantiseres (FX graph mode) med kalibrering på et utvalg
+#            av treningsbildene fra datasett-manifestet
+# og kan i tillegg beskjære (L2, strukturert) en andel av utgangskanalene i hver
+# konvolusjon før kvantisering. Hver variant skrives som <name>_<variant>.ts/.json
+# ved siden av float-modellen, og en rapport sammenligner nøyaktighet, latens og
+# størrelse mot float-modellen:
+#
+#   python coatvision-app/models/quantize.py --checkpoint local_data/models/multitask.pt \
+#       --modes dynamic,static --prune 0.2
+#
+# Serveren velger variant med MODEL_VARIANT (f.eks. MODEL_VARIANT=int8).
+
+import argparse
+import copy
+import json
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+from torch import nn
+from torch.nn.utils import prune
+from torch.utils.data import DataLoader, Subset
+
+import export_multitask
+import train_multitask as tm
+
+MODES = ("dynamic", "static")
+
+
+def variant_name(mode: str, prune_amount: float) -> str:
+    base = "int8" if mode == "static" else "int8dyn"
+    return f"pruned{int(round(prune_amount * 100))}_{base}" if prune_amount > 0 else base
+
+
+def prune_channels(model: nn.Module, amount: float) -> Dict[str, float]:
+    """Nuller ut `amount` av utgangskanalene (minst L2-norm) i hver Conv2d.
+
+    Kanalene fjernes ikke fysisk, så tette kjerner blir ikke raskere av dette
+    alene – gevinsten er at nettet tåler kvantisering/tynning som vurderes i
+    rapporten. Første konvolusjon (RGB-inngangen) beholdes urørt.
+    """
+    zeroed, total = 0, 0
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Conv2d) or name.endswith("backbone.conv1"):
+            continue
+        prune.ln_structured(module, "weight", amount=amount, n=2, dim=0)
+        prune.remove(module, "weight")
+        w = module.weight.detach()
+        zeroed += int((w.flatten(1).abs().sum(1) == 0).sum())
+        total += w.shape[0]
+    return {"amount": amount, "zero_channels": zeroed, "channels": total}
+
+
+def quantize_dynamic(model: nn.Module) -> nn.Module:
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model: nn.Module, calib_loader: DataLoader, image_size: int, backend: str) -> nn.Module:
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = backend
+    example = (torch.zeros(1, 3, image_size, image_size),)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs=example)
+    with torch.no_grad():
+        for images, _, _ in calib_loader:
+            prepared(tm.normalize_batch(images).contiguous())
+    return convert_fx(prepared)
+
+
+def script(model: nn.Module, image_size: int) -> torch.jit.ScriptModule:
+    example = torch.zeros(1, 3, image_size, image_size)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(model.eval(), example))
+
+
+def file_size(module: torch.jit.ScriptModule) -> int:
+    fd, path = tempfile.mkstemp(suffix=".ts")
+    os.close(fd)
+    try:
+        module.save(path)
+        return os.path.getsize(path)
+    finally:
+        os.unlink(path)
+
+
+def evaluate(module, loader: Optional[DataLoader]) -> dict:
+    """Fase-nøyaktighet og snitt absolutt feil (0–100-skala) på valideringssettet."""
+    if loader is None:
+        return {"phase_accuracy": None, "metric_mae": None, "samples": 0}
+    correct, labelled, abs_err, metric_n, total = 0, 0, 0.0, 0, 0
+    with torch.no_grad():
+        for images, phase_t, metric_t in loader:
+            phase_logits, metric_pred = module(tm.normalize_batch(images).contiguous())
+            known = phase_t != tm.IGNORE_INDEX
+            correct += int((phase_logits.argmax(1)[known] == phase_t[known]).sum())
+            labelled += int(known.sum())
+            mask = ~torch.isnan(metric_t)
+            abs_err += float((metric_pred[mask] - metric_t[mask]).abs().sum()) * 100.0
+            metric_n += int(mask.sum())
+            total += len(images)
+    return {
+        "phase_accuracy": correct / labelled if labelled else None,
+        "metric_mae": abs_err / metric_n if metric_n else None,
+        "samples": total,
+    }
+
+
+def measure_latency(module, image_size: int, batch_size: int = 1, runs: int = 30, warmup: int = 5) -> dict:
+    x = torch.randn(batch_size, 3, image_size, image_size)
+    timings = []
+    with torch.inference_mode():
+        for i in range(warmup + runs):
+            started = time.perf_counter()
+            module(x)
+            if i >= warmup:
+                timings.append((time.perf_counter() - started) * 1000.0)
+    timings.sort()
+    return {
+        "batch_size": batch_size,
+        "median_ms": round(statistics.median(timings), 3),
+        "p90_ms": round(timings[int(0.9 * (len(timings) - 1))], 3),
+    }
+
+
+def calibration_loader(train_ds, args) -> DataLoader:
+    n = min(args.calib_images, len(train_ds))
+    generator = torch.Generator().manual_seed(args.seed)
+    indices = torch.randperm(len(train_ds), generator=generator)[:n].tolist()
+    return DataLoader(Subset(train_ds, indices), batch_size=args.batch_size, num_workers=0)
+
+
+def profile(module, val_loader, image_size: int, args) -> dict:
+    return {
+        **evaluate(module, val_loader),
+        "size_bytes": file_size(module),
+        "latency": [measure_latency(module, image_size, bs, runs=args.latency_runs) for bs in (1, 8)],
+    }
+
+
+def run(args) -> dict:
+    tm.configure_threads(args)
+    model, state = export_multitask.load_trained(Path(args.checkpoint))
+    args.image_size = int(state["image_size"])
+    train_ds, val_ds, _ = tm.build_datasets(args)
+    val_loader = DataLoader(val_ds, batch_size=args.batch_size, num_workers=0) if len(val_ds) else None
+    calib_loader = calibration_loader(train_ds, args)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    report: Dict[str, object] = {
+        "checkpoint": str(args.checkpoint),
+        "backend": args.backend,
+        "calibration_images": len(calib_loader.dataset),
+        "variants": {"fp32": profile(script(model, args.image_size), val_loader, args.image_size, args)},
+    }
+
+    base = model
+    if args.prune > 0:
+        base = copy.deepcopy(model)
+        report["pruning"] = prune_channels(base, args.prune)
+
+    for mode in args.modes:
+        variant = variant_name(mode, args.prune)
+        candidate = copy.deepcopy(base).eval()
+        if mode == "dynamic":
+            candidate = quantize_dynamic(candidate)
+        else:
+            candidate = quantize_static(candidate, calib_loader, args.image_size, args.backend)
+        scripted = script(candidate, args.image_size)
+
+        stem = f"{args.name}_{variant}"
+        scripted.save(str(out_dir / f"{stem}.ts"))
+        meta = export_multitask.metadata_for(state, variant)
+        meta["formats"] = ["torchscript"]
+        meta["quantized_engine"] = args.backend if mode == "static" else torch.backends.quantized.engine
+        (out_dir / f"{stem}.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+        report["variants"][variant] = profile(scripted, val_loader, args.image_size, args)
+        print(f"[quantize] {variant}: {json.dumps(report['variants'][variant])}", flush=True)
+
+    fp32 = report["variants"]["fp32"]
+    for stats in report["variants"].values():
+        stats["size_ratio"] = round(stats["size_bytes"] / fp32["size_bytes"], 3)
+        stats["speedup_b1"] = round(fp32["latency"][0]["median_ms"] / stats["latency"][0]["median_ms"], 2)
+        if fp32["phase_accuracy"] is not None and stats["phase_accuracy"] is not None:
+            stats["accuracy_delta"] = round(stats["phase_accuracy"] - fp32["phase_accuracy"], 4)
+
+    report_path = Path(args.report) if args.report else out_dir / f"{args.name}_quantization_report.json"
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    report["report"] = str(report_path)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="INT8-kvantisering/pruning av multitask-modellen")
+    parser.add_argument("--checkpoint", default=str(tm.REPO_DIR / "local_data" / "models" / "multitask.pt"))
+    parser.add_argument("--out-dir", default=str(tm.REPO_DIR / "local_data" / "models"))
+    parser.add_argument("--name", default="multitask")
+    parser.add_argument("--modes", default="dynamic,static", help="Kommaseparert: dynamic, static")
+    parser.add_argument("--prune", type=float, default=0.0, help="Andel konv-kanaler som beskjæres (0 = av)")
+    parser.add_argument("--backend", default="x86", choices=["x86", "fbgemm", "qnnpack", "onednn"],
+                        help="Kvantiserings-motor; qnnpack for ARM-instanser")
+    parser.add_argument("--manifest", default=None, help="Sti til datasett-manifest (default fra config)")
+    parser.add_argument("--cache-dir", default=None, help="Memmap tensor-cache; uten denne brukes PIL-pipeline")
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--calib-images", type=int, default=256, help="Antall treningsbilder til kalibrering")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--latency-runs", type=int, default=30)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op tråder (0 = torch default)")
+    parser.add_argument("--cv-threads", type=int, default=1)
+    parser.add_argument("--report", default=None, help="Rapport-JSON (default <out-dir>/<name>_quantization_report.json)")
+    args = parser.parse_args(argv)
+    args.modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(args.modes) - set(MODES)
+    if unknown:
+        parser.error(f"Ukjent modus: {', '.join(sorted(unknown))}")
+    if not 0.0 <= args.prune < 1.0:
+        parser.error("--prune må være i [0, 1)")
+    return args
+
+
+if __name__ == "__main__":
+    print(json.dumps(run(parse_args()), indent=2))
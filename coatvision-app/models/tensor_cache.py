@@ -0,0 +1,157 @@
+# Intern / Konfidensiell – forhåndsprosessert tensor-cache for train_multitask
+#
+# Dekoder og skalerer hele datasettet én gang til en memory-mappet uint8-array
+# (N, S, S, 3) + en indeks. Treningen leser rett fra memmap, så hver epoke er
+# (nesten) ren beregning. Cachen bygges på nytt når manifest-hashen endres.
+
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+from backend.app.core.coatvision_core import reduced_decode_flag  # noqa: E402
+
+CACHE_VERSION = 2  # 2: sentrert kvadratisk utsnitt i stedet for strekking
+IMAGES_FILE = "images.u8"
+INDEX_FILE = "index.json"
+
+
+def _decode_square(path: str, size: int, width: Optional[int], height: Optional[int]) -> np.ndarray:
+    """Decode the centred square crop of an image to size x size RGB, using DCT scaling for big JPEGs.
+
+    `width`/`height` come from the manifest, so no extra header parse is needed.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    flag = cv2.IMREAD_COLOR
+    if data[:2] == b"\xff\xd8" and width and height:
+        # kvadratisk utsnitt: det er korteste side som må holde seg >= size
+        shortest = min(width, height)
+        flag = reduced_decode_flag((shortest, shortest), size)
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        raise ValueError(f"Could not decode {path}")
+    h, w = img.shape[:2]
+    side = min(h, w)
+    top, left = (h - side) // 2, (w - side) // 2
+    img = img[top:top + side, left:left + side]
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def read_index(cache_dir: Path) -> Optional[Dict]:
+    index_path = Path(cache_dir) / INDEX_FILE
+    if not index_path.exists():
+        return None
+    try:
+        return json.loads(index_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def is_valid(cache_dir: Path, manifest_hash: str, image_size: int) -> bool:
+    index = read_index(cache_dir)
+    return bool(
+        index
+        and index.get("version") == CACHE_VERSION
+        and index.get("manifest_hash") == manifest_hash
+        and index.get("image_size") == image_size
+        and (Path(cache_dir) / IMAGES_FILE).exists()
+    )
+
+
+def build_cache(rows: Sequence[Dict], cache_dir: Path, image_size: int, manifest_hash: str) -> Dict:
+    """Decode and resize `rows` (manifest dicts) once into a memmap shard.
+
+    The shard is written to a sibling temp dir and swapped in at the end, so
+    a crashed build never leaves a half-written cache that looks valid.
+    """
+    if not rows:
+        raise ValueError("Cannot build a tensor cache from an empty manifest")
+    cache_dir = Path(cache_dir)
+    tmp_dir = cache_dir.with_name(cache_dir.name + ".building")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    shape = (len(rows), image_size, image_size, 3)
+    images = np.memmap(tmp_dir / IMAGES_FILE, mode="w+", dtype=np.uint8, shape=shape)
+    entries: List[Dict] = []
+    for i, row in enumerate(rows):
+        images[i] = _decode_square(row["path"], image_size, row.get("width"), row.get("height"))
+        entries.append({k: row.get(k) for k in ("path", "sha256", "phase", "cvi", "cqi")})
+    images.flush()
+    del images
+
+    index = {
+        "version": CACHE_VERSION,
+        "manifest_hash": manifest_hash,
+        "image_size": image_size,
+        "shape": list(shape),
+        "rows": entries,
+    }
+    (tmp_dir / INDEX_FILE).write_text(json.dumps(index), encoding="utf-8")
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return index
+
+
+def load_or_build(rows: Sequence[Dict], cache_dir: Path, image_size: int, manifest_hash: str) -> Dict:
+    """Return the cache index, rebuilding only if the manifest hash or size changed."""
+    if is_valid(cache_dir, manifest_hash, image_size):
+        return read_index(cache_dir)
+    print(f"[cache] Building tensor cache for {len(rows)} images at {image_size}px -> {cache_dir}")
+    return build_cache(rows, cache_dir, image_size, manifest_hash)
+
+
+class MemmapDataset(Dataset):
+    """
+    Dataset som leser uint8-bilder (H, W, 3) direkte fra memmap-cachen.
+
+    `__getitem__` returnerer en tensor som deler minne med memmap-en (ingen
+    kopi); normalisering til float gjøres per batch i treningsløkka.
+    `indices` velger et utvalg (f.eks. train/val) uten å kopiere data.
+    """
+
+    def __init__(self, cache_dir: Path, targets_fn, indices: Optional[Sequence[int]] = None):
+        self.cache_dir = Path(cache_dir)
+        index = read_index(self.cache_dir)
+        if index is None:
+            raise FileNotFoundError(f"No tensor cache in {self.cache_dir}")
+        self.shape = tuple(index["shape"])
+        self.rows = index["rows"]
+        self.indices = list(range(len(self.rows))) if indices is None else list(indices)
+        self.targets = [targets_fn(row) for row in self.rows]
+        self._images = None  # åpnes lat i hver DataLoader-worker
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def _array(self) -> np.ndarray:
+        if self._images is None:
+            # "c" = copy-on-write: skrivbar visning uten kopi, så torch.from_numpy ikke klager
+            self._images = np.memmap(self.cache_dir / IMAGES_FILE, mode="c", dtype=np.uint8, shape=self.shape)
+        return self._images
+
+    def __getitem__(self, idx: int):
+        i = self.indices[idx]
+        image = torch.from_numpy(self._array()[i])
+        phase, metrics = self.targets[i]
+        return image, torch.tensor(phase, dtype=torch.long), torch.tensor(metrics, dtype=torch.float32)
+
+    def __getstate__(self):
+        # Ikke send memmap-handle til worker-prosesser
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
@@ -1,7 +1,15 @@
 # Intern / Konfidensiell – CoatVision treningsskript (v0.1)
 # DATO: 11.11.2025
+#
+# Multitask-modell: klassifiserer treningsfase (Phase) og regresserer
+# CVI/CQI fra analyze_coating. Data hentes fra datasett-manifestet.
+#
+#   python coatvision-app/models/train_multitask.py --epochs 10 --cache-dir local_data/tensor_cache
+#
+# Data-parallell trening på CPU (gloo, én prosess per rank, lokalt):
+#   python coatvision-app/models/train_multitask.py --world-size 8 --cache-dir local_data/tensor_cache
 
-import os, json, random
+import os, json, math, random, argparse, signal, socket, sys, time
 from pathlib import Path
 from typing import List, Tuple
 
@@ -10,7 +18,415 @@ from PIL import Image
 
 import torch
 import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader, Dataset, random_split
+from torch.utils.data.distributed import DistributedSampler
 import torchvision.transforms as T
 import torchvision.models as tv_models  # alias for å unngå navn-kollisjon
+
+REPO_DIR = Path(__file__).resolve().parents[2]
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+from backend.app.services import dataset_manifest  # noqa: E402
+from backend.app.services.training import Phase  # noqa: E402
+
+import augment  # noqa: E402
+import tensor_cache  # noqa: E402  (ligger ved siden av dette skriptet)
+
+PHASES = [p.value for p in Phase]
+METRIC_TARGETS = ("cvi", "cqi")
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+IGNORE_INDEX = -100
+
+
+def row_targets(row) -> Tuple[int, List[float]]:
+    """(fase-indeks, [cvi, cqi] skalert til 0-1). Manglende verdier -> ignore/NaN."""
+    phase = PHASES.index(row["phase"]) if row.get("phase") in PHASES else IGNORE_INDEX
+    metrics = [row[k] / 100.0 if row.get(k) is not None else float("nan") for k in METRIC_TARGETS]
+    return phase, metrics
+
+
+class ManifestImageDataset(Dataset):
+    """PIL + torchvision-transform per bilde (dekoder på nytt hver epoke)."""
+
+    def __init__(self, rows, image_size: int):
+        self.rows = list(rows)
+        self.transform = T.Compose([
+            T.Resize((image_size, image_size)),
+            T.ToTensor(),
+            T.Normalize(IMAGENET_MEAN, IMAGENET_STD),
+        ])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, idx):
+        row = self.rows[idx]
+        image = self.transform(Image.open(row["path"]).convert("RGB"))
+        phase, metrics = row_targets(row)
+        return image, torch.tensor(phase, dtype=torch.long), torch.tensor(metrics, dtype=torch.float32)
+
+
+class MultiTaskNet(nn.Module):
+    def __init__(self, num_phases: int = len(PHASES), num_metrics: int = len(METRIC_TARGETS), pretrained: bool = False):
+        super().__init__()
+        weights = tv_models.ResNet18_Weights.DEFAULT if pretrained else None
+        backbone = tv_models.resnet18(weights=weights)
+        features = backbone.fc.in_features
+        backbone.fc = nn.Identity()
+        self.backbone = backbone
+        self.phase_head = nn.Linear(features, num_phases)
+        self.metric_head = nn.Sequential(nn.Linear(features, num_metrics), nn.Sigmoid())
+
+    def forward(self, x):
+        feats = self.backbone(x)
+        return self.phase_head(feats), self.metric_head(feats)
+
+
+def normalize_batch(images: torch.Tensor) -> torch.Tensor:
+    """uint8 (N, H, W, 3) fra memmap-cachen -> normalisert float (N, 3, H, W)."""
+    if images.dtype != torch.uint8:
+        return images
+    x = images.permute(0, 3, 1, 2).float().div_(255.0)
+    mean = torch.tensor(IMAGENET_MEAN, dtype=x.dtype).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, dtype=x.dtype).view(1, 3, 1, 1)
+    return x.sub_(mean).div_(std).contiguous(memory_format=torch.channels_last)
+
+
+def multitask_loss(phase_logits, metric_pred, phase_t, metric_t):
+    """Maskert tap som alltid bruker begge hodene.
+
+    Mangler en batch fase-etiketter (eller metrikker), blir det leddet 0 men er
+    fortsatt koblet til grafen. Ellers får hodet ingen gradient, og DDP venter
+    på en reduksjon som aldri kommer (umerkede manifester fra opplasting/sync).
+    """
+    known = phase_t != IGNORE_INDEX
+    phase_loss = nn.functional.cross_entropy(phase_logits, phase_t, ignore_index=IGNORE_INDEX, reduction="sum")
+    phase_loss = phase_loss / known.sum().clamp(min=1)
+    mask = ~torch.isnan(metric_t)
+    sq = (metric_pred - torch.nan_to_num(metric_t)) ** 2
+    metric_loss = (sq * mask).sum() / mask.sum().clamp(min=1)
+    return phase_loss + metric_loss
+
+
+def seed_everything(seed: int) -> None:
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def configure_threads(args) -> None:
+    """Begrens tråder slik at treningen ikke tar kjernene fra API-et."""
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # kan bare settes før første parallelle operasjon
+    try:
+        import cv2
+        cv2.setNumThreads(args.cv_threads)
+    except ImportError:
+        pass
+
+
+class ProgressReporter:
+    """Skriver fremdrift som JSON (atomisk) slik at API-et kan lese den."""
+
+    def __init__(self, path, min_interval: float = 1.0):
+        self.path = Path(path) if path else None
+        self.min_interval = min_interval
+        self.state = {"state": "running", "pid": os.getpid()}
+        self._last_write = 0.0
+
+    def update(self, force: bool = False, **fields) -> None:
+        self.state.update(fields)
+        if self.path is None:
+            return
+        now = time.time()
+        if not force and now - self._last_write < self.min_interval:
+            return
+        self.state["updated_at"] = now
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.state), encoding="utf-8")
+        os.replace(tmp, self.path)
+        self._last_write = now
+
+
+def save_checkpoint(path: Path, model, optimizer, epoch: int, history: list, args, manifest_hash: str = "") -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    torch.save({
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "epoch": epoch,
+        "history": history,
+        "image_size": args.image_size,
+        "manifest_hash": manifest_hash,
+        "rng": torch.get_rng_state(),
+    }, tmp)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: Path, model, optimizer, manifest_hash: str = "") -> Tuple[int, list]:
+    """Returnerer (siste fullførte epoke, historikk); (0, []) hvis checkpointet er fra et annet manifest."""
+    state = torch.load(path, map_location="cpu", weights_only=False)
+    if manifest_hash and state.get("manifest_hash") != manifest_hash:
+        return 0, []
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    torch.set_rng_state(state["rng"])
+    return state["epoch"], state.get("history", [])
+
+
+def build_datasets(args):
+    conn = dataset_manifest.open_manifest(args.manifest)
+    try:
+        train_rows, val_rows = dataset_manifest.split(conn, val_fraction=args.val_fraction, seed=args.seed)
+        manifest_hash = dataset_manifest.manifest_hash(conn)
+    finally:
+        conn.close()
+    if not train_rows:
+        raise SystemExit("Datasett-manifestet er tomt – kjør dataset_manifest sync først.")
+
+    if not args.cache_dir:
+        return (ManifestImageDataset(train_rows, args.image_size), ManifestImageDataset(val_rows, args.image_size),
+                manifest_hash)
+
+    rows = train_rows + val_rows
+    tensor_cache.load_or_build(rows, Path(args.cache_dir), args.image_size, manifest_hash)
+    n_train = len(train_rows)
+    train_ds = tensor_cache.MemmapDataset(args.cache_dir, row_targets, indices=range(n_train))
+    val_ds = tensor_cache.MemmapDataset(args.cache_dir, row_targets, indices=range(n_train, len(rows)))
+    return train_ds, val_ds, manifest_hash
+
+
+def make_loader(dataset, args, shuffle: bool, sampler=None) -> DataLoader:
+    return DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=args.workers,
+        persistent_workers=args.workers > 0,
+        drop_last=False,
+    )
+
+
+def evaluate(model, loader) -> dict:
+    model.eval()
+    total, correct, labelled, loss_sum = 0, 0, 0, 0.0
+    with torch.no_grad():
+        for images, phase_t, metric_t in loader:
+            phase_logits, metric_pred = model(normalize_batch(images))
+            loss_sum += float(multitask_loss(phase_logits, metric_pred, phase_t, metric_t)) * len(images)
+            known = phase_t != IGNORE_INDEX
+            correct += int((phase_logits.argmax(1)[known] == phase_t[known]).sum())
+            labelled += int(known.sum())
+            total += len(images)
+    return {
+        "val_loss": loss_sum / max(total, 1),
+        "phase_accuracy": correct / labelled if labelled else None,
+    }
+
+
+def scaled_lr(args) -> float:
+    """--lr gjelder én prosess med --batch-size; skaleres med global batch (world_size × batch)."""
+    if args.lr_scaling == "linear":
+        return args.lr * args.world_size
+    if args.lr_scaling == "sqrt":
+        return args.lr * math.sqrt(args.world_size)
+    return args.lr
+
+
+def available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def reduce_epoch_stats(seen: int, loss_sum: float, elapsed: float, distributed: bool) -> Tuple[int, float, float]:
+    """Summerer eksempler/tap over alle ranks; epoketiden er den tregeste ranken."""
+    if not distributed:
+        return seen, loss_sum, elapsed
+    sums = torch.tensor([float(seen), loss_sum], dtype=torch.float64)
+    slowest = torch.tensor([elapsed], dtype=torch.float64)
+    dist.all_reduce(sums, op=dist.ReduceOp.SUM)
+    dist.all_reduce(slowest, op=dist.ReduceOp.MAX)
+    return int(sums[0].item()), float(sums[1].item()), float(slowest.item())
+
+
+def train_worker(rank: int, args, results=None) -> dict:
+    """Én treningsprosess. Med world_size > 1 er dette én rank i gloo-gruppen."""
+    distributed = args.world_size > 1
+    if distributed:
+        dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{args.master_port}",
+                                rank=rank, world_size=args.world_size)
+    try:
+        history = _train_loop(rank, args, distributed)
+    finally:
+        if distributed:
+            dist.destroy_process_group()
+    if results is not None and rank == 0:
+        results.put({"history": history})
+    return {"history": history}
+
+
+def _train_loop(rank: int, args, distributed: bool) -> list:
+    is_main = rank == 0
+    configure_threads(args)
+    seed_everything(args.seed)
+    progress = ProgressReporter(args.progress_file if is_main else None)
+    progress.update(force=True, phase="preparing", epochs=args.epochs, world_size=args.world_size)
+
+    train_ds, val_ds, manifest_hash = build_datasets(args)
+    # Hver rank ser sin egen del av treningssettet; samme antall batcher per rank
+    sampler = DistributedSampler(train_ds, num_replicas=args.world_size, rank=rank,
+                                 shuffle=True, seed=args.seed) if distributed else None
+    train_loader = make_loader(train_ds, args, shuffle=True, sampler=sampler)
+    val_loader = make_loader(val_ds, args, shuffle=False) if is_main and len(val_ds) else None
+
+    model = MultiTaskNet(pretrained=args.pretrained).to(memory_format=torch.channels_last)
+    optimizer = optim.AdamW(model.parameters(), lr=scaled_lr(args), weight_decay=1e-4)
+
+    history = []
+    start_epoch = 1
+    checkpoint = Path(args.checkpoint_dir) / "last.pt" if args.checkpoint_dir else None
+    if args.resume and checkpoint and checkpoint.exists():
+        done, history = load_checkpoint(checkpoint, model, optimizer, manifest_hash)
+        start_epoch = done + 1
+        if is_main:
+            print(f"[train] Resuming from epoch {start_epoch}" if done else
+                  "[train] Checkpoint is from another manifest, starting from scratch")
+
+    # Augmentering per batch på uint8 fra cachen; egen seed per rank
+    batch_augment = augment.BatchAugment(
+        args.image_size, mean=IMAGENET_MEAN, std=IMAGENET_STD, seed=args.seed + rank,
+    ) if args.batch_augment else None
+
+    # DDP kringkaster rank 0 sine vekter ved oppstart og all-reduserer gradientene
+    net = DistributedDataParallel(model, gradient_as_bucket_view=True) if distributed else model
+
+    for epoch in range(start_epoch, args.epochs + 1):
+        if sampler is not None:
+            sampler.set_epoch(epoch)
+        net.train()
+        started = time.perf_counter()
+        seen, loss_sum = 0, 0.0
+        for batch, (images, phase_t, metric_t) in enumerate(train_loader, 1):
+            optimizer.zero_grad(set_to_none=True)
+            inputs = batch_augment(images) if batch_augment else normalize_batch(images)
+            phase_logits, metric_pred = net(inputs)
+            loss = multitask_loss(phase_logits, metric_pred, phase_t, metric_t)
+            loss.backward()
+            optimizer.step()
+            seen += len(images)
+            loss_sum += loss.item() * len(images)
+            elapsed = time.perf_counter() - started
+            progress.update(
+                phase="training", epoch=epoch, batch=batch, batches=len(train_loader),
+                loss=loss_sum / seen,
+                # estimat: alle ranks går i takt
+                samples_per_sec=seen * args.world_size / elapsed if elapsed > 0 else None,
+            )
+
+        seen, loss_sum, elapsed = reduce_epoch_stats(seen, loss_sum, time.perf_counter() - started, distributed)
+        stats = {
+            "epoch": epoch,
+            "loss": loss_sum / max(seen, 1),
+            "samples_per_sec": seen / elapsed if elapsed > 0 else None,
+            "world_size": args.world_size,
+        }
+        if val_loader is not None:
+            stats.update(evaluate(model, val_loader))
+        history.append(stats)
+
+        if is_main:
+            print(json.dumps(stats), flush=True)
+            if checkpoint:
+                save_checkpoint(checkpoint, model, optimizer, epoch, history, args, manifest_hash)
+            progress.update(force=True, phase="epoch_done", last_epoch=stats, **stats)
+        if distributed:
+            dist.barrier()  # resten venter på evaluering/checkpoint fra rank 0
+
+    if is_main and args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        torch.save({"model": model.state_dict(), "phases": PHASES, "metrics": METRIC_TARGETS,
+                    "image_size": args.image_size}, args.output)
+    progress.update(force=True, state="completed", phase="done", output=args.output)
+    return history
+
+
+def train(args) -> dict:
+    if args.world_size <= 1:
+        return train_worker(0, args)
+
+    if args.threads <= 0:
+        # Del kjernene mellom ranks i stedet for at hver prosess tar alle
+        args.threads = max(1, available_cpus() // args.world_size)
+    if not args.master_port:
+        args.master_port = free_port()
+    if args.cache_dir:
+        build_datasets(args)  # bygg tensor-cachen én gang før ranks starter
+
+    results = mp.get_context("spawn").SimpleQueue()
+    context = mp.spawn(train_worker, args=(args, results), nprocs=args.world_size, join=False)
+
+    def forward_signal(signum, _frame):
+        # TrainingRunner.stop() sender SIGTERM til denne prosessen; ta med ranks
+        for process in context.processes:
+            if process.is_alive():
+                process.terminate()
+
+    previous = signal.signal(signal.SIGTERM, forward_signal)
+    try:
+        while not context.join():
+            pass
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+    return results.get() if not results.empty() else {"history": []}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tren CoatVision multitask-modell")
+    parser.add_argument("--manifest", default=None, help="Sti til datasett-manifest (default fra config)")
+    parser.add_argument("--cache-dir", default=None, help="Memmap tensor-cache; uten denne brukes PIL-pipeline")
+    parser.add_argument("--image-size", type=int, default=224)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=3e-4)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--pretrained", action="store_true")
+    parser.add_argument("--output", default=str(REPO_DIR / "local_data" / "models" / "multitask.pt"))
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op tråder per prosess (0 = torch default, eller kjernene delt på ranks)")
+    parser.add_argument("--cv-threads", type=int, default=1, help="cv2.setNumThreads for dekoding")
+    parser.add_argument("--checkpoint-dir", default=None, help="Lagre last.pt etter hver epoke")
+    parser.add_argument("--resume", action="store_true", help="Fortsett fra checkpoint-dir/last.pt")
+    parser.add_argument("--progress-file", default=None, help="JSON-fil med fremdrift (leses av API-et)")
+    parser.add_argument("--world-size", type=int, default=1, help="Antall data-parallelle prosesser (gloo)")
+    parser.add_argument("--master-port", type=int, default=0, help="TCP-port for gloo-rendezvous (0 = ledig port)")
+    parser.add_argument("--lr-scaling", default="linear", choices=["linear", "sqrt", "none"],
+                        help="Skalering av --lr med world_size (--batch-size er per prosess)")
+    parser.add_argument("--batch-augment", action="store_true",
+                        help="Tilfeldig utsnitt/speiling/lys/tone/støy per batch (krever --cache-dir)")
+    args = parser.parse_args(argv)
+    if args.batch_augment and not args.cache_dir:
+        parser.error("--batch-augment krever --cache-dir (augmenterer uint8-batcher fra tensor-cachen)")
+    return args
+
+
+if __name__ == "__main__":
+    train(parse_args())
@@ -1,10 +1,13 @@
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Any
-from openai import OpenAI
 import unicodedata
 
-from ..config import OPENAI_API_KEY
+from backend.app.services import lyxbot_client
+from backend.app.services import lyxbot_sessions
+from backend.app.services.lyxbot_client import LyxbotUnavailable
+from backend.app.services.lyxbot_sessions import InvalidSessionId
 
 # Router for LYXbot
 router = APIRouter(
@@ -12,10 +15,6 @@ router = APIRouter(
     tags=["lyxbot"],
 )
 
-# OpenAI-klient
-client = OpenAI(api_key=OPENAI_API_KEY)
-
-
 def strip_non_ascii(text: str) -> str:
     """
     Fjerner tegn som ikke lar seg representere i ren ASCII.
@@ -44,35 +43,46 @@ SYSTEM_PROMPT = strip_non_ascii(SYSTEM_PROMPT_RAW)
 
 class LyxbotRequest(BaseModel):
     message: str
+    # Valgfri samtale-id (genereres av appen); historikken holdes da på serveren
+    session_id: Optional[str] = None
 
 
 class LyxbotResponse(BaseModel):
     reply: str
+    cached: bool = False
+    session_id: Optional[str] = None
+
+
+FALLBACK_REPLY = "Beklager, jeg klarte ikke a generere et svar akkurat na."
 
 
 @router.post("/chat", response_model=LyxbotResponse)
 async def lyxbot_chat(body: LyxbotRequest) -> LyxbotResponse:
     """
     Enkelt chat-endepunkt for LYXbot.
-    Tar inn en tekst-melding og svarer med AI.
+    Tar inn en tekst-melding og svarer med AI (like spørsmål besvares fra cache).
     """
     try:
         user_message = strip_non_ascii(body.message)
 
-        completion = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message},
-            ],
-        )
-
-        reply: Any = completion.choices[0].message.content
-        if reply is None:
-            reply = "Beklager, jeg klarte ikke a generere et svar akkurat na."
+        if body.session_id:
+            messages = await lyxbot_sessions.store.context_async(body.session_id, SYSTEM_PROMPT, user_message)
+            reply, cached = await lyxbot_client.complete(messages)
+            await lyxbot_sessions.store.record_async(body.session_id, user_message, reply)
+        else:
+            reply, cached = await lyxbot_client.complete(
+                lyxbot_client.build_messages(SYSTEM_PROMPT, user_message),
+                key=lyxbot_client.cache_key(SYSTEM_PROMPT, user_message),
+            )
 
         # Vi returnerer som streng
-        return LyxbotResponse(reply=str(reply))
+        return LyxbotResponse(reply=strip_non_ascii(reply) or FALLBACK_REPLY, cached=cached, session_id=body.session_id)
+
+    except InvalidSessionId as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+    except LyxbotUnavailable:
+        raise HTTPException(status_code=503, detail="AI-tjenesten er ikke konfigurert.")
 
     except Exception:
         # Ikke send hele exception-teksten videre (kan inneholde rare tegn)
@@ -80,3 +90,26 @@ async def lyxbot_chat(body: LyxbotRequest) -> LyxbotResponse:
             status_code=500,
             detail="Feil mot AI-tjenesten. Proev igjen senere.",
         )
+
+
+@router.post("/chat/stream")
+async def lyxbot_chat_stream(body: LyxbotRequest):
+    """
+    Samme som /chat, men svaret strømmes token for token som Server-Sent Events.
+    """
+    user_message = strip_non_ascii(body.message)
+    if body.session_id:
+        try:
+            messages = await lyxbot_sessions.store.context_async(body.session_id, SYSTEM_PROMPT, user_message)
+        except InvalidSessionId as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+        return lyxbot_client.sse_chat(
+            messages,
+            fallback=FALLBACK_REPLY,
+            on_complete=lambda reply: lyxbot_sessions.store.record_async(body.session_id, user_message, reply),
+        )
+    return lyxbot_client.sse_chat(
+        lyxbot_client.build_messages(SYSTEM_PROMPT, user_message),
+        key=lyxbot_client.cache_key(SYSTEM_PROMPT, user_message),
+        fallback=FALLBACK_REPLY,
+    )
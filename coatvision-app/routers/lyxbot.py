@@ -1,11 +1,12 @@
-from typing import Any
+from typing import Optional
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from openai import OpenAI
-
-from ..config import OPENAI_API_KEY
 
+from backend.app.services import lyxbot_client
+from backend.app.services import lyxbot_sessions
+from backend.app.services.lyxbot_client import LyxbotUnavailable
+from backend.app.services.lyxbot_sessions import InvalidSessionId
 
 
 router = APIRouter(
@@ -18,15 +19,17 @@ router = APIRouter(
 
 class LyxbotRequest(BaseModel):
     message: str
+    # Valgfri samtale-id (genereres av appen); historikken holdes da på serveren
+    session_id: Optional[str] = None
 
 
 class LyxbotResponse(BaseModel):
     reply: str
+    cached: bool = False
+    session_id: Optional[str] = None
 
 
-# --------- OpenAI-klient ---------
-
-client = OpenAI(api_key=OPENAI_API_KEY)
+# --------- Prompt ---------
 
 SYSTEM_PROMPT = (
     "Du er LYXbot, en ekspert på bilpleie, lakkorrigering og keramisk coating.\n"
@@ -35,28 +38,34 @@ SYSTEM_PROMPT = (
 )
 
 
+FALLBACK_REPLY = "Beklager, jeg klarte ikke å generere et svar akkurat nå."
+
+
 # --------- Endepunkt ---------
 
 @router.post("/chat", response_model=LyxbotResponse)
 async def lyxbot_chat(body: LyxbotRequest) -> LyxbotResponse:
     """
     Enkelt chat-endepunkt for LYXbot.
-    Tar inn en tekst-melding og svarer med AI.
+    Tar inn en tekst-melding og svarer med AI (like spørsmål besvares fra cache).
     """
     try:
-        completion = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": body.message},
-            ],
-        )
-
-        reply: Any = completion.choices[0].message.content
-        if not reply:
-            reply = "Beklager, jeg klarte ikke å generere et svar akkurat nå."
-
-        return LyxbotResponse(reply=str(reply))
+        if body.session_id:
+            messages = await lyxbot_sessions.store.context_async(body.session_id, SYSTEM_PROMPT, body.message)
+            reply, cached = await lyxbot_client.complete(messages)
+            await lyxbot_sessions.store.record_async(body.session_id, body.message, reply)
+        else:
+            reply, cached = await lyxbot_client.complete(
+                lyxbot_client.build_messages(SYSTEM_PROMPT, body.message),
+                key=lyxbot_client.cache_key(SYSTEM_PROMPT, body.message),
+            )
+        return LyxbotResponse(reply=reply or FALLBACK_REPLY, cached=cached, session_id=body.session_id)
+
+    except InvalidSessionId as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+
+    except LyxbotUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e)) from e
 
     except Exception as e:
         # Logg til terminalen så vi ser ekte feil hvis noe går galt
@@ -67,3 +76,47 @@ async def lyxbot_chat(body: LyxbotRequest) -> LyxbotResponse:
             status_code=500,
             detail="Feil mot AI-tjenesten. Prøv igjen senere.",
         ) from e
+
+
+@router.post("/chat/stream")
+async def lyxbot_chat_stream(body: LyxbotRequest):
+    """
+    Samme som /chat, men svaret strømmes token for token som Server-Sent Events.
+    """
+    if body.session_id:
+        try:
+            messages = await lyxbot_sessions.store.context_async(body.session_id, SYSTEM_PROMPT, body.message)
+        except InvalidSessionId as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+        return lyxbot_client.sse_chat(
+            messages,
+            fallback=FALLBACK_REPLY,
+            on_complete=lambda reply: lyxbot_sessions.store.record_async(body.session_id, body.message, reply),
+        )
+    return lyxbot_client.sse_chat(
+        lyxbot_client.build_messages(SYSTEM_PROMPT, body.message),
+        key=lyxbot_client.cache_key(SYSTEM_PROMPT, body.message),
+        fallback=FALLBACK_REPLY,
+    )
+
+
+@router.get("/sessions/{session_id}")
+async def lyxbot_session(session_id: str):
+    """
+    Status for en samtale: antall turer, tokenbruk og sammendrag av eldre turer.
+    """
+    try:
+        info = await lyxbot_sessions.store.info_async(session_id)
+    except InvalidSessionId as e:
+        raise HTTPException(status_code=422, detail=str(e)) from e
+    if info is None:
+        raise HTTPException(status_code=404, detail="Ukjent eller utløpt samtale")
+    return info
+
+
+@router.delete("/sessions/{session_id}")
+async def lyxbot_end_session(session_id: str):
+    """
+    Avslutt en samtale og slett historikken på serveren.
+    """
+    return {"deleted": await lyxbot_sessions.store.delete_async(session_id)}
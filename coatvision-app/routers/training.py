@@ -1,7 +1,12 @@
 # backend/app/routers/training.py
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
+import hashlib
+import os
 import uuid
-from typing import Optional
+import zipfile
+import zlib
+from typing import BinaryIO, Callable, List, Optional, Set, Tuple
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
 from sqlalchemy.orm import Session
@@ -9,11 +14,31 @@ from sqlalchemy.orm import Session
 from ..db import get_db
 from .. import db_models as models  # kobler til backend/app/db_models.py
 
+try:
+    # Valgfritt: hold datasett-manifestet oppdatert etter hvert som bilder kommer inn
+    from backend.app.services import dataset_manifest
+except Exception:
+    dataset_manifest = None
+
 router = APIRouter(prefix="/api/training", tags=["training"])
 
 BASE_DIR = Path(__file__).resolve().parents[2]  # backend/
 TRAINING_DIR = BASE_DIR / "training_data"
 TRAINING_DIR.mkdir(parents=True, exist_ok=True)
+DERIVATIVES_DIR = TRAINING_DIR / "derivatives"
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+BULK_COMMIT_BATCH = int(os.getenv("TRAINING_BULK_COMMIT_BATCH", "200"))
+BULK_MAX_ENTRY_BYTES = int(os.getenv("TRAINING_BULK_MAX_ENTRY_MB", "50")) * 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+# Lengste side (px) for avledede bilder: liten tommelnegl + forhåndsvisning
+DERIVATIVE_SIZES = {"thumb": 256, "preview": 1024}
+
+# Thumbnails lages i bakgrunnen; OpenCV slipper GIL, så tråder holder
+_derivative_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("TRAINING_THUMBNAIL_WORKERS", "2")),
+    thread_name_prefix="training-thumbs",
+)
 
 
 @router.post("/upload-image")
@@ -44,6 +69,7 @@ async def upload_training_image(
     db.add(img)
     db.commit()
     db.refresh(img)
+    _submit(index_training_image, save_path)
 
     return {
         "id": img.id,
@@ -52,3 +78,193 @@ async def upload_training_image(
         "product_id": img.product_id,
         "purpose": img.purpose,
     }
+
+
+class EntryTooLarge(Exception):
+    pass
+
+
+def _log_failure(future: Future) -> None:
+    """Done-callback: feil i bakgrunnsjobber skal synes i loggen, ikke forsvinne med futuren."""
+    error = future.exception()
+    if error is not None:
+        print(f"[training] Background task failed: {error!r}")
+
+
+def _submit(fn: Callable, *args) -> Future:
+    future = _derivative_pool.submit(fn, *args)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def _stream_to_training_dir(src: BinaryIO, suffix: str, max_bytes: int = BULK_MAX_ENTRY_BYTES) -> Tuple[Path, str]:
+    """Kopier en filstrøm til TRAINING_DIR i biter uten å lese alt i minnet.
+
+    Returnerer (sti, sha256). Går kopieringen galt (for stor, ødelagt ZIP-oppføring)
+    slettes .part-filen.
+    """
+    save_path = TRAINING_DIR / f"{uuid.uuid4().hex}{suffix}"
+    tmp_path = save_path.with_name(save_path.name + ".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while chunk := src.read(COPY_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise EntryTooLarge(f"over {max_bytes} bytes")
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_path, save_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return save_path, digest.hexdigest()
+
+
+def make_training_derivatives(image_path: Path) -> None:
+    """Lag nedskalerte thumbnail/preview-varianter av et treningsbilde."""
+    import cv2  # lazy: ikke krev OpenCV for selve opplastingen
+
+    img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+    if img is None:
+        print(f"[training] Could not decode {image_path.name} for thumbnails")
+        return
+
+    DERIVATIVES_DIR.mkdir(parents=True, exist_ok=True)
+    # Største variant først, så skaleres de mindre ned fra den
+    for name, max_side in sorted(DERIVATIVE_SIZES.items(), key=lambda kv: -kv[1]):
+        height, width = img.shape[:2]
+        scale = max_side / max(height, width)
+        if scale < 1:
+            img = cv2.resize(img, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+        out_path = DERIVATIVES_DIR / f"{image_path.stem}_{name}.jpg"
+        cv2.imwrite(str(out_path), img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+
+
+def index_training_image(image_path: Path) -> None:
+    """Legg et nytt treningsbilde inn i datasett-manifestet (kjøres i bakgrunnen)."""
+    index_training_images([image_path])
+
+
+def index_training_images(image_paths: List[Path]) -> None:
+    """Legg en batch treningsbilder inn i manifestet: én tilkobling, én transaksjon."""
+    if dataset_manifest is None or not image_paths:
+        return
+    conn = dataset_manifest.open_manifest()
+    try:
+        dataset_manifest.upsert_many(conn, image_paths)
+    finally:
+        conn.close()
+
+
+def _iter_upload_images(upload: UploadFile, skipped: List[dict]):
+    """Yield (source_name, suffix, stream) for each image in a plain file or ZIP upload."""
+    suffix = Path(upload.filename or "").suffix.lower()
+    if suffix == ".zip" or upload.content_type in ("application/zip", "application/x-zip-compressed"):
+        try:
+            archive = zipfile.ZipFile(upload.file)
+        except zipfile.BadZipFile:
+            skipped.append({"name": upload.filename, "reason": "invalid zip"})
+            return
+        with archive:
+            for info in archive.infolist():
+                entry_suffix = Path(info.filename).suffix.lower()
+                if info.is_dir() or entry_suffix not in IMAGE_SUFFIXES:
+                    continue
+                if info.file_size > BULK_MAX_ENTRY_BYTES:
+                    skipped.append({"name": info.filename, "reason": "too large"})
+                    continue
+                with archive.open(info) as entry:
+                    yield info.filename, entry_suffix, entry
+        return
+
+    if suffix not in IMAGE_SUFFIXES:
+        skipped.append({"name": upload.filename, "reason": "unsupported file type"})
+        return
+    yield upload.filename, suffix, upload.file
+
+
+@router.post("/upload-bulk")
+def upload_training_images_bulk(
+    files: List[UploadFile] = File(...),
+    producer_id: Optional[int] = Form(None),
+    product_id: Optional[int] = Form(None),
+    purpose: Optional[str] = Form(None),
+    notes: Optional[str] = Form(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Last opp mange treningsbilder på én gang (flere filer og/eller ZIP-arkiv).
+    Bildene strømmes til training_data/, radene lagres i batcher og
+    thumbnails lages i bakgrunnen. Like bilder (samme innhold i opplastingen,
+    eller allerede i datasett-manifestet) lagres bare én gang.
+    """
+    ids: List[int] = []
+    skipped: List[dict] = []
+    batch: List[models.TrainingImage] = []
+    seen: Set[str] = set()
+
+    def flush_batch():
+        if not batch:
+            return
+        db.add_all(batch)
+        db.flush()
+        ids.extend(img.id for img in batch)
+        paths = [Path(img.file_path) for img in batch]  # før commit: den utløper attributtene
+        db.commit()
+        # manifestet oppdateres per batch, ikke per bilde
+        _submit(index_training_images, paths)
+        batch.clear()
+
+    # én manifest-tilkobling per forespørsel for duplikatsjekken
+    manifest = dataset_manifest.open_manifest() if dataset_manifest is not None else None
+    try:
+        for upload in files:
+            for source_name, suffix, stream in _iter_upload_images(upload, skipped):
+                try:
+                    save_path, sha256 = _stream_to_training_dir(stream, suffix)
+                except EntryTooLarge:
+                    skipped.append({"name": source_name, "reason": "too large"})
+                    continue
+                except (zipfile.BadZipFile, EOFError, zlib.error) as e:
+                    skipped.append({"name": source_name, "reason": f"unreadable: {e}"})
+                    continue
+                if save_path.stat().st_size == 0:
+                    save_path.unlink()
+                    skipped.append({"name": source_name, "reason": "empty file"})
+                    continue
+                if sha256 in seen or (manifest is not None and dataset_manifest.has_sha256(manifest, sha256)):
+                    save_path.unlink()
+                    skipped.append({"name": source_name, "reason": "duplicate"})
+                    continue
+                seen.add(sha256)
+
+                batch.append(
+                    models.TrainingImage(
+                        producer_id=producer_id,
+                        product_id=product_id,
+                        purpose=purpose,
+                        file_path=str(save_path),
+                        notes=notes,
+                    )
+                )
+                _submit(make_training_derivatives, save_path)
+                if len(batch) >= BULK_COMMIT_BATCH:
+                    flush_batch()
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+    flush_batch()
+
+    if not ids and skipped:
+        raise HTTPException(status_code=400, detail={"message": "Ingen gyldige bilder", "skipped": skipped})
+
+    return {
+        "count": len(ids),
+        "ids": ids,
+        "skipped": skipped,
+        "producer_id": producer_id,
+        "product_id": product_id,
+        "purpose": purpose,
+    }